@@ -0,0 +1,268 @@
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from tqdm import tqdm
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+
+HIST_BINS = 256
+HIST_MAX = 4096  # 12ビットデータ → ビン幅 16
+STATS_SUFFIX = ".stats.npz"
+DEFAULT_BLOCK_ROWS = 8
+
+class BandStatsAccumulator:
+    """
+    行ブロックを1回ずつ流し込み、バンドごとの統計量を集計する。
+
+    - バンドごとに12ビットの全階調 (HIST_MAX 段階) の度数を数え、和・二乗和・パーセンタイルは
+      この度数分布から正確に求める（画素値の二乗などの一時配列を作らない）。
+    - HIST_MAX 以上の値は最上位の階調として数える（min/max は実際の値を保持する）。
+    - 同じバンド数の集計同士は `merge` で結合できる（並列集計用）。
+
+    Args:
+        bands (int): スペクトルのバンド数。
+    """
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.count = 0
+        self.min = np.full(bands, np.iinfo(np.uint16).max, dtype=np.uint16)
+        self.max = np.zeros(bands, dtype=np.uint16)
+        self.levels = np.zeros((bands, HIST_MAX), dtype=np.int64)
+        self._offsets = (np.arange(bands) * HIST_MAX)[None, :, None]
+
+    def update(self, block):
+        """
+        BIL形式の行ブロックを集計に加える。
+
+        Args:
+            block (numpy.ndarray): (rows, bands, width) の uint16 配列。
+        """
+        rows, _, width = block.shape
+        self.count += rows * width
+        np.minimum(self.min, block.min(axis=(0, 2)), out=self.min)
+        np.maximum(self.max, block.max(axis=(0, 2)), out=self.max)
+        index = np.minimum(block, HIST_MAX - 1) + self._offsets
+        self.levels += np.bincount(index.ravel(), minlength=self.bands * HIST_MAX).reshape(self.bands, HIST_MAX)
+
+    def merge(self, other):
+        """
+        別の集計を結合する。
+
+        Args:
+            other (BandStatsAccumulator): 結合する集計。
+
+        Returns:
+            BandStatsAccumulator: self。
+        """
+        self.count += other.count
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        self.levels += other.levels
+        return self
+
+    def result(self):
+        """
+        集計結果を返す。
+
+        Returns:
+            dict: count, min, max, mean, std, p1, p99（それぞれバンド数の長さの配列）と
+                hist（(bands, HIST_BINS) の固定ビンのヒストグラム）。
+        """
+        values = np.arange(HIST_MAX, dtype=np.float64)
+        count = max(self.count, 1)
+        mean = self.levels @ values / count
+        variance = np.maximum(self.levels @ values ** 2 / count - mean ** 2, 0)
+        return {
+            "count": np.int64(self.count),
+            "min": self.min.copy(),
+            "max": self.max.copy(),
+            "mean": mean,
+            "std": np.sqrt(variance),
+            "hist": self.levels.reshape(self.bands, HIST_BINS, -1).sum(axis=-1).astype(np.uint32),
+            "p1": histogram_percentile(self.levels, 1),
+            "p99": histogram_percentile(self.levels, 99),
+        }
+
+def histogram_percentile(hist, q):
+    """
+    0〜HIST_MAX を等分した固定ビンのヒストグラムからパーセンタイルを求める（ビン内は線形補間）。
+
+    Args:
+        hist (numpy.ndarray): (bands, ビン数) のヒストグラム。
+        q (float): パーセンタイル (0-100)。
+
+    Returns:
+        numpy.ndarray: (bands,) の float64 配列。
+    """
+    bin_width = HIST_MAX / hist.shape[-1]
+    cumulative = np.cumsum(hist, axis=-1, dtype=np.float64)
+    total = cumulative[..., -1:]
+    target = q / 100 * total
+    index = np.minimum((cumulative < target).sum(axis=-1), hist.shape[-1] - 1)
+    below = np.where(index > 0, np.take_along_axis(cumulative, np.maximum(index - 1, 0)[..., None], -1)[..., 0], 0)
+    in_bin = np.take_along_axis(hist, index[..., None], -1)[..., 0]
+    fraction = np.where(in_bin > 0, (target[..., 0] - below) / np.maximum(in_bin, 1), 0)
+    return (index + np.clip(fraction, 0, 1)) * bin_width
+
+def compute_band_stats(cube, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    NH9キューブを行ブロック単位で1回だけ走査し、バンドごとの統計量を計算する。
+
+    Args:
+        cube (NH9Cube): 入力のNH9キューブ（`PackedNH9Cube` も可）。
+        block_rows (int, optional): 1ブロックあたりの行数。デフォルトは8。
+
+    Returns:
+        dict: `BandStatsAccumulator.result` の集計結果。
+    """
+    accumulator = BandStatsAccumulator(cube.bands)
+    buffer = np.empty((block_rows, cube.bands, cube.width), dtype=np.uint16)
+    for start in range(0, cube.height, block_rows):
+        stop = min(start + block_rows, cube.height)
+        accumulator.update(cube.read_rows(start, stop, out=buffer[:stop - start]))
+    return accumulator.result()
+
+def accumulate_bil(data, accumulator=None, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    メモリ上のBIL配列を行ブロックごとに集計に加える（読み込み済みのデータを再走査せずに集計する場合に使う）。
+
+    Args:
+        data (numpy.ndarray): (rows, bands, width) の uint16 配列（転置ビューも可）。
+        accumulator (BandStatsAccumulator, optional): 加算先の集計。None の場合は新しく作成する。
+        block_rows (int, optional): 1ブロックあたりの行数。デフォルトは8。
+
+    Returns:
+        BandStatsAccumulator: 集計。
+    """
+    if accumulator is None:
+        accumulator = BandStatsAccumulator(data.shape[1])
+    for start in range(0, data.shape[0], block_rows):
+        accumulator.update(data[start:start + block_rows])
+    return accumulator
+
+def stats_path(nh9_path):
+    """
+    NH9ファイルに対応する統計量のサイドカーファイルのパスを返す。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+
+    Returns:
+        str: 「元のファイル名.stats.npz」形式のパス。
+    """
+    return nh9_path + STATS_SUFFIX
+
+def save_band_stats(nh9_path, stats):
+    """
+    統計量をNH9ファイルの隣にサイドカーファイルとして保存する。
+
+    - 入力ファイルのサイズと更新時刻も保存し、読み込み時に古い統計量を検出できるようにする。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        stats (dict): `compute_band_stats` の集計結果。
+
+    Returns:
+        str: 保存したサイドカーファイルのパス。
+    """
+    stat = os.stat(nh9_path)
+    path = stats_path(nh9_path)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns, **stats)
+    os.replace(tmp_path, path)
+    return path
+
+def load_band_stats(nh9_path):
+    """
+    NH9ファイルの統計量をサイドカーファイルから読み込む。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+
+    Returns:
+        dict or None: 統計量。サイドカーファイルがない、または入力ファイルより古い場合は None。
+    """
+    path = stats_path(nh9_path)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(nh9_path)
+    with np.load(path) as data:
+        if int(data["source_size"]) != stat.st_size or int(data["source_mtime_ns"]) != stat.st_mtime_ns:
+            return None
+        return {key: data[key] for key in data.files if not key.startswith("source_")}
+
+def write_stats_group(group, stats):
+    """
+    統計量をHDF5のグループに小さなデータセットとして書き込む。
+
+    Args:
+        group (h5py.Group): 書き込み先のグループ。
+        stats (dict): `compute_band_stats` の集計結果。
+
+    Returns:
+        None
+    """
+    for key, value in stats.items():
+        if key in group:
+            del group[key]
+        group.create_dataset(key, data=value)
+
+def read_stats_group(group):
+    """
+    `write_stats_group` で書き込んだ統計量を読み込む。
+
+    Args:
+        group (h5py.Group): 統計量のグループ。
+
+    Returns:
+        dict: 統計量。
+    """
+    return {key: group[key][()] for key in group}
+
+def build_stats_file(nh9_path, height=HEIGHT, width=WIDTH, bands=BANDS, force=False):
+    """
+    1つのNH9ファイルの統計量を計算してサイドカーファイルに保存する（プロセスプールのワーカーからも呼ばれる）。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        force (bool, optional): 最新のサイドカーファイルがあっても再計算するか。
+
+    Returns:
+        str or None: 保存したサイドカーファイルのパス。最新のため再計算しなかった場合は None。
+    """
+    if not force and load_band_stats(nh9_path) is not None:
+        return None
+    return save_band_stats(nh9_path, compute_band_stats(NH9Cube(nh9_path, height, width, bands)))
+
+if __name__ == "__main__":
+    """
+    指定したフォルダ以下（またはファイル）の .nh9 ファイルごとにバンド統計量のサイドカーファイルを作成する。
+
+    - 各ファイルは1回だけ走査し、バンドごとの min/max/mean/std、固定ビンのヒストグラム、1/99パーセンタイルを保存する。
+    - 最新のサイドカーファイルがあるファイルはスキップする（--force で再計算）。
+    """
+    parser = argparse.ArgumentParser(description="NH9ファイルのバンド統計量のサイドカーファイルを作成する。")
+    parser.add_argument("paths", nargs="+", help=".nh9 ファイル、またはそれらを含むフォルダ。")
+    parser.add_argument("--workers", type=int, default=1, help="ワーカープロセス数。")
+    parser.add_argument("--force", action="store_true", help="最新のサイドカーファイルがあっても再計算する。")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.nh9"), recursive=True)))
+        else:
+            files.append(path)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(build_stats_file, f, force=args.force): f for f in files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Computing band stats", unit="file"):
+            try:
+                future.result()
+            except Exception as e:
+                tqdm.write(f"エラー: {futures[future]} の統計量の計算中に問題が発生しました: {e}")
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import itertools
+import numpy as np
+import h5py
+from nh9reader import HEIGHT, WIDTH, BANDS
+from mainCUI import (LAYOUTS, CHUNK_PRESETS, hdf5_storage_options, convert_nh9_to_npy, create_capture_dataset,
+                     prepare_capture)
+from pack12 import unpack12
+from synth_nh9 import synthetic_cube
+
+def bench_setting(bil_data, layout, chunks, compression, gzip_level, shuffle, reads, workdir, pack=False):
+    """
+    1つの保存設定について、圧縮率・書き込み速度・ランダム読み出しの遅延を測定する。
+
+    Args:
+        bil_data (numpy.ndarray): (height, bands, width) の入力データ。
+        layout (str): 保存形式 ("bil" または "hwc")。
+        chunks (str or tuple): チャンクのプリセット名またはチャンク形状。
+        compression (str): 圧縮方式。
+        gzip_level (int): gzip の圧縮レベル。
+        shuffle (bool): shuffle フィルタを使用するか。
+        reads (int): ランダム読み出しの回数。
+        workdir (str): 一時ファイルを書き込むフォルダ。
+        pack (bool, optional): 12ビット詰めを前処理に使うか。読み出し時間には展開時間も含む。
+            読み出しは HDF5 のチャンクキャッシュを無効にして測定する（毎回チャンクを展開する）。
+
+    Returns:
+        dict: 測定結果。
+    """
+    height, bands, width = bil_data.shape
+    data = np.ascontiguousarray(bil_data.transpose(0, 2, 1)) if layout == "hwc" else bil_data
+    storage = hdf5_storage_options(layout, chunks, compression, gzip_level, shuffle, height, width, bands, pack)
+    path = os.path.join(workdir, "bench.h5")
+
+    start = time.perf_counter()
+    with h5py.File(path, "w") as hdf5_file:
+        create_capture_dataset(hdf5_file, "capture", prepare_capture(data, storage), storage)
+    write_seconds = time.perf_counter() - start
+    file_size = os.path.getsize(path)
+
+    rng = random.Random(0)
+    band_latencies = []
+    patch_latencies = []
+    # チャンクキャッシュ (既定 1 MiB) に収まるチャンクだけ繰り返し読み出しが速く見えないよう、キャッシュを無効にする
+    with h5py.File(path, "r", rdcc_nbytes=0) as hdf5_file:
+        dataset = hdf5_file["capture"]
+        for _ in range(reads):
+            band = rng.randrange(bands)
+            start = time.perf_counter()
+            if layout == "bil":
+                _ = unpack12(dataset[:, band, :], width) if pack else dataset[:, band, :]
+            elif pack:
+                _ = unpack12(dataset[:, :, band // 2 * 3:band // 2 * 3 + 3], 2)[:, :, band % 2]
+            else:
+                _ = dataset[:, :, band]
+            band_latencies.append(time.perf_counter() - start)
+
+            row, col = rng.randrange(max(1, height - 64)), rng.randrange(max(1, width - 64)) // 2 * 2
+            start = time.perf_counter()
+            if layout == "bil" and pack:
+                _ = unpack12(dataset[row:row + 64, :, col // 2 * 3:(col + 64) // 2 * 3], 64)
+            elif layout == "bil":
+                _ = dataset[row:row + 64, :, col:col + 64]
+            elif pack:
+                _ = unpack12(dataset[row:row + 64, col:col + 64, :], bands)
+            else:
+                _ = dataset[row:row + 64, col:col + 64, :]
+            patch_latencies.append(time.perf_counter() - start)
+    os.remove(path)
+
+    return {
+        "layout": layout,
+        "chunks": list(storage["chunks"]),
+        "compression": compression if compression != "gzip" else f"gzip-{gzip_level}",
+        "shuffle": shuffle,
+        "pack12": pack,
+        "ratio": data.nbytes / file_size,
+        "write_mb_s": data.nbytes / 2**20 / write_seconds,
+        "band_read_ms": 1000 * float(np.median(band_latencies)),
+        "patch_read_ms": 1000 * float(np.median(patch_latencies)),
+    }
+
+if __name__ == "__main__":
+    """
+    HDF5の保存設定（保存形式・チャンク形状・圧縮方式）ごとに、圧縮率・書き込み速度 (MB/s)・
+    ランダムなバンド/パッチ読み出しの遅延を測定して表示する。
+
+    - NH9ファイルを指定しない場合は合成データを使用する。
+    """
+    parser = argparse.ArgumentParser(description="HDF5保存設定のベンチマーク。")
+    parser.add_argument("nh9_file", nargs="?", help="入力に使うNH9ファイル（省略時は合成データ）。")
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--bands", type=int, default=BANDS)
+    parser.add_argument("--gzip-levels", default="1,4", help="測定する gzip レベル（カンマ区切り）。")
+    parser.add_argument("--reads", type=int, default=20, help="ランダム読み出しの回数。")
+    parser.add_argument("--pack12", action="store_true", help="12ビット詰めを前処理に使う設定も測定する。")
+    parser.add_argument("--json", help="結果を書き出すJSONファイルのパス。")
+    args = parser.parse_args()
+
+    if args.nh9_file:
+        bil_data = convert_nh9_to_npy(args.nh9_file, "bil", args.height, args.width, args.bands)
+        if bil_data is None:
+            raise SystemExit(1)
+    else:
+        bil_data = synthetic_cube(args.height, args.width, args.bands)
+
+    codecs = [("gzip", int(level)) for level in args.gzip_levels.split(",")] + [("lzf", 0), ("none", 0)]
+    packings = (False, True) if args.pack12 else (False,)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for layout, chunks, (compression, level), pack in itertools.product(LAYOUTS, CHUNK_PRESETS, codecs, packings):
+            shuffle = compression != "none"
+            result = bench_setting(bil_data, layout, chunks, compression, level, shuffle, args.reads, workdir, pack)
+            results.append(result)
+            print(f"{layout:4} {chunks:6} {result['compression']:7} {'pack12' if pack else '':6} "
+                  f"ratio {result['ratio']:5.2f}  "
+                  f"write {result['write_mb_s']:7.1f} MB/s  band {result['band_read_ms']:7.2f} ms  "
+                  f"patch {result['patch_read_ms']:7.2f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
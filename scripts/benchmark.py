@@ -0,0 +1,256 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from nh9reader import HEIGHT, WIDTH, BANDS
+from synth_nh9 import generate_dataset, generate_placeholder_tree, write_synthetic_metadata
+
+BENCHMARKS = ("hyprawread", "extract_rgb", "convert_hdf5", "extract_hsi_data", "count_tags")
+DEFAULT_TOLERANCE = 0.10
+HIGHER_IS_BETTER = ("mb_s", "files_s")
+LOWER_IS_BETTER = ("peak_rss_mb",)
+
+def bench_hyprawread(workload):
+    """hyprawread で各ファイルを開き、フレーム全体を読み込む。"""
+    from hs_to_rgbV2 import hyprawread
+    height, width, bands = workload["geometry"]
+    for file_path in workload["files"]:
+        np.array(hyprawread(file_path, width, height, bands))
+    return len(workload["files"]), sum(os.path.getsize(f) for f in workload["files"])
+
+def bench_extract_rgb(workload):
+    """hyprawread + extract_rgb で各ファイルをRGB画像に変換する（hs_to_rgbV2.py の従来の処理）。"""
+    from hs_to_rgbV2 import hyprawread, extract_rgb
+    height, width, bands = workload["geometry"]
+    for file_path in workload["files"]:
+        extract_rgb(hyprawread(file_path, width, height, bands))
+    return len(workload["files"]), sum(os.path.getsize(f) for f in workload["files"])
+
+def bench_convert_hdf5(workload):
+    """mainCUI.py の既定の設定（BIL・バンド単位のチャンク・gzip + shuffle）で日付フォルダをHDF5に変換する。"""
+    import h5py
+    from mainCUI import process_date_folder, hdf5_storage_options
+    output_root = os.path.join(workload["workdir"], "hdf5")
+    shutil.rmtree(output_root, ignore_errors=True)
+    os.makedirs(output_root)
+    storage = hdf5_storage_options(height=workload["geometry"][0], width=workload["geometry"][1],
+                                   bands=workload["geometry"][2])
+    for date_folder in workload["date_folders"]:
+        process_date_folder(date_folder, output_root, storage=storage)
+    converted = 0
+    for name in os.listdir(output_root):
+        if name.endswith(".h5"):
+            with h5py.File(os.path.join(output_root, name), "r") as hdf5_file:
+                converted += sum(1 for d in hdf5_file.values() if isinstance(d, h5py.Dataset))
+    if converted != len(workload["files"]):
+        raise RuntimeError(f"converted {converted} of {len(workload['files'])} files")
+    return converted, sum(os.path.getsize(f) for f in workload["files"])
+
+def bench_extract_hsi_data(workload):
+    """extract_id.py で空のインデックスから全ファイルを走査し、JSONに書き出す。"""
+    from extract_id import extract_hsi_data
+    output_json = os.path.join(workload["workdir"], "hsi_data_ids.json")
+    db_path = os.path.splitext(output_json)[0] + ".sqlite"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    extract_hsi_data(workload["index_root"], output_json, db_path)
+    return workload["index_files"], 0
+
+def bench_count_tags(workload):
+    """tagcount.py でメタデータのタグを集計し、グラフを画像として保存する（キャッシュなし）。"""
+    import matplotlib
+    matplotlib.use("Agg")
+    from tagcount import count_tags_and_plot
+    count_tags_and_plot(workload["metadata"], os.path.join(workload["workdir"], "charts"), cache_path=None, workers=1)
+    return 1, os.path.getsize(workload["metadata"])
+
+def peak_rss_mb():
+    """
+    このプロセスと終了した子プロセスのピークの常駐メモリ (MB) を返す（Linux では ru_maxrss は KB 単位）。
+    """
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / scale
+
+def run_benchmark(name, workload):
+    """
+    1つのベンチマークを実行する（ピークメモリを個別に測るため、新しいプロセスで呼ばれる）。
+
+    Returns:
+        dict: seconds, files, bytes, mb_s, files_s, peak_rss_mb。
+    """
+    os.environ["TQDM_DISABLE"] = "1"
+    bench = globals()[f"bench_{name}"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        files, nbytes = bench(workload)
+        seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "files": files,
+        "bytes": nbytes,
+        "mb_s": nbytes / 2**20 / seconds if nbytes else None,
+        "files_s": files / seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def prepare_workload(workdir, height=HEIGHT, width=WIDTH, bands=BANDS, locations=2, files_per_location=2,
+                     index_files=5000, metadata_records=100000, seed=0):
+    """
+    合成データ（NH9ファイル・インデックス用の空のファイル・メタデータ）を作業フォルダに生成する。
+
+    Returns:
+        dict: 各ベンチマークに渡す入力の情報。
+    """
+    data_root = os.path.join(workdir, "data")
+    files = generate_dataset(data_root, 1, locations, files_per_location, height, width, bands, seed)
+    index_root = os.path.join(workdir, "index")
+    generate_placeholder_tree(index_root, index_files)
+    metadata = os.path.join(workdir, "metadata.json")
+    write_synthetic_metadata(metadata, metadata_records, seed)
+    return {
+        "workdir": workdir,
+        "geometry": (height, width, bands),
+        "files": files,
+        "date_folders": sorted({os.path.dirname(os.path.dirname(f)) for f in files}),
+        "index_root": index_root,
+        "index_files": index_files,
+        "metadata": metadata,
+    }
+
+def run_suite(workload, names=BENCHMARKS, repeat=1):
+    """
+    ベンチマークを1つずつ新しいプロセスで実行し、repeat 回のうち最も速かった結果を返す。
+
+    Args:
+        workload (dict): `prepare_workload` の入力の情報。
+        names (sequence of str, optional): 実行するベンチマーク名。
+        repeat (int, optional): 各ベンチマークの実行回数。
+
+    Returns:
+        dict: {ベンチマーク名: 結果}。
+    """
+    results = {}
+    context = get_context("spawn")
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_benchmark, name, workload).result())
+        best = min(runs, key=lambda r: r["seconds"])
+        best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+        results[name] = best
+        throughput = f"{best['mb_s']:8.1f} MB/s" if best["mb_s"] else " " * 13
+        print(f"{name:18} {best['seconds']:8.2f} s  {throughput}  {best['files_s']:9.1f} files/s  "
+              f"peak RSS {best['peak_rss_mb']:7.1f} MB")
+    return results
+
+def environment_info():
+    """
+    結果の比較に必要な実行環境の情報を返す。
+    """
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    ベンチマーク結果を保存済みのベースラインと比較する。
+
+    - MB/s・files/s が (1 - tolerance) 倍を下回る、またはピークメモリが (1 + tolerance) 倍を超えた場合を劣化とする。
+
+    Args:
+        report (dict): 今回の結果（`run_suite` の結果を含むレポート）。
+        baseline (dict): ベースラインのレポート。
+        tolerance (float, optional): 許容する変化の割合。デフォルトは0.1。
+
+    Returns:
+        list of str: 劣化した項目の説明。
+    """
+    if list(report["geometry"]) != list(baseline.get("geometry", [])):
+        print(f"警告: ジオメトリがベースラインと異なります ({baseline.get('geometry')} -> {report['geometry']})")
+    regressions = []
+    for name, result in report["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            continue
+        for metric in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+            current, previous = result.get(metric), base.get(metric)
+            if not current or not previous:
+                continue
+            change = current / previous - 1
+            print(f"{name:18} {metric:12} {previous:10.1f} -> {current:10.1f} ({change:+.1%})")
+            if (metric in HIGHER_IS_BETTER and change < -tolerance) or (metric in LOWER_IS_BETTER and change > tolerance):
+                regressions.append(f"{name} {metric}: {previous:.1f} -> {current:.1f} ({change:+.1%})")
+    return regressions
+
+if __name__ == "__main__":
+    """
+    合成NH9データで読み込み・RGB生成・HDF5変換・インデックス作成・タグ集計の処理速度を測定し、JSONで出力する。
+
+    - 各ベンチマークは新しいプロセスで実行し、時間・MB/s・files/s・ピークメモリを測る（入力はページキャッシュに載った状態）。
+    - --baseline を指定した場合は結果を比較し、劣化があれば終了コード 1 で終了する。
+    """
+    parser = argparse.ArgumentParser(description="合成NH9データによるベンチマーク。")
+    parser.add_argument("--small", action="store_true", help="小さいジオメトリ (270 × 512 × 151) で測定する。")
+    parser.add_argument("--locations", type=int, default=2, help="場所フォルダ数。")
+    parser.add_argument("--files", type=int, default=2, help="場所フォルダあたりのNH9ファイル数。")
+    parser.add_argument("--index-files", type=int, default=5000, help="インデックス作成の対象ファイル数。")
+    parser.add_argument("--metadata-records", type=int, default=100000, help="タグ集計のメタデータの件数。")
+    parser.add_argument("--only", help="実行するベンチマーク（カンマ区切り）: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=1, help="各ベンチマークの実行回数（最速の結果を使う）。")
+    parser.add_argument("--workdir", help="合成データの作業フォルダ（省略時は一時フォルダを作成して削除する）。")
+    parser.add_argument("--output", help="結果を書き出すJSONファイルのパス。")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイルのパス。")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="劣化とみなす変化の割合。")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else BENCHMARKS
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"不明なベンチマークです: {', '.join(unknown)}")
+    height, width = (HEIGHT // 4, WIDTH // 4) if args.small else (HEIGHT, WIDTH)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nh9bench-")
+    try:
+        print(f"Generating synthetic data in {workdir}")
+        workload = prepare_workload(workdir, height, width, BANDS, args.locations, args.files,
+                                    args.index_files, args.metadata_records)
+        report = {
+            "geometry": [height, width, BANDS],
+            "environment": environment_info(),
+            "benchmarks": run_suite(workload, names, args.repeat),
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Results saved to {args.output}")
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions against the baseline")
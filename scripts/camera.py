@@ -0,0 +1,75 @@
+import os
+import re
+
+DEFAULT_GEOMETRY = (1080, 2048, 151)  # カメラの仕様 (height, width, bands)
+GEOMETRY_ENV = "HSI_GEOMETRY"
+RGB_BANDS = ((54, 70), (30, 40), (20, 30))  # RGB 合成に使う (開始, 終了) のバンド範囲: R, G, B
+FILENAME_PATTERN = re.compile(
+    r"Scan-d\(s(?P<scan>.+),g(?P<gain>\d+),(?P<exposure>[\d.]+ms),(?P<wavelength>\d+-\d+)\)_(?P<datetime>\d+_\d+)\.nh9"
+)
+
+def parse_geometry(value):
+    """
+    ジオメトリの指定を解析する。
+
+    Args:
+        value (str): "1080,2048,151" 形式（高さ, 幅, バンド数）。
+
+    Returns:
+        tuple: (height, width, bands)。
+
+    Raises:
+        ValueError: 形式が不正、または0以下の値を含む場合。
+    """
+    try:
+        height, width, bands = (int(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError(f"不正なジオメトリの指定です: {value} (高さ,幅,バンド数 の形式で指定してください)")
+    if min(height, width, bands) <= 0:
+        raise ValueError(f"不正なジオメトリの指定です: {value}")
+    return height, width, bands
+
+def camera_geometry():
+    """
+    各スクリプトが共有するカメラのジオメトリを返す。
+
+    - 環境変数 HSI_GEOMETRY（"1080,2048,151" 形式）が設定されている場合はその値を使う
+      （`hsi.py --geometry` は `set_geometry` で設定してからサブコマンドのモジュールを読み込む）。
+
+    Returns:
+        tuple: (height, width, bands)。
+    """
+    value = os.environ.get(GEOMETRY_ENV)
+    return parse_geometry(value) if value else DEFAULT_GEOMETRY
+
+def set_geometry(height, width, bands):
+    """
+    以降に読み込むモジュールが使うカメラのジオメトリを設定する。
+
+    - nh9reader など HEIGHT/WIDTH/BANDS を読み込むモジュールより先に呼ぶ必要がある。
+    - 環境変数 HSI_GEOMETRY にも設定し、spawn で起動する子プロセスにも引き継ぐ。
+
+    Args:
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+    """
+    global HEIGHT, WIDTH, BANDS
+    HEIGHT, WIDTH, BANDS = height, width, bands
+    os.environ[GEOMETRY_ENV] = f"{height},{width},{bands}"
+
+def parse_filename(file_name):
+    """
+    ファイル名からメタデータを解析する。
+
+    Args:
+        file_name (str): 解析対象のNH9ファイル名。
+
+    Returns:
+        dict: 解析されたメタデータ（scan, gain, exposure, wavelength, datetime）。
+              マッチしない場合は空の辞書を返す。
+    """
+    match = FILENAME_PATTERN.match(file_name)
+    return match.groupdict() if match else {}
+
+HEIGHT, WIDTH, BANDS = camera_geometry()
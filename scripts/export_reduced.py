@@ -0,0 +1,310 @@
+import os
+import json
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import h5py
+from tqdm import tqdm
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+
+DEFAULT_BLOCK_ROWS = 64
+FORMATS = ("h5", "npy")
+REDUCED_SUFFIX = ".reduced"
+
+def parse_band_ranges(value, bands=BANDS):
+    """
+    バンド範囲の指定を解析する。
+
+    Args:
+        value (str or None): "20-70" や "20-70,100-120" 形式（終了バンドを含まない）。None の場合は全バンド。
+        bands (int): スペクトルのバンド数。
+
+    Returns:
+        list of tuple: [(開始バンド, 終了バンド)] のリスト。
+
+    Raises:
+        ValueError: 形式が不正、または範囲がバンド数を超える場合。
+    """
+    if not value:
+        return [(0, bands)]
+    ranges = []
+    for part in value.split(","):
+        start, sep, stop = part.partition("-")
+        start, stop = int(start), int(stop) if sep else int(start) + 1
+        if not 0 <= start < stop <= bands:
+            raise ValueError(f"不正なバンド範囲です: {part} (バンド数 {bands})")
+        ranges.append((start, stop))
+    return ranges
+
+def output_band_edges(band_ranges, spectral_bin):
+    """
+    各出力バンドが平均する入力バンドの範囲を求める。
+
+    - 各バンド範囲を先頭から spectral_bin 本ずつまとめる（割り切れない末尾は残りの本数で平均する）。
+
+    Args:
+        band_ranges (list of tuple): [(開始バンド, 終了バンド)] のリスト。
+        spectral_bin (int): まとめるバンド数。
+
+    Returns:
+        numpy.ndarray: (出力バンド数, 2) の [開始バンド, 終了バンド) の配列。
+    """
+    edges = []
+    for start, stop in band_ranges:
+        for band in range(start, stop, spectral_bin):
+            edges.append((band, min(band + spectral_bin, stop)))
+    return np.array(edges, dtype=np.int64)
+
+def reduced_shape(height, width, band_edges, spatial_bin):
+    """
+    縮小後のキューブの形状を返す（割り切れない端の行・列は切り捨てる）。
+
+    Returns:
+        tuple: (height // spatial_bin, 出力バンド数, width // spatial_bin) の BIL 形式の形状。
+    """
+    return (height // spatial_bin, len(band_edges), width // spatial_bin)
+
+def reduce_block(block, band_start, band_edges, spatial_bin):
+    """
+    BIL形式の行ブロックを、スペクトル方向・空間方向にまとめる（ベクトル化した累積和と reshape による集約）。
+
+    Args:
+        block (numpy.ndarray): (rows, バンド数, width) の uint16 配列（rows は spatial_bin の倍数）。
+        band_start (int): block の先頭バンドの番号。
+        band_edges (numpy.ndarray): block に含まれる出力バンドの (n, 2) の [開始, 終了) の配列。
+        spatial_bin (int): まとめる画素数（縦横）。
+
+    Returns:
+        numpy.ndarray: (rows // spatial_bin, n, width // spatial_bin) の uint16 配列（四捨五入した平均値）。
+    """
+    rows, _, width = block.shape
+    cumulative = np.zeros((rows, block.shape[1] + 1, width), dtype=np.uint32)
+    np.cumsum(block, axis=1, dtype=np.uint32, out=cumulative[:, 1:])
+    sums = cumulative[:, band_edges[:, 1] - band_start] - cumulative[:, band_edges[:, 0] - band_start]
+
+    out_rows, out_width = rows // spatial_bin, width // spatial_bin
+    if spatial_bin > 1:
+        sums = sums[:out_rows * spatial_bin, :, :out_width * spatial_bin]
+        sums = sums.reshape(out_rows, spatial_bin, -1, out_width, spatial_bin).sum(axis=(1, 4), dtype=np.uint32)
+
+    count = ((band_edges[:, 1] - band_edges[:, 0]) * spatial_bin * spatial_bin).astype(np.uint32)[None, :, None]
+    return ((sums + count // 2) // count).astype(np.uint16)
+
+def reduced_path(nh9_path, output_dir, fmt, input_root=None):
+    """
+    NH9ファイルに対応する出力ファイルのパスを返す（input_root からの相対的なフォルダ構成を維持する）。
+
+    Returns:
+        str: 「<出力フォルダ>/<相対フォルダ>/<元のファイル名>.reduced.<h5 | npy>」形式のパス。
+    """
+    relative = os.path.relpath(nh9_path, input_root) if input_root else os.path.basename(nh9_path)
+    return os.path.join(output_dir, relative + f"{REDUCED_SUFFIX}.{fmt}")
+
+def reduced_metadata(nh9_path, band_ranges, spectral_bin, spatial_bin):
+    """
+    縮小キューブに保存するメタデータ（バンドの対応表と縮小率）を作成する。
+
+    Args:
+        nh9_path (str): 入力のNH9ファイルのパス。
+        band_ranges (list of tuple): [(開始バンド, 終了バンド)] のリスト。
+        spectral_bin (int): まとめるバンド数 N。
+        spatial_bin (int): まとめる画素数 M (M × M)。
+
+    Returns:
+        dict: source, band_ranges, band_edges, spectral_bin, spatial_bin, layout。
+    """
+    return {
+        "source": os.path.basename(nh9_path),
+        "band_ranges": [list(r) for r in band_ranges],
+        "band_edges": output_band_edges(band_ranges, spectral_bin).tolist(),
+        "spectral_bin": spectral_bin,
+        "spatial_bin": spatial_bin,
+        "layout": "bil",
+    }
+
+def export_reduced(nh9_path, output_path, band_ranges=None, spectral_bin=1, spatial_bin=1,
+                   height=HEIGHT, width=WIDTH, bands=BANDS, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    NH9ファイルを行ブロック単位で1回だけ走査し、バンド範囲の抽出・スペクトル方向の平均・空間方向の平均を行った
+    縮小キューブを uint16 の HDF5 (.h5) または NPY (.npy) として保存する。
+
+    - 各バンド範囲は行ごとに必要なバンドのみを直接読み込む（他のバンドは読まない）。
+    - 出力は BIL 形式 (height / M, 出力バンド数, width / M)。各出力バンドは入力バンドの [開始, 終了) の平均で、
+      対応表 (band_edges) を HDF5 の属性、NPY の場合は「<出力ファイル名>.json」に保存する。
+    - 一時ファイルに書き込んでから置き換えるため、中断しても壊れたファイルは残らない。
+
+    Args:
+        nh9_path (str): 入力のNH9ファイルのパス。
+        output_path (str): 出力ファイルのパス（拡張子 .h5 または .npy）。
+        band_ranges (list of tuple, optional): [(開始バンド, 終了バンド)] のリスト。デフォルトは全バンド。
+        spectral_bin (int, optional): まとめるバンド数 N。デフォルトは1。
+        spatial_bin (int, optional): まとめる画素数 M (M × M)。デフォルトは1。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        block_rows (int, optional): 1ブロックあたりの行数（spatial_bin の倍数に切り上げる）。
+
+    Returns:
+        str: 保存したファイルのパス。
+    """
+    band_ranges = band_ranges or [(0, bands)]
+    metadata = reduced_metadata(nh9_path, band_ranges, spectral_bin, spatial_bin)
+    band_edges = output_band_edges(band_ranges, spectral_bin)
+    shape = reduced_shape(height, width, band_edges, spatial_bin)
+    block_rows = -(-block_rows // spatial_bin) * spatial_bin
+
+    cube = NH9Cube(nh9_path, height, width, bands)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = output_path + ".tmp" + os.path.splitext(output_path)[1]
+    hdf5_file = output = None
+    try:
+        if output_path.endswith(".npy"):
+            output = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint16, shape=shape)
+        else:
+            hdf5_file = h5py.File(tmp_path, "w")
+            chunks = (max(1, min(64, shape[0])), 1, max(1, shape[2]))
+            output = hdf5_file.create_dataset("data", shape=shape, dtype=np.uint16, chunks=chunks,
+                                              compression="gzip", compression_opts=4, shuffle=True)
+            for key, value in metadata.items():
+                output.attrs[key] = value
+
+        out_band = 0
+        for start, stop in band_ranges:
+            edges = output_band_edges([(start, stop)], spectral_bin)
+            buffer = np.empty((block_rows, stop - start, width), dtype=np.uint16)
+            for row in range(0, shape[0] * spatial_bin, block_rows):
+                row_stop = min(row + block_rows, shape[0] * spatial_bin)
+                block = cube.read_rows(row, row_stop, start, stop, out=buffer[:row_stop - row])
+                output[row // spatial_bin:row_stop // spatial_bin, out_band:out_band + len(edges)] = \
+                    reduce_block(block, start, edges, spatial_bin)
+            out_band += len(edges)
+    except BaseException:
+        # 書き込み途中の一時ファイルを残さない
+        if hdf5_file is not None:
+            hdf5_file.close()
+        del output
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hdf5_file is None:
+        output.flush()
+    else:
+        hdf5_file.close()
+    del output
+
+    if hdf5_file is None:
+        # 中断しても古いメタデータと新しいキューブの組が最新と判定されないよう、キューブの後でサイドカーを置き換える
+        with open(output_path + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(tmp_path, output_path)
+        os.replace(output_path + ".json.tmp", output_path + ".json")
+    else:
+        os.replace(tmp_path, output_path)
+    return output_path
+
+def load_reduced(path):
+    """
+    `export_reduced` で保存した縮小キューブを読み込む。
+
+    Args:
+        path (str): .h5 または .npy のファイルのパス。
+
+    Returns:
+        tuple: ((height / M, 出力バンド数, width / M) の uint16 配列（NPY はメモリマップ）, メタデータの辞書)。
+    """
+    metadata = read_reduced_metadata(path)
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r"), metadata
+    with h5py.File(path, "r") as hdf5_file:
+        return hdf5_file["data"][...], metadata
+
+def read_reduced_metadata(path):
+    """
+    縮小キューブのメタデータ（HDF5 はデータセットの属性、NPY は「<ファイル名>.json」）のみを読み込む。
+
+    Args:
+        path (str): .h5 または .npy のファイルのパス。
+
+    Returns:
+        dict: `reduced_metadata` と同じキーを持つ辞書。
+    """
+    if path.endswith(".npy"):
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            return json.load(f)
+    with h5py.File(path, "r") as hdf5_file:
+        return {key: value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value
+                for key, value in hdf5_file["data"].attrs.items()}
+
+def is_up_to_date(nh9_path, output_path, band_ranges, spectral_bin, spatial_bin, bands=BANDS):
+    """
+    出力がNH9ファイルより新しく、同じバンド範囲・縮小率で作成されているかを判定する。
+
+    - 保存されたメタデータの band_edges・spectral_bin・spatial_bin を要求された値と比較する。
+      メタデータが読めない場合は最新でないとみなす。
+
+    Returns:
+        bool: 作り直す必要がない場合は True。
+    """
+    if not os.path.exists(output_path) or os.stat(output_path).st_mtime_ns < os.stat(nh9_path).st_mtime_ns:
+        return False
+    expected = reduced_metadata(nh9_path, band_ranges or [(0, bands)], spectral_bin, spatial_bin)
+    try:
+        stored = read_reduced_metadata(output_path)
+    except (OSError, KeyError, ValueError):
+        return False
+    return all(np.array_equal(np.asarray(stored.get(key)), np.asarray(expected[key]))
+               for key in ("band_edges", "spectral_bin", "spatial_bin"))
+
+def export_file(nh9_path, output_path, band_ranges, spectral_bin, spatial_bin, force=False):
+    """
+    1つのNH9ファイルを縮小して保存する（プロセスプールのワーカーから呼ばれる）。
+
+    Returns:
+        str or None: 保存したファイルのパス。出力が最新（`is_up_to_date`）のためスキップした場合は None。
+    """
+    if not force and is_up_to_date(nh9_path, output_path, band_ranges, spectral_bin, spatial_bin):
+        return None
+    return export_reduced(nh9_path, output_path, band_ranges, spectral_bin, spatial_bin)
+
+if __name__ == "__main__":
+    """
+    指定したフォルダ以下（またはファイル）の .nh9 ファイルを、バンド範囲の抽出・スペクトル方向の平均 (N バンド)・
+    空間方向の平均 (M × M 画素) で縮小し、フォルダ構成を維持して出力フォルダに保存する。
+
+    - ファイル単位でプロセスプールで並列に処理する。
+    - 出力がNH9ファイルより新しく、同じバンド範囲・縮小率で作成されているファイルはスキップする（--force で作り直す）。
+    """
+    parser = argparse.ArgumentParser(description="NH9ファイルをバンド範囲・スペクトル・空間方向に縮小して保存する。")
+    parser.add_argument("input", help=".nh9 ファイル、またはそれらを含むフォルダ。")
+    parser.add_argument("output_folder", help="縮小キューブを保存するフォルダ。")
+    parser.add_argument("--bands", help='抽出するバンド範囲 (例: "20-70" や "20-70,100-120"、終了バンドを含まない)。')
+    parser.add_argument("--spectral-bin", type=int, default=1, help="まとめるバンド数 N。")
+    parser.add_argument("--spatial-bin", type=int, default=1, help="まとめる画素数 M (M × M)。")
+    parser.add_argument("--format", choices=FORMATS, default="h5", help="出力形式。")
+    parser.add_argument("--workers", type=int, default=1, help="ワーカープロセス数。")
+    parser.add_argument("--force", action="store_true", help="出力が最新でも作り直す。")
+    args = parser.parse_args()
+
+    try:
+        ranges = parse_band_ranges(args.bands)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.spectral_bin < 1 or args.spatial_bin < 1:
+        parser.error("--spectral-bin と --spatial-bin は1以上を指定してください")
+
+    if os.path.isdir(args.input):
+        files = sorted(glob.glob(os.path.join(args.input, "**", "*.nh9"), recursive=True))
+        input_root = args.input
+    else:
+        files = [args.input]
+        input_root = None
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(export_file, f, reduced_path(f, args.output_folder, args.format, input_root),
+                                   ranges, args.spectral_bin, args.spatial_bin, args.force): f for f in files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Exporting reduced cubes", unit="file"):
+            try:
+                future.result()
+            except Exception as e:
+                tqdm.write(f"エラー: {futures[future]} の縮小中に問題が発生しました: {e}")
@@ -1,47 +1,272 @@
 import os
 import re
 import json
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from camera import parse_filename
 
-def extract_hsi_data(input_directory, output_json):
+ID_PATTERN = re.compile(r".*_(\d{8}_\d{6})\.nh9")
+DEFAULT_WORKERS = 8
+FILE_COLUMNS = ("path", "directory", "file_name", "id", "datetime_folder", "location_folder",
+                "scan", "gain", "exposure", "wavelength", "size", "mtime_ns")
+JSON_COLUMNS = ("file_name", "id", "datetime_folder", "location_folder",
+                "scan", "gain", "exposure", "wavelength", "size", "mtime_ns")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    id TEXT NOT NULL,
+    datetime_folder TEXT,
+    location_folder TEXT,
+    scan TEXT,
+    gain TEXT,
+    exposure TEXT,
+    wavelength TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_id ON files (id);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_folders ON files (datetime_folder, location_folder);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+"""
+
+def open_index(db_path):
+    """
+    SQLiteのインデックスを開く（存在しない場合はテーブルとインデックスを作成する）。
+
+    Args:
+        db_path (str): SQLiteデータベースのパス。
+
+    Returns:
+        sqlite3.Connection: 行を `sqlite3.Row` で返す接続。
+    """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+def file_record(file_name, relative_dir, stat):
+    """
+    1つのNH9ファイルのインデックスのレコードを作成する。
+
+    - ファイル名から日時ID（形式: YYYYMMDD_HHMMSS）とメタデータ（scan, gain, exposure, wavelength）を取得
+    - ディレクトリ階層から「日時フォルダ」と「場所フォルダ」を取得
+
+    Args:
+        file_name (str): NH9ファイル名。
+        relative_dir (str): 入力ディレクトリからの相対パス（直下の場合は "."）。
+        stat (os.stat_result): ファイルの stat。
+
+    Returns:
+        dict or None: FILE_COLUMNS をキーとするレコード。ファイル名に日時IDがない場合は None。
+    """
+    match = ID_PATTERN.match(file_name)
+    if not match:
+        return None
+    path_parts = [] if relative_dir == "." else relative_dir.split(os.sep)
+    metadata = parse_filename(file_name)
+    return {
+        "path": os.path.join(relative_dir, file_name),
+        "directory": relative_dir,
+        "file_name": file_name,
+        "id": match.group(1),
+        "datetime_folder": path_parts[0] if len(path_parts) > 0 else "",
+        "location_folder": path_parts[1] if len(path_parts) > 1 else "",
+        "scan": metadata.get("scan"),
+        "gain": metadata.get("gain"),
+        "exposure": metadata.get("exposure"),
+        "wavelength": metadata.get("wavelength"),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+def scan_directory(input_directory, relative_dir, known_mtime):
+    """
+    1つのディレクトリを確認し、前回から変更されていれば os.scandir で走査する（スレッドプールで実行）。
+
+    Args:
+        input_directory (str): 入力ディレクトリのパス。
+        relative_dir (str): 走査するディレクトリの相対パス。
+        known_mtime (int or None): インデックスに記録されている更新時刻。None の場合は必ず走査する。
+
+    Returns:
+        tuple: (相対パス, 現在の更新時刻, 走査したか, NH9ファイルのレコードのリスト, サブディレクトリの相対パスのリスト)。
+            走査しなかった場合、レコードとサブディレクトリは None。
+    """
+    directory = os.path.join(input_directory, relative_dir)
+    mtime_ns = os.stat(directory).st_mtime_ns
+    if mtime_ns == known_mtime:
+        return relative_dir, mtime_ns, False, None, None
+
+    records = []
+    subdirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(os.path.normpath(os.path.join(relative_dir, entry.name)))
+            elif entry.name.endswith(".nh9") and entry.is_file():
+                record = file_record(entry.name, relative_dir, entry.stat())
+                if record is not None:
+                    records.append(record)
+    return relative_dir, mtime_ns, True, records, subdirs
+
+def build_index(input_directory, db_path, workers=DEFAULT_WORKERS, rebuild=False):
+    """
+    入力ディレクトリ以下のNH9ファイルのインデックスをSQLiteデータベースに作成・更新する。
+
+    - ディレクトリ階層を1段ずつ、スレッドプールで並列に os.scandir で走査する（場所フォルダ単位で並列化される）。
+    - 更新時刻が前回の記録と同じディレクトリは走査せず、記録済みのファイルとサブディレクトリをそのまま使う。
+    - 消えたディレクトリのファイルはインデックスから削除する。
+
+    Args:
+        input_directory (str): NH9ファイルを含む親ディレクトリのパス。
+        db_path (str): SQLiteデータベースのパス。
+        workers (int, optional): 走査に使うスレッド数。デフォルトは8。
+        rebuild (bool, optional): 既存のインデックスを破棄して全ディレクトリを走査し直すか。
+
+    Returns:
+        dict: {"scanned": 走査したディレクトリ数, "skipped": 走査を省略したディレクトリ数, "files": ファイル数}。
+    """
+    root = os.path.abspath(input_directory)
+    conn = open_index(db_path)
+    try:
+        with conn:
+            stored_root = conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+            if rebuild or (stored_root is not None and stored_root["value"] != root):
+                conn.execute("DELETE FROM files")
+                conn.execute("DELETE FROM directories")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('root', ?)", (root,))
+
+        known_mtimes = {row["path"]: row["mtime_ns"] for row in conn.execute("SELECT path, mtime_ns FROM directories")}
+        known_children = {}
+        for row in conn.execute("SELECT path, parent FROM directories"):
+            known_children.setdefault(row["parent"], []).append(row["path"])
+
+        visited = set()
+        scanned = skipped = 0
+        frontier = [(".", None)]
+        insert = (f"INSERT OR REPLACE INTO files ({', '.join(FILE_COLUMNS)}) "
+                  f"VALUES ({', '.join(':' + c for c in FILE_COLUMNS)})")
+        with ThreadPoolExecutor(max_workers=workers) as executor, conn:
+            while frontier:
+                futures = [(parent, executor.submit(scan_directory, root, path, known_mtimes.get(path)))
+                           for path, parent in frontier]
+                frontier = []
+                for parent, future in futures:
+                    try:
+                        relative_dir, mtime_ns, changed, records, subdirs = future.result()
+                    except OSError as e:
+                        print(f"エラー: ディレクトリの走査中に問題が発生しました: {e}")
+                        continue
+                    visited.add(relative_dir)
+                    if changed:
+                        scanned += 1
+                        conn.execute("DELETE FROM files WHERE directory = ?", (relative_dir,))
+                        conn.executemany(insert, records)
+                        conn.execute("INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                                     (relative_dir, parent, mtime_ns))
+                    else:
+                        skipped += 1
+                        subdirs = known_children.get(relative_dir, [])
+                    frontier.extend((subdir, relative_dir) for subdir in subdirs)
+
+            removed = [(path,) for path in known_mtimes if path not in visited]
+            conn.executemany("DELETE FROM files WHERE directory = ?", removed)
+            conn.executemany("DELETE FROM directories WHERE path = ?", removed)
+
+        files = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    finally:
+        conn.close()
+    return {"scanned": scanned, "skipped": skipped, "files": files}
+
+def export_json(db_path, output_json):
+    """
+    インデックスの内容をJSONファイルに書き出す（1レコードずつ書き出すため全件をメモリに載せない）。
+
+    Args:
+        db_path (str): SQLiteデータベースのパス。
+        output_json (str): 出力するJSONファイルのパス。
+
+    Returns:
+        int: 書き出したレコード数。
+    """
+    conn = open_index(db_path)
+    count = 0
+    try:
+        with open(output_json, "w", encoding="utf-8") as f:
+            f.write("[")
+            for row in conn.execute(f"SELECT {', '.join(JSON_COLUMNS)} FROM files ORDER BY path"):
+                f.write(",\n    " if count else "\n    ")
+                f.write(json.dumps(dict(row), ensure_ascii=False))
+                count += 1
+            f.write("\n]\n" if count else "]\n")
+    finally:
+        conn.close()
+    return count
+
+def extract_hsi_data(input_directory, output_json, db_path=None, workers=DEFAULT_WORKERS):
     """
     指定したディレクトリ内の .nh9 ファイルをスキャンし、ファイル名から日時を抽出して
     階層構造に基づくフォルダ情報と共にJSONファイルに保存する。
 
-    - ファイル名から日時情報を取得（形式: YYYYMMDD_HHMMSS）
-    - ファイルのディレクトリ階層から「日時フォルダ」と「場所フォルダ」を取得
-    - 取得した情報をリストに格納し、JSONファイルとして保存
+    - インデックス (SQLite) を作成・更新してから、その内容をJSONとして書き出す。
+    - 前回から変更されていないディレクトリは走査しない。
 
     Args:
         input_directory (str): NH9ファイルを含む親ディレクトリのパス。
         output_json (str): 抽出したデータを保存するJSONファイルのパス。
+        db_path (str, optional): インデックスのSQLiteデータベースのパス。
+            デフォルトは output_json の拡張子を .sqlite に置き換えたパス。
+        workers (int, optional): 走査に使うスレッド数。
 
     Returns:
         None
     """
+    if db_path is None:
+        db_path = os.path.splitext(output_json)[0] + ".sqlite"
+    build_index(input_directory, db_path, workers)
+    export_json(db_path, output_json)
 
-    pattern = re.compile(r".*_(\d{8}_\d{6})\.nh9")
-    hsi_data = []
+    print(f"Extracted HSI data saved to {output_json}")
 
-    for root, _, files in os.walk(input_directory):
-        for file in files:
-            if file.endswith(".nh9"):
-                match = pattern.match(file)
-                if match:
-                    datetime_str = match.group(1)
-                    relative_path = os.path.relpath(root, input_directory)
-                    path_parts = relative_path.split(os.sep)
+def main(argv=None, prog=None):
+    """
+    NH9ファイルのインデックス (SQLite) を作成・更新し、必要に応じてJSONに書き出す。
 
-                    hsi_data.append({
-                        "file_name": file,
-                        "id": datetime_str,
-                        "datetime_folder": path_parts[0] if len(path_parts) > 0 else "",
-                        "location_folder": path_parts[1] if len(path_parts) > 1 else ""
-                    })
+    - 2回目以降は、更新時刻が変わったディレクトリのみを走査する（--rebuild で全ディレクトリを走査し直す）。
 
-    with open(output_json, "w", encoding="utf-8") as f:
-        json.dump(hsi_data, f, ensure_ascii=False, indent=4)
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py index` から呼ばれる場合など）。
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="NH9ファイルのインデックスをSQLiteに作成・更新する。")
+    parser.add_argument("input_directory", nargs="?", default="/mnt/hdd1/toyo/workspace/data",
+                        help="NH9ファイルを含む親ディレクトリのパス。")
+    parser.add_argument("--db", default="hsi_data_ids.sqlite", help="インデックスのSQLiteデータベースのパス。")
+    parser.add_argument("--json", help="インデックスを書き出すJSONファイルのパス（省略時は書き出さない）。")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="走査に使うスレッド数。")
+    parser.add_argument("--rebuild", action="store_true", help="既存のインデックスを破棄して走査し直す。")
+    args = parser.parse_args(argv)
 
-    print(f"Extracted HSI data saved to {output_json}")
+    result = build_index(args.input_directory, args.db, args.workers, args.rebuild)
+    print(f"Indexed {result['files']} files in {args.db} "
+          f"({result['scanned']} directories scanned, {result['skipped']} unchanged)")
+    if args.json:
+        export_json(args.db, args.json)
+        print(f"Extracted HSI data saved to {args.json}")
 
 if __name__ == "__main__":
-    extract_hsi_data("/mnt/hdd1/toyo/workspace/data", "hsi_data_ids.json")
+    main()
@@ -0,0 +1,248 @@
+import os
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from tqdm import tqdm
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+from bandstats import HIST_BINS, compute_band_stats, load_band_stats, save_band_stats, histogram_percentile
+from instrument import ALL_GROUP, group_label
+
+GROUP_BY = ("all", "date", "location")
+LEGACY_ALL_GROUP = "all"  # 旧形式の集計結果で全体の集計に使っていたキー
+DEFAULT_OUTPUT = "global_stats.npz"
+SUMMARY_KEYS = ("count", "min", "max", "mean", "std", "hist")
+
+class GlobalBandStats:
+    """
+    ファイルごとのバンド統計量を結合し、データセット全体のバンドごとの統計量を求める。
+
+    - 平均と分散は件数・平均・偏差平方和 (M2) の組として保持し、Chan らの並列版 Welford 法で結合する
+      （総和・二乗和を直接足し合わせないため、多数のファイルでも桁落ちしない）。
+    - min/max はそのまま、固定ビンのヒストグラムは加算で結合し、パーセンタイルはヒストグラムから求める。
+    - 結合の順序に依存しないため、並列に集計した部分結果同士も `merge` で結合できる。
+
+    Args:
+        bands (int): スペクトルのバンド数。
+    """
+
+    def __init__(self, bands=BANDS):
+        self.bands = bands
+        self.files = 0
+        self.count = 0
+        self.mean = np.zeros(bands, dtype=np.float64)
+        self.m2 = np.zeros(bands, dtype=np.float64)
+        self.min = np.full(bands, np.iinfo(np.uint16).max, dtype=np.uint16)
+        self.max = np.zeros(bands, dtype=np.uint16)
+        self.hist = np.zeros((bands, HIST_BINS), dtype=np.int64)
+
+    def _combine(self, files, count, mean, m2, minimum, maximum, hist):
+        total = self.count + count
+        if count == 0:
+            return self
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+        self.files += files
+        np.minimum(self.min, minimum, out=self.min)
+        np.maximum(self.max, maximum, out=self.max)
+        self.hist += hist
+        return self
+
+    def add(self, stats):
+        """
+        1ファイルのバンド統計量（`bandstats` のサイドカーファイルの形式）を結合する。
+
+        Args:
+            stats (dict): count, min, max, mean, std, hist を含む統計量。
+
+        Returns:
+            GlobalBandStats: self。
+        """
+        count = int(stats["count"])
+        return self._combine(1, count, np.asarray(stats["mean"], dtype=np.float64),
+                             np.asarray(stats["std"], dtype=np.float64) ** 2 * count,
+                             stats["min"], stats["max"], stats["hist"])
+
+    def merge(self, other):
+        """
+        別の集計を結合する。
+
+        Args:
+            other (GlobalBandStats): 結合する集計。
+
+        Returns:
+            GlobalBandStats: self。
+        """
+        return self._combine(other.files, other.count, other.mean, other.m2, other.min, other.max, other.hist)
+
+    def result(self):
+        """
+        集計結果を返す。
+
+        Returns:
+            dict: files, count, min, max, mean, std, p1, p50, p99（それぞれバンド数の長さの配列）と
+                hist（(bands, HIST_BINS) の int64 のヒストグラム）。
+        """
+        return {
+            "files": np.int64(self.files),
+            "count": np.int64(self.count),
+            "min": self.min.copy(),
+            "max": self.max.copy(),
+            "mean": self.mean.copy(),
+            "std": np.sqrt(self.m2 / max(self.count, 1)),
+            "hist": self.hist.copy(),
+            "p1": histogram_percentile(self.hist, 1),
+            "p50": histogram_percentile(self.hist, 50),
+            "p99": histogram_percentile(self.hist, 99),
+        }
+
+def file_band_stats(nh9_path, height=HEIGHT, width=WIDTH, bands=BANDS, save_sidecar=True):
+    """
+    1つのNH9ファイルのバンド統計量を返す（プロセスプールのワーカーで実行）。
+
+    - 最新のサイドカーファイル (bandstats.py) があれば読み込み、なければ1回走査して計算する。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        save_sidecar (bool, optional): 計算した統計量をサイドカーファイルとして保存するか。
+
+    Returns:
+        dict: 結合に必要な統計量 (SUMMARY_KEYS)。
+    """
+    stats = load_band_stats(nh9_path)
+    if stats is None:
+        stats = compute_band_stats(NH9Cube(nh9_path, height, width, bands))
+        if save_sidecar:
+            try:
+                save_band_stats(nh9_path, stats)
+            except OSError:
+                pass  # 読み取り専用のアーカイブでは保存しない
+    return {key: stats[key] for key in SUMMARY_KEYS}
+
+def group_key(nh9_path, input_root, group_by):
+    """
+    NH9ファイルの集計先のグループ名を返す。
+
+    - input_root 直下を「日付フォルダ」、その直下を「場所フォルダ」とする (extract_id.py と同じ階層)。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        input_root (str): データのルートフォルダのパス。
+        group_by (str): "all", "date", "location" のいずれか。
+
+    Returns:
+        str: グループ名（input_root 直下のファイルは ""）。group_by が "all" の場合は ALL_GROUP。
+    """
+    if group_by == "all":
+        return ALL_GROUP
+    relative_dir = os.path.relpath(os.path.dirname(nh9_path), input_root)
+    parts = [] if relative_dir == "." else relative_dir.split(os.sep)
+    index = 0 if group_by == "date" else 1
+    return parts[index] if len(parts) > index else ""
+
+def compute_global_stats(input_root, group_by="all", workers=None, save_sidecars=True,
+                         height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    データのルートフォルダ以下の全 .nh9 ファイルのバンド統計量をプロセスプールで並列に求め、
+    グループごと（および全体）に結合する。
+
+    Args:
+        input_root (str): データのルートフォルダのパス（日付フォルダ/場所フォルダ/*.nh9）。
+        group_by (str, optional): "all"（全体のみ）、"date"（日付フォルダごと）、"location"（場所フォルダごと）。
+        workers (int, optional): ワーカープロセス数。デフォルトはCPU数。
+        save_sidecars (bool, optional): 計算したファイルごとの統計量をサイドカーファイルとして保存するか。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+
+    Returns:
+        dict: {グループ名: `GlobalBandStats.result` の集計結果}。全体の集計は ALL_GROUP（フォルダ名と衝突しないキー）。
+    """
+    files = sorted(glob.glob(os.path.join(input_root, "**", "*.nh9"), recursive=True))
+    groups = {ALL_GROUP: GlobalBandStats(bands)}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(file_band_stats, f, height, width, bands, save_sidecars): f for f in files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Merging band stats", unit="file"):
+            nh9_path = futures[future]
+            try:
+                stats = future.result()
+            except Exception as e:
+                tqdm.write(f"エラー: {nh9_path} の統計量の計算中に問題が発生しました: {e}")
+                continue
+            groups[ALL_GROUP].add(stats)
+            if group_by != "all":
+                groups.setdefault(group_key(nh9_path, input_root, group_by), GlobalBandStats(bands)).add(stats)
+    return {name: summary.result() for name, summary in groups.items()}
+
+def save_global_stats(output_path, results, group_by="all"):
+    """
+    グループごとの集計結果を .npz ファイルに保存する（一時ファイル経由）。
+
+    Args:
+        output_path (str): 出力ファイルのパス。
+        results (dict): `compute_global_stats` の集計結果。
+        group_by (str, optional): 集計に使ったグループ分け。
+
+    Returns:
+        str: 保存したファイルのパス。
+    """
+    names = sorted(results)
+    arrays = {f"{i}_{key}": value for i, name in enumerate(names) for key, value in results[name].items()}
+    tmp_path = output_path + ".tmp.npz"
+    np.savez_compressed(tmp_path, groups=np.array(names), group_by=group_by, **arrays)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def load_global_stats(path):
+    """
+    `save_global_stats` で保存した集計結果を読み込む。
+
+    Args:
+        path (str): .npz ファイルのパス。
+
+    Returns:
+        dict: {グループ名: 集計結果}。全体の集計は ALL_GROUP。
+    """
+    with np.load(path) as data:
+        results = {}
+        for i, name in enumerate(data["groups"].tolist()):
+            prefix = f"{i}_"
+            results[name] = {key[len(prefix):]: data[key] for key in data.files if key.startswith(prefix)}
+    if ALL_GROUP not in results and LEGACY_ALL_GROUP in results:
+        results[ALL_GROUP] = results.pop(LEGACY_ALL_GROUP)
+    return results
+
+def main(argv=None, prog=None):
+    """
+    データのルートフォルダ以下の全 .nh9 ファイルから、データセット全体（と日付・場所フォルダごと）の
+    バンドごとの平均・標準偏差・min/max・パーセンタイルを求めて保存する。
+
+    - ファイルごとの統計量は bandstats.py のサイドカーファイルを再利用し、ないファイルのみ走査する。
+    - 保存した結果は hs_to_rgbV2.py --global-stats で固定の正規化に使える。
+
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py stats` から呼ばれる場合など）。
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="データセット全体のバンド統計量を並列に集計して保存する。")
+    parser.add_argument("input_directory", help="データのルートフォルダ（日付フォルダ/場所フォルダ/*.nh9）。")
+    parser.add_argument("--group-by", choices=GROUP_BY, default="all", help="全体に加えて集計するグループ。")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="集計結果の .npz ファイル。")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数。")
+    parser.add_argument("--no-sidecars", action="store_true", help="計算したファイルごとの統計量を保存しない。")
+    args = parser.parse_args(argv)
+
+    results = compute_global_stats(args.input_directory, args.group_by, args.workers, not args.no_sidecars)
+    save_global_stats(args.output, results, args.group_by)
+    for name, result in sorted(results.items(), key=lambda item: (item[0] != ALL_GROUP, item[0])):
+        print(f"{group_label(name)}: {int(result['files'])} files, "
+              f"mean {float(np.mean(result['mean'])):.1f}, p99 {float(np.mean(result['p99'])):.1f}")
+    print(f"Global stats saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
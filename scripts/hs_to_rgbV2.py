@@ -1,9 +1,21 @@
 import os
 import glob
-import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
 import numpy as np
 from tqdm import tqdm
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+from camera import RGB_BANDS
+from prefetch import PrefetchPipeline
+from manifest import Manifest, fast_hash
+from bandstats import load_band_stats, stats_path
+from global_stats import load_global_stats
+from instrument import FileTrace, NULL_TRACE, NULL_RECORDER, ALL_GROUP, group_label, open_recorder, profile_to
+
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+PARTIAL_SUFFIX = ".partial.jpg"  # 書き込み途中の画像に付ける接尾辞
 
 def make_folder(folder_name):
     """
@@ -22,6 +34,8 @@ def hyprawread(file_path, width, height, spectral_dim):
     """
     ハイパースペクトルデータをバイナリファイルから読み込み、3次元配列として返す。
 
+    - ファイルはメモリマップで開かれ、参照したバンドのページのみが読み込まれる。
+
     Args:
         file_path (str): 読み込むファイルのパス。
         width (int): 画像の幅 (ピクセル単位)。
@@ -29,13 +43,12 @@ def hyprawread(file_path, width, height, spectral_dim):
         spectral_dim (int): スペクトルの次元数 (バンド数)。
 
     Returns:
-        numpy.ndarray: (height, width, spectral_dim) の形状を持つ画像データ。
+        numpy.ndarray: (height, width, spectral_dim) の形状を持つ画像データ（メモリマップのビュー）。
+
+    Raises:
+        ValueError: ファイルサイズが指定したジオメトリと一致しない場合。
     """
-    with open(file_path, 'rb') as file:
-        img_data = np.fromfile(file, np.uint16)
-    img_data = np.reshape(img_data, (height, spectral_dim, width))
-    img_data = np.transpose(img_data, (0, 2, 1))  # 転置して正しい順序に戻す
-    return img_data
+    return NH9Cube(file_path, height, width, spectral_dim).to_hwc()  # 転置して正しい順序に戻す
 
 def extract_rgb(img_data):
     """
@@ -64,12 +77,450 @@ def extract_rgb(img_data):
     rgb_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
     return rgb_image
 
-def process_hyperspectral_images(input_dir, output_dir, width, height, spectral_dim):
+def rgb_band_span():
+    """
+    RGB生成に使うバンドをすべて含む連続範囲を返す。
+
+    Returns:
+        tuple: (開始バンド, 終了バンド)。
+    """
+    return min(b0 for b0, _ in RGB_BANDS), max(b1 for _, b1 in RGB_BANDS)
+
+def block_rows_for_budget(width, block_bytes, itemsize=2):
+    """
+    ブロック予算に収まる1ブロックあたりの行数を求める。
+
+    Args:
+        width (int): 画像の幅。
+        block_bytes (int): 1ブロックの読み込みバッファに割り当てるバイト数。
+        itemsize (int, optional): 1画素のバイト数。デフォルトは2 (uint16)。
+
+    Returns:
+        int: 1ブロックあたりの行数（最低1行）。
+    """
+    band_start, band_stop = rgb_band_span()
+    row_bytes = (band_stop - band_start) * width * itemsize
+    return max(1, block_bytes // row_bytes)
+
+def accumulate_rgb_sums(block, band_sums, band_start):
+    """
+    BIL形式の行ブロックから R/G/B のバンド和を累積バッファに書き込む。
+
+    Args:
+        block (numpy.ndarray): (rows, bands, width) の形状を持つ行ブロック。
+        band_sums (numpy.ndarray): 書き込み先の (3, rows, width) の float32 配列。
+        band_start (int): block の先頭バンドの番号。
+
+    Returns:
+        None
+    """
+    for channel, (b0, b1) in enumerate(RGB_BANDS):
+        np.sum(block[:, b0 - band_start:b1 - band_start, :], axis=1, dtype=np.float32, out=band_sums[channel])
+
+def normalize_rgb_sums(band_sums, channel_max=None):
+    """
+    バンド和から平均を求め、各チャンネルの最大値で 0-255 に正規化したBGR画像を生成する。
+
+    - 12ビット値の和は float32 で誤差なく表現できるため、平均・正規化を
+      float64 で行うことで `extract_rgb` の出力とビット単位で一致する。
+    - channel_max を指定した場合は、平面の最大値を求めずにその値で正規化し、0-255 に切り詰める。
+
+    Args:
+        band_sums (numpy.ndarray): (3, height, width) の float32 のバンド和（R, G, B の順）。
+        channel_max (sequence of float, optional): R, G, B の正規化に使う最大値。
+
+    Returns:
+        numpy.ndarray: OpenCV形式のBGR画像 (uint8)。
+    """
+    bgr_image = np.empty(band_sums.shape[1:] + (3,), dtype=np.uint8)
+    for channel, (b0, b1) in enumerate(RGB_BANDS):
+        band = band_sums[channel].astype(np.float64) / (b1 - b0)
+        if channel_max is None:
+            band = 255 * band / np.max(band)
+        else:
+            band = np.clip(255 * band / channel_max[channel], 0, 255)
+        bgr_image[:, :, 2 - channel] = band.astype(np.uint8)  # RGB → BGR
+    return bgr_image
+
+def rgb_channel_max(band_stats):
+    """
+    バンド統計量から R/G/B チャンネルの正規化に使う最大値を求める。
+
+    - 各チャンネルはバンド範囲の平均なので、その最大値はバンドごとの最大値の平均を超えない。
+
+    Args:
+        band_stats (dict): `bandstats.load_band_stats` の統計量。
+
+    Returns:
+        tuple: (R, G, B) の最大値。
+    """
+    return tuple(max(float(np.mean(band_stats["max"][b0:b1])), 1.0) for b0, b1 in RGB_BANDS)
+
+def load_channel_max(file_path):
+    """
+    NH9ファイルのバンド統計量のサイドカーファイルから R/G/B の最大値を読み込む。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+
+    Returns:
+        tuple or None: (R, G, B) の最大値。サイドカーファイルがない（または古い）場合は None。
+    """
+    band_stats = load_band_stats(file_path)
+    return None if band_stats is None else rgb_channel_max(band_stats)
+
+def global_channel_max(global_stats, percentile="p99"):
+    """
+    データセット全体のバンド統計量から、全ファイル共通の R/G/B の正規化に使う値を求める。
+
+    - 外れ値で暗くならないよう最大値ではなくパーセンタイル（既定は99パーセンタイル）を使い、
+      超える画素は 255 に切り詰める。
+
+    Args:
+        global_stats (dict): `global_stats.load_global_stats` の1グループの集計結果。
+        percentile (str, optional): 使うパーセンタイルのキー ("p99", "p50" など)。
+
+    Returns:
+        tuple: (R, G, B) の正規化に使う値。
+    """
+    return tuple(max(float(np.mean(global_stats[percentile][b0:b1])), 1.0) for b0, b1 in RGB_BANDS)
+
+def load_global_channel_max(stats_path, group=ALL_GROUP):
+    """
+    global_stats.py で保存した集計結果から、指定したグループの R/G/B の正規化に使う値を読み込む。
+
+    Args:
+        stats_path (str): 集計結果の .npz ファイルのパス。
+        group (str, optional): グループ名（日付フォルダ名・場所フォルダ名）。デフォルトは全体 (ALL_GROUP)。
+
+    Returns:
+        tuple: (R, G, B) の正規化に使う値。
+
+    Raises:
+        KeyError: 指定したグループが集計結果にない場合。
+    """
+    results = load_global_stats(stats_path)
+    if group not in results:
+        available = ", ".join(group_label(name) for name in sorted(results))
+        raise KeyError(f"グループ '{group}' が {stats_path} にありません (利用可能: {available})")
+    return global_channel_max(results[group])
+
+def accumulate_rgb_streaming(cube, block_bytes=DEFAULT_BLOCK_BYTES, trace=NULL_TRACE):
+    """
+    NH9キューブを行ブロック単位で走査し、R/G/B のバンド和を求める。
+
+    - 各行ブロックについて R/G/B のバンド範囲 (RGB_BANDS) のみを読み込み、
+      float32 の累積バッファにバンド和を書き込む。
+    - ピーク時のメモリ使用量は block_bytes + RGB平面3枚分に抑えられる。
+
+    Args:
+        cube (NH9Cube): 入力のNH9キューブ。
+        block_bytes (int, optional): 1ブロックの読み込みバッファに割り当てるバイト数。
+        trace (FileTrace, optional): 読み込み・バンド和の各ステージの計測先。
+
+    Returns:
+        numpy.ndarray: (3, height, width) の float32 のバンド和（R, G, B の順）。
+    """
+    band_start, band_stop = rgb_band_span()
+    block_rows = min(cube.height, block_rows_for_budget(cube.width, block_bytes, cube.dtype.itemsize))
+    buffer = np.empty((block_rows, band_stop - band_start, cube.width), dtype=cube.dtype)
+    band_sums = np.empty((len(RGB_BANDS), cube.height, cube.width), dtype=np.float32)
+
+    for start in range(0, cube.height, block_rows):
+        stop = min(start + block_rows, cube.height)
+        with trace.stage("read", bytes_in=buffer[:stop - start].nbytes):
+            block = cube.read_rows(start, stop, band_start, band_stop, out=buffer[:stop - start])
+        with trace.stage("reduce"):
+            accumulate_rgb_sums(block, band_sums[:, start:stop], band_start)
+    return band_sums
+
+def extract_rgb_streaming(cube, block_bytes=DEFAULT_BLOCK_BYTES, channel_max=None, trace=NULL_TRACE):
+    """
+    NH9キューブを行ブロック単位で走査し、`extract_rgb` と同一のRGB画像を生成する。
+
+    - 行ブロックごとにバンド和を求め (`accumulate_rgb_streaming`)、最大値による正規化は
+      2パス目で小さなRGB平面に対してのみ行う。
+    - ピーク時のメモリ使用量は block_bytes + RGB平面数枚分に抑えられる。
+
+    Args:
+        cube (NH9Cube): 入力のNH9キューブ。
+        block_bytes (int, optional): 1ブロックの読み込みバッファに割り当てるバイト数。
+        channel_max (sequence of float, optional): R, G, B の正規化に使う最大値（`rgb_channel_max`）。
+        trace (FileTrace, optional): 読み込み・バンド和・正規化の各ステージの計測先。
+
+    Returns:
+        numpy.ndarray: OpenCV形式のBGR画像 (uint8)。
+    """
+    band_sums = accumulate_rgb_streaming(cube, block_bytes, trace)
+
+    # 2パス目: 小さなRGB平面のみで平均と最大値による正規化を行う
+    with trace.stage("normalize"):
+        return normalize_rgb_sums(band_sums, channel_max)
+
+def estimate_frame_footprint(width, height, spectral_dim, block_bytes=None):
+    """
+    1ファイルの変換に必要なピークメモリ量を見積もる。
+
+    - ストリーミング処理: 読み込みバッファ + float32 のバンド和3面 + float64 の一時平面2面 + 出力画像。
+    - フレーム全体の処理: フレーム全体 + float64 の平均平面・正規化平面・dstack 結果。
+
+    Args:
+        width (int): 画像の幅。
+        height (int): 画像の高さ。
+        spectral_dim (int): スペクトルの次元数。
+        block_bytes (int, optional): ストリーミング処理の読み込みバッファのバイト数。
+
+    Returns:
+        int: 1ワーカーあたりのピークメモリの見積もり（バイト）。
+    """
+    plane = height * width
+    if block_bytes:
+        band_start, band_stop = rgb_band_span()
+        block_rows = min(height, block_rows_for_budget(width, block_bytes))
+        read_buffer = block_rows * (band_stop - band_start) * width * 2
+        return read_buffer + 3 * plane * 4 + 2 * plane * 8 + 3 * plane
+    return height * width * spectral_dim * 2 + 9 * plane * 8 + 3 * plane
+
+def limit_workers(workers, footprint, memory_limit=None):
+    """
+    ワーカー数 × 1ファイルあたりのピークメモリ量がメモリ上限を超えないワーカー数を返す。
+
+    Args:
+        workers (int): 希望するワーカー数。
+        footprint (int): 1ファイルあたりのピークメモリの見積もり（`estimate_frame_footprint`）。
+        memory_limit (int, optional): 全ワーカーのメモリ上限（バイト）。None の場合は制限しない。
+
+    Returns:
+        int: 上限内に収まるワーカー数。
+
+    Raises:
+        ValueError: 1ファイル分のピークメモリ量だけで上限を超える場合。
+    """
+    if not memory_limit:
+        return workers
+    if footprint > memory_limit:
+        raise ValueError(f"1ファイルあたり約 {footprint / 2**20:.0f} MiB 必要で、メモリ上限 {memory_limit / 2**30:.2f} GiB を"
+                         f"超えています。--block-mb を小さくするか --max-memory-gb を大きくしてください")
+    return min(workers, memory_limit // footprint)
+
+def render_rgb(file_path, width, height, spectral_dim, block_bytes=None, use_stats=False, channel_max=None,
+               trace=NULL_TRACE):
+    """
+    NH9ファイルを読み込み、BGR画像を生成する。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        width (int): 画像の幅。
+        height (int): 画像の高さ。
+        spectral_dim (int): スペクトルの次元数。
+        block_bytes (int, optional): ストリーミング処理の読み込みバッファのバイト数。
+            None の場合はフレーム全体を対象に処理する。
+        use_stats (bool, optional): バンド統計量のサイドカーファイルがあれば、その最大値で正規化するか
+            （この場合は常にストリーミング処理を行う）。
+        channel_max (sequence of float, optional): 全ファイル共通の R/G/B の正規化に使う値
+            （`load_global_channel_max`）。指定した場合は use_stats より優先する。
+        trace (FileTrace, optional): 各ステージの計測先。フレーム全体の処理では、メモリマップの読み込みと
+            計算が分けられないため "extract" ステージとして計測する。
+
+    Returns:
+        numpy.ndarray: OpenCV形式のBGR画像 (uint8)。
+    """
+    if channel_max is None and use_stats:
+        channel_max = load_channel_max(file_path)
+    if block_bytes or channel_max is not None:
+        return extract_rgb_streaming(NH9Cube(file_path, height, width, spectral_dim),
+                                     block_bytes or DEFAULT_BLOCK_BYTES, channel_max, trace)
+    with trace.stage("extract", bytes_in=height * width * spectral_dim * 2):
+        img_data = hyprawread(file_path, width, height, spectral_dim)
+        return extract_rgb(img_data)
+
+def rgb_output_path(file_path, output_dir):
+    """
+    NH9ファイルに対応するRGB画像の出力パスを返す。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        output_dir (str): 出力フォルダのパス。
+
+    Returns:
+        str: 「rgb-元のファイル名.jpg」形式の出力パス。
+    """
+    base_name = os.path.basename(file_path)
+    output_name = f"rgb-{os.path.splitext(base_name)[0]}.jpg"
+    return os.path.join(output_dir, output_name)
+
+def write_image_atomic(output_path, image):
+    """
+    画像を一時ファイルに書き込んでから置き換え、中断時に壊れた画像が残らないようにする。
+
+    Args:
+        output_path (str): 保存先の画像パス (.jpg)。
+        image (numpy.ndarray): 保存する画像。
+
+    Returns:
+        None
+    """
+    tmp_path = os.path.splitext(output_path)[0] + PARTIAL_SUFFIX
+    if not cv2.imwrite(tmp_path, image):
+        raise IOError(f"{tmp_path} の書き込みに失敗しました")
+    os.replace(tmp_path, output_path)
+
+def open_output_manifest(output_dir, use_hash=False, rebuild=False):
+    """
+    出力フォルダのマニフェストを読み込み、前回中断時に残った書き込み途中の画像を削除する。
+
+    Args:
+        output_dir (str): 出力フォルダのパス。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): マニフェストを破棄して全ファイルを変換し直すか。
+
+    Returns:
+        Manifest: 出力フォルダのマニフェスト。
+    """
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME), use_hash)
+    if rebuild:
+        manifest.clear()
+    for partial_path in glob.glob(os.path.join(output_dir, "*" + PARTIAL_SUFFIX)):
+        os.remove(partial_path)
+    return manifest
+
+def normalization_settings(use_stats=False, channel_max=None, global_stats=None, stats_group=None):
+    """
+    マニフェストに記録する正規化の設定を作成する（設定を変えて再実行した場合に変換し直すため）。
+
+    Args:
+        use_stats (bool, optional): バンド統計量のサイドカーファイルの最大値で正規化するか。
+        channel_max (sequence of float, optional): 全ファイル共通の R/G/B の正規化に使う値。
+        global_stats (str, optional): channel_max を読み込んだ global_stats.py の集計結果のパス。
+        stats_group (str, optional): channel_max を読み込んだグループ。
+
+    Returns:
+        dict: normalization ("frame", "stats", "global")。"global" の場合は channel_max と、
+            集計結果ファイルの高速ハッシュ (stats_file)・グループ (stats_group)。
+    """
+    if channel_max is not None:
+        return {"normalization": "global", "channel_max": [float(v) for v in channel_max],
+                "stats_file": fast_hash(global_stats) if global_stats else None, "stats_group": stats_group}
+    return {"normalization": "stats" if use_stats else "frame"}
+
+def file_normalization(file_path, normalization):
+    """
+    1つのNH9ファイルについて、マニフェストに記録する正規化の設定を返す。
+
+    - "stats" の場合は、サイドカーファイルの高速ハッシュ（ない場合は None）を加える
+      （サイドカーファイルを作成・更新した場合に変換し直すため）。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        normalization (dict): `normalization_settings` の設定。
+
+    Returns:
+        dict: マニフェストのエントリに加える値。
+    """
+    if normalization["normalization"] != "stats":
+        return normalization
+    sidecar = stats_path(file_path)
+    return dict(normalization, sidecar=fast_hash(sidecar) if os.path.exists(sidecar) else None)
+
+def is_converted(file_path, output_dir, manifest, normalization=None):
+    """
+    NH9ファイルが変換済み（出力が存在し、入力がマニフェストの記録から変更されておらず、
+    同じ正規化の設定で変換されている）かを確認する。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        output_dir (str): 出力フォルダのパス。
+        manifest (Manifest): 出力フォルダのマニフェスト。
+        normalization (dict, optional): `normalization_settings` の設定。None の場合はフレームごとの正規化。
+
+    Returns:
+        bool: 変換済みの場合は True。正規化の設定が記録されていないエントリは変換済みとみなさない。
+    """
+    key = os.path.basename(file_path)
+    if not manifest.is_current(key, file_path) or not os.path.exists(rgb_output_path(file_path, output_dir)):
+        return False
+    entry = manifest.entries[key]
+    expected = file_normalization(file_path, normalization or normalization_settings())
+    return all(entry.get(name) == value for name, value in expected.items())
+
+def record_converted(file_path, manifest, normalization=None):
+    """
+    変換が完了したNH9ファイルを、正規化の設定とともにマニフェストに記録する。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        manifest (Manifest): 出力フォルダのマニフェスト。
+        normalization (dict, optional): `normalization_settings` の設定。None の場合はフレームごとの正規化。
+    """
+    manifest.record(os.path.basename(file_path), file_path,
+                    **file_normalization(file_path, normalization or normalization_settings()))
+    manifest.maybe_save()
+
+def convert_file(file_path, output_path, width, height, spectral_dim, block_bytes=None, use_stats=False,
+                 channel_max=None, trace=NULL_TRACE):
+    """
+    1つのNH9ファイルをRGB画像に変換して保存する（プロセスプールのワーカーからも呼ばれる）。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        output_path (str): 保存先の画像パス。
+        width (int): 画像の幅。
+        height (int): 画像の高さ。
+        spectral_dim (int): スペクトルの次元数。
+        block_bytes (int, optional): ストリーミング処理の読み込みバッファのバイト数。
+        use_stats (bool, optional): バンド統計量のサイドカーファイルの最大値で正規化するか。
+        channel_max (sequence of float, optional): 全ファイル共通の R/G/B の正規化に使う値。
+        trace (FileTrace, optional): 各ステージの計測先。
+
+    Returns:
+        str: 保存した画像のパス。
+    """
+    rgb_image = render_rgb(file_path, width, height, spectral_dim, block_bytes, use_stats, channel_max, trace)
+    make_folder(os.path.dirname(output_path))
+    with trace.stage("write", bytes_in=rgb_image.nbytes) as stage:
+        write_image_atomic(output_path, rgb_image)
+        stage.bytes_out = os.path.getsize(output_path)
+    return output_path
+
+def convert_file_traced(file_path, output_path, group, profile_path, width, height, spectral_dim, block_bytes=None,
+                        use_stats=False, channel_max=None):
+    """
+    `convert_file` を計測付きで実行する（計測が有効な場合にプロセスプールのワーカーから呼ばれる）。
+
+    Args:
+        file_path (str): NH9ファイルのパス。
+        output_path (str): 保存先の画像パス。
+        group (str): 集計のグループ名（場所フォルダ名）。
+        profile_path (str or None): cProfile の結果の保存先（`RunRecorder.profile_path`）。
+        その他の引数は `convert_file` と同じ。
+
+    Returns:
+        dict: 実行ログのレコード（`FileTrace.record`）。
+    """
+    trace = FileTrace(file_path, group)
+    with profile_to(profile_path):
+        convert_file(file_path, output_path, width, height, spectral_dim, block_bytes, use_stats, channel_max, trace)
+    return trace.record()
+
+def process_hyperspectral_images(input_dir, output_dir, width, height, spectral_dim, block_bytes=None, prefetch_depth=0,
+                                 use_hash=False, rebuild=False, use_stats=False, channel_max=None,
+                                 recorder=NULL_RECORDER, normalization=None):
     """
     指定したディレクトリ内の .nh9 ファイルを処理し、RGB画像として保存する。
 
     - 入力フォルダ内の全 .nh9 ファイルをスキャン。
     - 各ファイルを RGB に変換し、指定した出力フォルダに保存。
+    - block_bytes を指定した場合は行ブロック単位のストリーミング処理を行う。
+    - prefetch_depth を指定した場合は、RGBに使うバンドの読み込みとバンド和の計算を prefetch_depth ファイル先まで
+      バックグラウンドスレッドで行い（block_bytes の行ブロック単位、None の場合は既定値）、画像の保存も別スレッドで行う。
+      先読みしたファイルはバンド和（float32 の3平面）のみを保持する。
+    - 変換に失敗したファイルはエラーを表示してスキップし、マニフェストに記録しない（先読みの有無によらない）。
+    - 出力フォルダのマニフェストと一致しない（新規・変更された、または正規化の設定が異なる）ファイルのみ変換する。
+    - use_stats の場合は、バンド統計量のサイドカーファイル（bandstats.py で作成）の最大値で正規化し、
+      フレームごとの最大値の計算を省く。サイドカーファイルがないファイルは従来どおり正規化する。
+    - channel_max を指定した場合は、全ファイルをその値で正規化する（フレーム間で明るさが揃う）。
+    - recorder を指定した場合は、ファイルごとの各ステージの処理時間と入出力バイト数を記録する
+      （入力フォルダ名をグループとして集計する）。
 
     Args:
         input_dir (str): .nh9 ファイルを含むフォルダのパス。
@@ -77,10 +528,21 @@ def process_hyperspectral_images(input_dir, output_dir, width, height, spectral_
         width (int): 画像の幅。
         height (int): 画像の高さ。
         spectral_dim (int): スペクトルの次元数。
+        block_bytes (int, optional): ストリーミング処理の読み込みバッファのバイト数。
+            None の場合はフレーム全体を対象に処理する。
+        prefetch_depth (int, optional): 先読みするファイル数。0 の場合は先読みしない。
+        use_hash (bool, optional): 変更検出にサイズ・更新時刻に加えて高速ハッシュを使用するか。
+        rebuild (bool, optional): マニフェストを破棄して全ファイルを変換し直すか。
+        use_stats (bool, optional): バンド統計量のサイドカーファイルの最大値で正規化するか。
+        channel_max (sequence of float, optional): 全ファイル共通の R/G/B の正規化に使う値。
+        recorder (RunRecorder, optional): 計測の記録先（`instrument.open_recorder`）。
+        normalization (dict, optional): マニフェストに記録する正規化の設定（`normalization_settings`）。
+            None の場合は use_stats・channel_max から作成する。
 
     Returns:
         None
     """
+    normalization = normalization or normalization_settings(use_stats, channel_max)
     files = glob.glob(os.path.join(input_dir, "*.nh9"))
     
     if not files:
@@ -89,19 +551,103 @@ def process_hyperspectral_images(input_dir, output_dir, width, height, spectral_
 
     print(f"Found {len(files)} .nh9 files in {input_dir}")
 
+    make_folder(output_dir)
+    manifest = open_output_manifest(output_dir, use_hash, rebuild)
+    pending_files = [f for f in files if not is_converted(f, output_dir, manifest, normalization)]
+    if len(pending_files) < len(files):
+        print(f"変換済みの {len(files) - len(pending_files)} ファイルをスキップします")
+
+    try:
+        _convert_pending_files(pending_files, input_dir, output_dir, width, height, spectral_dim,
+                               block_bytes, prefetch_depth, manifest, use_stats, channel_max, recorder,
+                               normalization)
+    finally:
+        manifest.save()
+
+def _convert_pending_files(files, input_dir, output_dir, width, height, spectral_dim,
+                           block_bytes, prefetch_depth, manifest, use_stats=False, channel_max=None,
+                           recorder=NULL_RECORDER, normalization=None):
+    """
+    `process_hyperspectral_images` の変換処理本体。変換が完了したファイルをマニフェストに記録する。
+    """
+    group = os.path.basename(os.path.normpath(input_dir))
+    if prefetch_depth > 0:
+        traces = {}
+        failed = []
+
+        def load(file_path):
+            trace = traces[file_path] = recorder.file(file_path, group)
+            with recorder.profiled(file_path, "load"):
+                cube = NH9Cube(file_path, height, width, spectral_dim)
+                return accumulate_rgb_streaming(cube, block_bytes or DEFAULT_BLOCK_BYTES, trace)
+
+        def process(file_path, band_sums):
+            trace = traces[file_path]
+            with recorder.profiled(file_path, "process"):
+                with trace.stage("normalize"):
+                    if channel_max is None and use_stats:
+                        return normalize_rgb_sums(band_sums, load_channel_max(file_path))
+                    return normalize_rgb_sums(band_sums, channel_max)
+
+        def write(file_path, rgb_image):
+            trace = traces.pop(file_path)
+            output_path = rgb_output_path(file_path, output_dir)
+            with recorder.profiled(file_path, "write"), trace.stage("write", bytes_in=rgb_image.nbytes) as stage:
+                write_image_atomic(output_path, rgb_image)
+                stage.bytes_out = os.path.getsize(output_path)
+            recorder.finish(trace)
+            record_converted(file_path, manifest, normalization)
+            print(f"Image saved: {output_path}")
+
+        def on_error(file_path, e):
+            failed.append(file_path)
+            tqdm.write(f"エラー: {file_path} の処理中に問題が発生しました: {e}")
+            trace = traces.pop(file_path, None)
+            if trace is not None:
+                recorder.finish(trace, "failed", error=str(e))
+
+        pipeline = PrefetchPipeline(load, process, write, depth=prefetch_depth, on_error=on_error)
+        with tqdm(total=len(files), desc=f"Processing files in {input_dir}") as progress:
+            stats = pipeline.run(files, progress)
+        print(f"パイプライン統計: {stats.summary()}")
+        if failed:
+            print(f"{len(files)} ファイル中 {len(failed)} ファイルの変換に失敗しました")
+        return
+
+    failed = 0
     for file_path in tqdm(files, desc=f"Processing files in {input_dir}"):
-        img_data = hyprawread(file_path, width, height, spectral_dim)
-        rgb_image = extract_rgb(img_data)
+        trace = recorder.file(file_path, group)
+        try:
+            with recorder.profiled(file_path):
+                output_path = convert_file(file_path, rgb_output_path(file_path, output_dir),
+                                           width, height, spectral_dim, block_bytes, use_stats, channel_max, trace)
+        except Exception as e:
+            failed += 1
+            tqdm.write(f"エラー: {file_path} の処理中に問題が発生しました: {e}")
+            recorder.finish(trace, "failed", error=str(e))
+            continue
+        recorder.finish(trace)
+        record_converted(file_path, manifest, normalization)
+        print(f"Image saved: {output_path}")
+    if failed:
+        print(f"{len(files)} ファイル中 {failed} ファイルの変換に失敗しました")
 
-        base_name = os.path.basename(file_path)
-        output_name = f"rgb-{os.path.splitext(base_name)[0]}.jpg"
-        output_path = os.path.join(output_dir, output_name)
+def list_location_folders(date_folder):
+    """
+    日付フォルダ直下の場所フォルダを列挙する。
 
-        make_folder(output_dir)
-        cv2.imwrite(output_path, rgb_image)
-        print(f"Image saved: {output_path}")
+    Args:
+        date_folder (str): 日付フォルダのパス。
 
-def process_hyperspectral_images_in_location_folders(date_folder, output_dir, width, height, spectral_dim):
+    Returns:
+        list of str: 場所フォルダのパスのリスト。
+    """
+    return [os.path.join(date_folder, d) for d in os.listdir(date_folder) if os.path.isdir(os.path.join(date_folder, d))]
+
+def process_hyperspectral_images_in_location_folders(date_folder, output_dir, width, height, spectral_dim,
+                                                     block_bytes=None, prefetch_depth=0, use_hash=False, rebuild=False,
+                                                     use_stats=False, channel_max=None, recorder=NULL_RECORDER,
+                                                     normalization=None):
     """
     日付フォルダ内の各場所フォルダを探索し、ハイパースペクトル画像を処理する。
 
@@ -113,11 +659,19 @@ def process_hyperspectral_images_in_location_folders(date_folder, output_dir, wi
         width (int): 画像の幅。
         height (int): 画像の高さ。
         spectral_dim (int): スペクトルの次元数。
+        block_bytes (int, optional): ストリーミング処理の読み込みバッファのバイト数。
+        prefetch_depth (int, optional): 先読みするファイル数。0 の場合は先読みしない。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): マニフェストを破棄して全ファイルを変換し直すか。
+        use_stats (bool, optional): バンド統計量のサイドカーファイルの最大値で正規化するか。
+        channel_max (sequence of float, optional): 全ファイル共通の R/G/B の正規化に使う値。
+        recorder (RunRecorder, optional): 計測の記録先（場所フォルダごとに集計する）。
+        normalization (dict, optional): マニフェストに記録する正規化の設定（`normalization_settings`）。
 
     Returns:
         None
     """
-    location_folders = [os.path.join(date_folder, d) for d in os.listdir(date_folder) if os.path.isdir(os.path.join(date_folder, d))]
+    location_folders = list_location_folders(date_folder)
 
     for location_folder in location_folders:
         print(f"Processing location folder: {location_folder}")
@@ -125,29 +679,209 @@ def process_hyperspectral_images_in_location_folders(date_folder, output_dir, wi
         location_subdir = os.path.basename(location_folder)
         output_location_dir = os.path.join(output_dir, location_subdir)
 
-        process_hyperspectral_images(location_folder, output_location_dir, width, height, spectral_dim)
+        process_hyperspectral_images(location_folder, output_location_dir, width, height, spectral_dim,
+                                     block_bytes, prefetch_depth, use_hash, rebuild, use_stats, channel_max, recorder,
+                                     normalization)
 
-if __name__ == "__main__":
+def process_hyperspectral_images_parallel(date_folder, output_dir, width, height, spectral_dim,
+                                          workers, memory_limit=None, block_bytes=None, use_hash=False, rebuild=False,
+                                          use_stats=False, channel_max=None, recorder=NULL_RECORDER,
+                                          normalization=None):
+    """
+    日付フォルダ内の全場所フォルダの .nh9 ファイルを、プロセスプールで並列にRGB画像へ変換する。
+
+    - 全場所フォルダのファイルをまとめて1つのジョブリストにし、ファイル単位で分配する。
+    - memory_limit を指定した場合、ワーカー数 × 1ファイルあたりのピークメモリ量が
+      上限を超えないようにワーカー数を制限する（1ファイル分だけで上限を超える場合は変換しない）。
+    - 進捗は全体で1本の tqdm バーに表示する。
+    - 各出力フォルダのマニフェストと一致しない（新規・変更された、または正規化の設定が異なる）ファイルのみ変換する。
+    - recorder を指定した場合は、ワーカーで計測したファイルごとの各ステージの結果を記録する。
+
+    Args:
+        date_folder (str): 日付フォルダのパス。
+        output_dir (str): 変換後の画像を保存するフォルダの親ディレクトリ。
+        width (int): 画像の幅。
+        height (int): 画像の高さ。
+        spectral_dim (int): スペクトルの次元数。
+        workers (int): ワーカープロセス数の上限。
+        memory_limit (int, optional): 全ワーカー合計のメモリ上限（バイト）。
+        block_bytes (int, optional): ストリーミング処理の読み込みバッファのバイト数。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): マニフェストを破棄して全ファイルを変換し直すか。
+        use_stats (bool, optional): バンド統計量のサイドカーファイルの最大値で正規化するか。
+        channel_max (sequence of float, optional): 全ファイル共通の R/G/B の正規化に使う値。
+        recorder (RunRecorder, optional): 計測の記録先（場所フォルダごとに集計する）。
+        normalization (dict, optional): マニフェストに記録する正規化の設定（`normalization_settings`）。
+            None の場合は use_stats・channel_max から作成する。
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: memory_limit が1ファイル分のピークメモリ量より小さい場合（`limit_workers`）。
+    """
+    normalization = normalization or normalization_settings(use_stats, channel_max)
+    jobs = []
+    manifests = {}
+    skipped = 0
+    for location_folder in list_location_folders(date_folder):
+        output_location_dir = os.path.join(output_dir, os.path.basename(location_folder))
+        make_folder(output_location_dir)
+        manifest = manifests[output_location_dir] = open_output_manifest(output_location_dir, use_hash, rebuild)
+        for file_path in sorted(glob.glob(os.path.join(location_folder, "*.nh9"))):
+            if is_converted(file_path, output_location_dir, manifest, normalization):
+                skipped += 1
+            else:
+                jobs.append((file_path, rgb_output_path(file_path, output_location_dir)))
+
+    if skipped:
+        print(f"変換済みの {skipped} ファイルをスキップします")
+    if not jobs:
+        print(f"{date_folder} に変換する .nh9 ファイルがありません")
+        for manifest in manifests.values():
+            manifest.save()
+        return
+
+    footprint = estimate_frame_footprint(width, height, spectral_dim, block_bytes)
+    max_workers = min(workers, len(jobs))
+    allowed = limit_workers(max_workers, footprint, memory_limit)
+    if allowed < max_workers:
+        print(f"メモリ上限 {memory_limit / 2**30:.2f} GiB に収まるよう、ワーカー数を {allowed} に制限します "
+              f"(1ファイルあたり {footprint / 2**20:.0f} MiB)")
+        max_workers = allowed
+
+    print(f"{len(jobs)} 個の .nh9 ファイルを {max_workers} ワーカーで処理します")
+
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            def submit(file_path, output_path):
+                if not recorder.enabled:
+                    return executor.submit(convert_file, file_path, output_path, width, height, spectral_dim,
+                                           block_bytes, use_stats, channel_max)
+                group = os.path.basename(os.path.dirname(file_path))
+                return executor.submit(convert_file_traced, file_path, output_path, group,
+                                       recorder.profile_path(file_path), width, height, spectral_dim, block_bytes,
+                                       use_stats, channel_max)
+
+            futures = {submit(file_path, output_path): (file_path, output_path) for file_path, output_path in jobs}
+            with tqdm(total=len(jobs), desc=f"Processing files in {date_folder}") as progress:
+                for future in as_completed(futures):
+                    file_path, output_path = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        failed += 1
+                        tqdm.write(f"エラー: {file_path} の処理中に問題が発生しました: {e}")
+                        recorder.finish(recorder.file(file_path, os.path.basename(os.path.dirname(file_path))),
+                                        "failed", error=str(e))
+                    else:
+                        if recorder.enabled:
+                            recorder.add_record(result)
+                        record_converted(file_path, manifests[os.path.dirname(output_path)], normalization)
+                    progress.update(1)
+    finally:
+        for manifest in manifests.values():
+            manifest.save()
+
+    if failed:
+        print(f"{len(jobs)} ファイル中 {failed} ファイルの変換に失敗しました")
+
+def main(argv=None, prog=None):
     """
     コマンドライン引数から日付フォルダのパスを取得し、RGB画像を生成する。
 
     - コマンドライン引数が指定されていない場合はエラーメッセージを出して終了。
     - 「RGB-日付フォルダ」の出力ディレクトリを作成。
     - 指定された日付フォルダ内の場所フォルダごとに処理を実行。
+    - --block-mb でストリーミング処理の読み込みバッファ (MB) を指定する（0 でフレーム全体を処理）。
+    - --workers N で全場所フォルダのファイルを N プロセスで並列処理する。
+      --max-memory-gb でワーカー全体のメモリ上限を指定する。
+    - --prefetch N で逐次処理時に N ファイル先まで先読みし、読み込み・計算・保存を重ね合わせる
+      （先読みも --block-mb の行ブロック単位で行い、先読みしたファイルはバンド和のみを保持する）。
+    - 出力フォルダのマニフェストと一致する変換済みファイルはスキップする（--rebuild で全ファイルを変換し直す）。
+      正規化の設定（--use-stats・--global-stats・--stats-group）もマニフェストに記録し、異なる場合は変換し直す。
+    - --use-stats でバンド統計量のサイドカーファイルの最大値を使って正規化する。
+    - --global-stats で global_stats.py の集計結果から全ファイル共通の値で正規化する（--stats-group でグループを指定）。
+    - --run-log でファイルごとの各ステージの処理時間と入出力バイト数を JSONL に記録し、終了時に場所フォルダごとの
+      集計を表示する。--profile で名前が一致するファイルを cProfile で計測する。
+
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py rgb` から呼ばれる場合など）。
     """
-    if len(sys.argv) > 1:
-        date_folder = sys.argv[1]
-    else:
-        print("Please provide the date folder path.")
-        sys.exit()
+    parser = argparse.ArgumentParser(prog=prog, description="NH9ハイパースペクトル画像をRGBのJPEG画像に変換する。")
+    parser.add_argument("date_folder", help=".nh9 ファイルを含む場所フォルダがある日付フォルダのパス。")
+    parser.add_argument("--block-mb", type=int, default=DEFAULT_BLOCK_BYTES // (1024 * 1024),
+                        help="ストリーミング処理の読み込みバッファ (MB)。0 でフレーム全体を処理する。")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="ワーカープロセス数（1 でファイルを逐次処理する）。")
+    parser.add_argument("--max-memory-gb", type=float, default=None,
+                        help="全ワーカー合計のメモリ上限 (GB)。上限に収まるようワーカー数を減らす。")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="逐次処理時に N ファイル先までバックグラウンドスレッドで先読みする（0 で無効）。")
+    parser.add_argument("--hash", action="store_true",
+                        help="変更検出にサイズ・更新時刻に加えて高速ハッシュも使う。")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="マニフェストを無視して全ファイルを変換し直す。")
+    parser.add_argument("--use-stats", action="store_true",
+                        help="フレームを走査せず、バンド統計量のサイドカーファイル (bandstats.py) の最大値で正規化する。")
+    parser.add_argument("--global-stats", default=None,
+                        help="global_stats.py の集計結果の 99 パーセンタイルで全フレームを同じ値で正規化する"
+                             "（フレーム間で明るさが揃う）。")
+    parser.add_argument("--stats-group", default=None,
+                        help="--global-stats の集計結果で使うグループ（日付フォルダ名・場所フォルダ名。既定はデータセット全体）。")
+    parser.add_argument("--run-log", default=None,
+                        help="ファイルごと・ステージごとの処理時間と入出力バイト数を追記するJSONLファイル"
+                             "（終了時に場所フォルダごとの集計を表示する）。")
+    parser.add_argument("--profile", action="append", default=[], metavar="PATTERN",
+                        help="ファイル名がこの glob パターンに一致するファイルを cProfile で計測する（複数指定可）。")
+    parser.add_argument("--profile-dir", default="profiles",
+                        help="--profile の .prof ファイルを保存するフォルダ。")
+    args = parser.parse_args(argv)
+    date_folder = args.date_folder
+    block_bytes = args.block_mb * 1024 * 1024
+    channel_max = None
+    stats_group = args.stats_group or ALL_GROUP
+    if args.global_stats:
+        try:
+            channel_max = load_global_channel_max(args.global_stats, stats_group)
+        except (OSError, KeyError) as e:
+            parser.error(str(e))
+        print(f"全ファイル共通の正規化の値 (R, G, B): {', '.join(f'{v:.1f}' for v in channel_max)}")
+    normalization = normalization_settings(args.use_stats, channel_max, args.global_stats, stats_group)
 
     folder_name = os.path.basename(os.path.normpath(date_folder))
     output_directory = os.path.join(os.getcwd(), f"RGB-{folder_name}")
 
     make_folder(output_directory)
 
-    width, height, spectral_dim = 2048, 1080, 151
+    width, height, spectral_dim = WIDTH, HEIGHT, BANDS
+    memory_limit = int(args.max_memory_gb * 2**30) if args.max_memory_gb else None
+    if args.workers > 1:
+        try:
+            limit_workers(args.workers, estimate_frame_footprint(width, height, spectral_dim, block_bytes), memory_limit)
+        except ValueError as e:
+            parser.error(str(e))
+
+    recorder = open_recorder(args.run_log, args.profile, args.profile_dir, script="hs_to_rgbV2",
+                             date_folder=date_folder, workers=args.workers, block_mb=args.block_mb,
+                             prefetch=args.prefetch)
 
     print(f"Starting to process hyperspectral images in {date_folder}")
-    process_hyperspectral_images_in_location_folders(date_folder, output_directory, width, height, spectral_dim)
+    try:
+        if args.workers > 1:
+            process_hyperspectral_images_parallel(date_folder, output_directory, width, height, spectral_dim,
+                                                  args.workers, memory_limit, block_bytes, args.hash, args.rebuild,
+                                                  args.use_stats, channel_max, recorder, normalization)
+        else:
+            process_hyperspectral_images_in_location_folders(date_folder, output_directory, width, height,
+                                                             spectral_dim, block_bytes, args.prefetch, args.hash,
+                                                             args.rebuild, args.use_stats, channel_max, recorder,
+                                                             normalization)
+    finally:
+        recorder.close()
     print("Processing complete.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import importlib
+from camera import GEOMETRY_ENV, DEFAULT_GEOMETRY, parse_geometry, set_geometry
+
+# サブコマンド名: (モジュール名, 説明)。モジュールはサブコマンドの実行時にのみ読み込む
+COMMANDS = {
+    "index": ("extract_id", "NH9ファイルのインデックス (SQLite / JSON) を作成・更新する"),
+    "rgb": ("hs_to_rgbV2", "NH9ファイルからRGB画像を生成する"),
+    "convert": ("mainCUI", "NH9ファイルをHDF5形式に圧縮保存する"),
+    "view": ("spectralview", "NH9ファイルのスペクトルバンドを可視化する"),
+    "tags": ("tagcount", "メタデータのタグを集計してグラフにする"),
+    "stats": ("global_stats", "データセット全体のバンド統計量を集計する"),
+    "verify": ("verify_hdf5", "HDF5ファイルと元のNH9ファイルの値が一致するかを検証する"),
+}
+# 対話的な入力を行わないようにサブコマンドに渡す引数
+NON_INTERACTIVE_ARGS = {"convert": ["--no-input"]}
+
+def run_command(command, argv, prog=None):
+    """
+    サブコマンドのモジュールを読み込み、その `main` を実行する。
+
+    Args:
+        command (str): サブコマンド名 (COMMANDS のキー)。
+        argv (list of str): サブコマンドに渡す引数。
+        prog (str, optional): ヘルプに表示するプログラム名。
+
+    Returns:
+        None
+    """
+    module_name, _ = COMMANDS[command]
+    module = importlib.import_module(module_name)
+    module.main(NON_INTERACTIVE_ARGS.get(command, []) + list(argv), prog=prog)
+
+def main(argv=None):
+    """
+    NH9データ処理の各スクリプトをサブコマンドとして実行する統合CLI。
+
+    - サブコマンドのモジュール（cv2・h5py・matplotlib などの重い依存関係を含む）は、実行するサブコマンドのみ読み込む。
+    - --geometry でカメラのジオメトリを指定した場合は、camera.py に設定してからモジュールを読み込む
+      （全スクリプトが camera.py を通じて同じ値を使う）。
+    - 全てのオプションはコマンドラインで指定し、対話的な入力は行わない（view でファイルを省略した場合を除く）。
+
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+    """
+    commands = "\n".join(f"  {name:10}{description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        description="NH9ハイパースペクトルデータの処理ツール。",
+        epilog=f"サブコマンド:\n{commands}\n\n各サブコマンドのオプションは「%(prog)s <command> --help」で表示する。",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--geometry", metavar="H,W,B",
+                        help=f"カメラのジオメトリ（高さ,幅,バンド数）。既定は環境変数 {GEOMETRY_ENV} または "
+                             f"{','.join(map(str, DEFAULT_GEOMETRY))}。")
+    parser.add_argument("command", choices=COMMANDS, metavar="command", help="実行するサブコマンド。")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="サブコマンドの引数。")
+    args = parser.parse_args(argv)
+
+    if args.geometry:
+        try:
+            set_geometry(*parse_geometry(args.geometry))
+        except ValueError as e:
+            parser.error(str(e))
+    run_command(args.command, args.args, prog=f"{parser.prog} {args.command}")
+
+if __name__ == "__main__":
+    main()
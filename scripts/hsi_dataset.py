@@ -0,0 +1,384 @@
+import os
+import glob
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import h5py
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+from pack12 import unpack12, packed_length
+from mainCUI import PARTIAL_SUFFIX
+
+DEFAULT_PATCH_SIZE = 64
+DEFAULT_MAX_OPEN_FILES = 16
+
+def index_captures(paths, height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    HDF5ファイル（mainCUI.py の出力）とNH9ファイルから、すべてのキャプチャを列挙する。
+
+    - HDF5ファイルは直下の3次元データセットをキャプチャとする（書き込み途中のデータセットや統計量のグループは除く）。
+    - フォルダを指定した場合は、その下の *.h5 と *.nh9 を再帰的に探す。
+
+    Args:
+        paths (list of str): HDF5ファイル・NH9ファイル、またはそれらを含むフォルダのパス。
+        height (int): NH9ファイルの画像の高さ。
+        width (int): NH9ファイルの画像の幅。
+        bands (int): NH9ファイルのスペクトルのバンド数。
+
+    Returns:
+        list of dict: 各キャプチャの {"path", "dataset"（NH9ファイルの場合は None）, "height", "width", "bands"}。
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.h5"), recursive=True)))
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.nh9"), recursive=True)))
+        else:
+            files.append(path)
+
+    captures = []
+    for file_path in files:
+        if file_path.endswith(".nh9"):
+            captures.append({"path": file_path, "dataset": None, "height": height, "width": width, "bands": bands})
+            continue
+        with h5py.File(file_path, "r") as hdf5_file:
+            for name, dataset in hdf5_file.items():
+                if not isinstance(dataset, h5py.Dataset) or name.endswith(PARTIAL_SUFFIX) or dataset.ndim != 3:
+                    continue
+                shape = tuple(dataset.attrs.get("unpacked_shape", dataset.shape))
+                if dataset.attrs.get("layout", "bil") == "hwc":
+                    capture_height, capture_width, capture_bands = shape
+                else:
+                    capture_height, capture_bands, capture_width = shape
+                captures.append({"path": file_path, "dataset": name, "height": capture_height,
+                                 "width": capture_width, "bands": capture_bands})
+    return captures
+
+class FileHandlePool:
+    """
+    開いたファイル（h5py.File または NH9Cube）を保持する、上限付きのLRUプール。
+
+    - 上限を超えた場合は最も長く使われていないファイルを閉じる。
+    - 1つのスレッド内で使う（`HSIPatchDataset` はスレッドごとにプールを持つ）。
+
+    Args:
+        max_open (int, optional): 同時に開いておくファイル数の上限。デフォルトは16。
+        height (int): NH9ファイルの画像の高さ。
+        width (int): NH9ファイルの画像の幅。
+        bands (int): NH9ファイルのスペクトルのバンド数。
+    """
+
+    def __init__(self, max_open=DEFAULT_MAX_OPEN_FILES, height=HEIGHT, width=WIDTH, bands=BANDS):
+        self.max_open = max_open
+        self.geometry = (height, width, bands)
+        self._handles = OrderedDict()
+
+    def get(self, path):
+        """
+        ファイルを開いて返す（開いている場合はそのまま返す）。
+
+        Args:
+            path (str): HDF5ファイルまたはNH9ファイルのパス。
+
+        Returns:
+            h5py.File or NH9Cube: 開いたファイル。
+        """
+        handle = self._handles.get(path)
+        if handle is not None:
+            self._handles.move_to_end(path)
+            return handle
+        if path.endswith(".nh9"):
+            handle = NH9Cube(path, *self.geometry)
+        else:
+            handle = h5py.File(path, "r")
+        self._handles[path] = handle
+        while len(self._handles) > self.max_open:
+            _, evicted = self._handles.popitem(last=False)
+            evicted.close()
+        return handle
+
+    def close(self):
+        """
+        すべてのファイルを閉じる。
+        """
+        while self._handles:
+            _, handle = self._handles.popitem()
+            handle.close()
+
+def _band_selection(band_indices):
+    """
+    バンド番号の配列を、連続していればスライスに、そうでなければ昇順のリストに変換する。
+    """
+    start, stop = int(band_indices[0]), int(band_indices[-1]) + 1
+    if stop - start == len(band_indices):
+        return slice(start, stop)
+    return band_indices.tolist()
+
+def read_crop(handle, dataset_name, row, col, size, band_indices):
+    """
+    キャプチャから (バンド部分集合, パッチ) の切り出しを、必要なバイト範囲・チャンクのみ読み込む。
+
+    - NH9ファイル: メモリマップから、対象の行・バンドの列範囲のみを読み込む。
+    - HDF5ファイル: 保存形式 (bil / hwc) に応じたハイパースラブを読み込み、
+      12ビット詰めの場合は対象の列（またはバンド）範囲を含むバイト列のみを展開する。
+
+    Args:
+        handle (h5py.File or NH9Cube): 開いたファイル。
+        dataset_name (str or None): HDF5のデータセット名（NH9ファイルの場合は None）。
+        row (int): パッチの先頭行。
+        col (int): パッチの先頭列。
+        size (int): パッチの一辺の画素数。
+        band_indices (numpy.ndarray): 読み込むバンド番号（昇順）。
+
+    Returns:
+        numpy.ndarray: (バンド数, size, size) の uint16 配列。
+    """
+    rows = slice(row, row + size)
+    bands = _band_selection(band_indices)
+    if dataset_name is None:
+        return handle.data[rows, bands, col:col + size].transpose(1, 0, 2)
+
+    dataset = handle[dataset_name]
+    packed = dataset.attrs.get("packing") == "12bit"
+    if dataset.attrs.get("layout", "bil") == "bil":
+        if not packed:
+            return dataset[rows, bands, col:col + size].transpose(1, 0, 2)
+        start = col // 2 * 2
+        raw = dataset[rows, bands, start // 2 * 3:packed_length(col + size)]
+        return unpack12(raw)[:, :, col - start:col - start + size].transpose(1, 0, 2)
+
+    if not packed:
+        return dataset[rows, col:col + size, bands].transpose(2, 0, 1)
+    start = int(band_indices[0]) // 2 * 2
+    raw = dataset[rows, col:col + size, start // 2 * 3:packed_length(int(band_indices[-1]) + 1)]
+    return unpack12(raw)[:, :, band_indices - start].transpose(2, 0, 1)
+
+class HSIPatchDataset:
+    """
+    HDF5ファイル・NH9ファイルのすべてのキャプチャから、(パッチ, バンド部分集合) を切り出すデータセット。
+
+    - 各キャプチャを patch_size × patch_size のパッチの格子（間隔 stride）に分け、通し番号でアクセスする。
+    - 切り出しは必要なチャンク・バイト範囲のみを読み込み、フレーム全体は読み込まない。
+    - ファイルはスレッドごとのLRUプールで開いたままにする。
+
+    Args:
+        paths (list of str): HDF5ファイル・NH9ファイル、またはそれらを含むフォルダのパス。
+        patch_size (int, optional): パッチの一辺の画素数。デフォルトは64。
+        bands (sequence of int or slice, optional): 読み込むバンド。None の場合はすべてのバンド。
+        stride (int, optional): パッチの間隔。デフォルトは patch_size（重なりなし）。
+        height (int): NH9ファイルの画像の高さ。
+        width (int): NH9ファイルの画像の幅。
+        n_bands (int): NH9ファイルのスペクトルのバンド数。
+        max_open_files (int, optional): スレッドごとに開いておくファイル数の上限。
+    """
+
+    def __init__(self, paths, patch_size=DEFAULT_PATCH_SIZE, bands=None, stride=None,
+                 height=HEIGHT, width=WIDTH, n_bands=BANDS, max_open_files=DEFAULT_MAX_OPEN_FILES):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.patch_size = patch_size
+        self.stride = stride or patch_size
+        self.geometry = (height, width, n_bands)
+        self.max_open_files = max_open_files
+        self.captures = index_captures(self.paths, height, width, n_bands)
+
+        capture_bands = min((c["bands"] for c in self.captures), default=n_bands)
+        if bands is None:
+            bands = range(capture_bands)
+        elif isinstance(bands, slice):
+            bands = range(*bands.indices(capture_bands))
+        self.band_indices = np.unique(np.asarray(bands, dtype=np.intp))
+        if len(self.band_indices) == 0 or self.band_indices[-1] >= capture_bands:
+            raise ValueError(f"不正なバンド指定です (バンド数 {capture_bands})")
+
+        grid = [(max(0, (c["height"] - patch_size) // self.stride + 1),
+                 max(0, (c["width"] - patch_size) // self.stride + 1)) for c in self.captures]
+        self.grid = np.array(grid, dtype=np.int64).reshape(-1, 2)
+        self.offsets = np.concatenate([[0], np.cumsum(self.grid[:, 0] * self.grid[:, 1])])
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def patch_shape(self):
+        """tuple: 1つのパッチの形状 (バンド数, patch_size, patch_size)。"""
+        return (len(self.band_indices), self.patch_size, self.patch_size)
+
+    def locate(self, index):
+        """
+        通し番号をキャプチャとパッチの位置に変換する。
+
+        Args:
+            index (int): パッチの通し番号。
+
+        Returns:
+            tuple: (キャプチャ番号, 先頭行, 先頭列)。
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        capture = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        position = index - int(self.offsets[capture])
+        grid_row, grid_col = divmod(position, int(self.grid[capture, 1]))
+        return capture, grid_row * self.stride, grid_col * self.stride
+
+    def _pool(self):
+        pool = getattr(self._local, "pool", None)
+        if pool is None:
+            pool = self._local.pool = FileHandlePool(self.max_open_files, *self.geometry)
+        return pool
+
+    def read_patch(self, capture, row, col, out=None):
+        """
+        指定したキャプチャ・位置のパッチを読み込む。
+
+        Args:
+            capture (int): キャプチャ番号。
+            row (int): パッチの先頭行。
+            col (int): パッチの先頭列。
+            out (numpy.ndarray, optional): 書き込み先の (バンド数, patch_size, patch_size) の uint16 配列。
+
+        Returns:
+            numpy.ndarray: (バンド数, patch_size, patch_size) の uint16 配列。
+        """
+        info = self.captures[capture]
+        handle = self._pool().get(info["path"])
+        crop = read_crop(handle, info["dataset"], row, col, self.patch_size, self.band_indices)
+        if out is None:
+            return np.ascontiguousarray(crop)
+        np.copyto(out, crop)
+        return out
+
+    def __getitem__(self, index):
+        return self.read_patch(*self.locate(index))
+
+    def close(self):
+        """
+        このスレッドで開いたファイルを閉じる。
+        """
+        pool = getattr(self._local, "pool", None)
+        if pool is not None:
+            pool.close()
+
+_worker_state = {}
+
+def _init_process_worker(dataset, shm_name, shape):
+    """
+    プロセスワーカーの初期化: データセットを受け取り、バッチバッファの共有メモリに接続する。
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state["dataset"] = dataset
+    _worker_state["shm"] = shm
+    _worker_state["buffers"] = np.ndarray(shape, dtype=np.uint16, buffer=shm.buf)
+
+def _fill_batch(dataset, buffers, slot, indices):
+    """
+    バッチバッファの1スロットにパッチを読み込む。
+
+    Returns:
+        tuple: (スロット番号, (パッチ数, 3) の (キャプチャ番号, 先頭行, 先頭列) 配列)。
+    """
+    keys = np.empty((len(indices), 3), dtype=np.int64)
+    for i, index in enumerate(indices):
+        keys[i] = dataset.locate(index)
+        dataset.read_patch(*keys[i], out=buffers[slot, i])
+    return slot, keys
+
+def _fill_batch_in_process(slot, indices):
+    return _fill_batch(_worker_state["dataset"], _worker_state["buffers"], slot, indices)
+
+class PatchLoader:
+    """
+    `HSIPatchDataset` からバッチを先読みして返すローダー。
+
+    - depth 個先までのバッチをワーカー（スレッドまたはプロセス）で、使い回すバッチバッファのスロットに読み込む。
+    - プロセスの場合、バッファは共有メモリ上に確保するため、バッチをプロセス間でコピーしない。
+    - 返すバッチはバッファのビューで、次のバッチを要求した時点で再利用される（保持する場合はコピーする）。
+
+    Args:
+        dataset (HSIPatchDataset): パッチのデータセット。
+        batch_size (int, optional): 1バッチのパッチ数。デフォルトは32。
+        shuffle (bool, optional): エポックごとにパッチの順序をシャッフルするか。
+        seed (int, optional): シャッフルの乱数シード（エポックごとに 1 ずつ進める）。
+        workers (int, optional): ワーカー数。デフォルトは4。
+        depth (int, optional): 先読みするバッチ数。デフォルトは workers。
+        processes (bool, optional): ワーカーをプロセスにするか（HDF5の解凍を並列化したい場合）。
+        drop_last (bool, optional): 端数のバッチを捨てるか。
+    """
+
+    def __init__(self, dataset, batch_size=32, shuffle=True, seed=0, workers=4, depth=None, processes=False,
+                 drop_last=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.workers = max(1, workers)
+        self.depth = max(1, depth or self.workers)
+        self.processes = processes
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return -(-len(self.dataset) // self.batch_size)
+
+    def _batches(self):
+        order = np.arange(len(self.dataset))
+        if self.shuffle:
+            np.random.default_rng(self.seed + self.epoch).shuffle(order)
+        stop = len(self) * self.batch_size
+        return [order[start:min(start + self.batch_size, stop)] for start in range(0, stop, self.batch_size)]
+
+    def __iter__(self):
+        """
+        Yields:
+            tuple: ((パッチ数, バンド数, size, size) の uint16 配列, (パッチ数, 3) の (キャプチャ番号, 先頭行, 先頭列) 配列)。
+        """
+        batches = deque(self._batches())
+        self.epoch += 1
+        slots = self.depth + 1  # 先読み中 depth 個 + 呼び出し元が使用中の 1 個
+        shape = (slots, self.batch_size) + self.dataset.patch_shape
+
+        shm = None
+        if self.processes:
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 2)
+            buffers = np.ndarray(shape, dtype=np.uint16, buffer=shm.buf)
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_process_worker,
+                                           initargs=(self.dataset, shm.name, shape))
+            fill = _fill_batch_in_process
+        else:
+            buffers = np.empty(shape, dtype=np.uint16)
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            fill = lambda slot, indices: _fill_batch(self.dataset, buffers, slot, indices)
+
+        free = deque(range(slots))
+        pending = deque()
+        try:
+            while batches or pending:
+                while batches and len(pending) < self.depth:
+                    indices = batches.popleft()
+                    pending.append((len(indices), executor.submit(fill, free.popleft(), indices)))
+                count, future = pending.popleft()
+                slot, keys = future.result()
+                yield buffers[slot, :count], keys
+                free.append(slot)
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if not self.processes:
+                self.dataset.close()
+            if shm is not None:
+                del buffers
+                shm.close()
+                shm.unlink()
@@ -0,0 +1,396 @@
+import os
+import json
+import time
+import fnmatch
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import numpy as np
+
+DEFAULT_PROFILE_DIR = "profiles"
+ALL_GROUP = "/"  # 全体の集計のキー（フォルダ名に使えない文字のため、日付・場所フォルダ名のグループと衝突しない）
+
+class _Stage:
+    """
+    1回のステージの処理時間を計測し、終了時に FileTrace に加算するコンテキストマネージャ。
+
+    - 入出力のバイト数が処理後に分かる場合は、with ブロック内で bytes_in / bytes_out を設定する。
+    """
+
+    __slots__ = ("trace", "name", "bytes_in", "bytes_out", "_start")
+
+    def __init__(self, trace, name, bytes_in, bytes_out):
+        self.trace = trace
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self._start, self.bytes_in, self.bytes_out)
+        return False
+
+class FileTrace:
+    """
+    1ファイルの各ステージ（読み込み・計算・圧縮・書き込みなど）の処理時間と入出力バイト数を集計する。
+
+    - 同じステージを複数回（行ブロックごとなど）計測した場合は合計する。
+    - ワーカープロセスで作成し、`stages` をそのまま親プロセスに返して `merge` で結合できる。
+
+    Args:
+        file_path (str): 対象のファイルのパス。
+        group (str, optional): 集計のグループ名（場所フォルダ名など）。
+    """
+
+    def __init__(self, file_path, group=""):
+        self.file = file_path
+        self.group = group
+        self.stages = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name, bytes_in=0, bytes_out=0):
+        """
+        ステージの処理時間を計測するコンテキストマネージャを返す。
+
+        Args:
+            name (str): ステージ名。
+            bytes_in (int, optional): 入力のバイト数。
+            bytes_out (int, optional): 出力のバイト数。
+
+        Returns:
+            _Stage: with 文で使うコンテキストマネージャ。
+        """
+        return _Stage(self, name, bytes_in, bytes_out)
+
+    def add(self, name, seconds=0.0, bytes_in=0, bytes_out=0, calls=1):
+        """
+        ステージの処理時間と入出力バイト数を加算する。
+        """
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = {"seconds": 0.0, "bytes_in": 0, "bytes_out": 0, "calls": 0}
+            entry["seconds"] += seconds
+            entry["bytes_in"] += int(bytes_in)
+            entry["bytes_out"] += int(bytes_out)
+            entry["calls"] += calls
+
+    def merge(self, stages):
+        """
+        別の FileTrace の `stages`（ワーカープロセスの計測結果など）を結合する。
+        """
+        for name, entry in stages.items():
+            self.add(name, entry["seconds"], entry["bytes_in"], entry["bytes_out"], entry["calls"])
+
+    def record(self, status="ok", **extra):
+        """
+        実行ログの1レコード（JSONに変換できる辞書）を返す。
+
+        Args:
+            status (str, optional): 処理結果 ("ok", "failed" など)。
+            **extra: レコードに追加する項目。
+
+        Returns:
+            dict: type, file, group, status, wall_s（作成からの経過時間）, stages。
+        """
+        return {"type": "file", "file": self.file, "group": self.group, "status": status,
+                "wall_s": time.perf_counter() - self._start, "stages": self.stages, **extra}
+
+class _NullStage:
+    """計測を行わないステージ（無効時に共有する1つのインスタンス）。"""
+
+    bytes_in = 0
+    bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _NullTrace:
+    """計測を行わない FileTrace（無効時に使う）。"""
+
+    def stage(self, name, bytes_in=0, bytes_out=0):
+        return _NULL_STAGE
+
+    def add(self, name, seconds=0.0, bytes_in=0, bytes_out=0, calls=1):
+        pass
+
+    def merge(self, stages):
+        pass
+
+_NULL_STAGE = _NullStage()
+NULL_TRACE = _NullTrace()
+
+class RunRecorder:
+    """
+    1回の実行の、ファイルごとのステージ別の計測結果を記録する。
+
+    - 各ファイルの計測結果を JSONL の実行ログに1行ずつ書き出す（log_path を指定した場合）。
+    - 終了時 (`close`) にグループ（場所フォルダ）ごと・ステージごとのパーセンタイルとスループットを集計し、
+      実行ログに書き出して表示する。
+    - profile_patterns に一致するファイルは `profiled`（ワーカープロセスでは `profile_path` と `profile_to`）の範囲を
+      cProfile で計測し、profile_dir に保存する。
+    - 複数のスレッドから呼び出してよい。
+
+    Args:
+        log_path (str, optional): JSONL の実行ログのパス（追記）。
+        profile_patterns (list of str, optional): cProfile で計測するファイル名のパターン (fnmatch)。
+        profile_dir (str, optional): cProfile の結果 (.prof) を保存するフォルダ。
+        **run_info: 実行ログの先頭レコードに記録する実行条件。
+    """
+
+    enabled = True
+
+    def __init__(self, log_path=None, profile_patterns=None, profile_dir=DEFAULT_PROFILE_DIR, **run_info):
+        self.log_path = log_path
+        self.profile_patterns = list(profile_patterns or [])
+        self.profile_dir = profile_dir
+        self.records = []
+        self.profiles = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._log = open(log_path, "a", encoding="utf-8") if log_path else None
+        self._write({"type": "run", "started": datetime.now().isoformat(timespec="seconds"), **run_info})
+
+    def _write(self, record):
+        if self._log is not None:
+            self._log.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def file(self, file_path, group=""):
+        """
+        ファイルの計測を開始する。
+
+        Args:
+            file_path (str): 対象のファイルのパス。
+            group (str, optional): 集計のグループ名（場所フォルダ名など）。
+
+        Returns:
+            FileTrace: ステージの計測に使うトレース。
+        """
+        return FileTrace(file_path, group)
+
+    def finish(self, trace, status="ok", **extra):
+        """
+        ファイルの計測を終了し、実行ログに記録する。
+
+        Args:
+            trace (FileTrace): `file` で作成したトレース。
+            status (str, optional): 処理結果 ("ok", "failed" など)。
+            **extra: レコードに追加する項目。
+        """
+        self.add_record(trace.record(status, **extra))
+
+    def add_record(self, record):
+        """
+        計測結果のレコード（`FileTrace.record` の辞書）を記録する。
+        """
+        with self._lock:
+            self.records.append(record)
+            self._write(record)
+
+    def profile_path(self, file_path, stage=None):
+        """
+        ファイル名がパターンに一致する場合に、cProfile の結果の保存先を返す（ワーカープロセスに渡して使う）。
+
+        Args:
+            file_path (str): 対象のファイルのパス。
+            stage (str, optional): 別々のスレッドで処理するステージを個別に計測する場合のステージ名。
+
+        Returns:
+            str or None: 「<profile_dir>/<ファイル名>[.<stage>].prof」。一致しない場合は None。
+        """
+        name = os.path.basename(file_path)
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in self.profile_patterns):
+            return None
+        path = os.path.join(self.profile_dir, name + (f".{stage}" if stage else "") + ".prof")
+        with self._lock:
+            self.profiles.append(path)
+        return path
+
+    def profiled(self, file_path, stage=None):
+        """
+        ファイル名がパターンに一致する場合に、with ブロックの処理を cProfile で計測するコンテキストマネージャを返す。
+
+        Args:
+            file_path (str): 対象のファイルのパス。
+            stage (str, optional): ステージ名（`profile_path` を参照）。
+
+        Returns:
+            contextmanager: 一致しない場合は何もしないコンテキストマネージャ。
+        """
+        return profile_to(self.profile_path(file_path, stage))
+
+    def summary(self):
+        """
+        グループごと（と全体 ALL_GROUP）・ステージごとの集計を返す。
+
+        Returns:
+            dict: {グループ名: {"files", "failed", "stages": {ステージ名: {"total_s", "p50_s", "p90_s", "p99_s",
+                "bytes_in", "bytes_out", "mb_s_in", "mb_s_out"}}}}。ステージ "file" はファイル全体の経過時間。
+        """
+        with self._lock:
+            records = list(self.records)
+        groups = {}
+        for record in records:
+            for group in (ALL_GROUP, record["group"]):
+                entry = groups.setdefault(group, {"files": 0, "failed": 0, "stages": {}})
+                entry["files"] += 1
+                entry["failed"] += record["status"] != "ok"
+                stages = dict(record["stages"], file={"seconds": record["wall_s"], "bytes_in": 0, "bytes_out": 0})
+                for name, stage in stages.items():
+                    collected = entry["stages"].setdefault(name, {"seconds": [], "bytes_in": 0, "bytes_out": 0})
+                    collected["seconds"].append(stage["seconds"])
+                    collected["bytes_in"] += stage["bytes_in"]
+                    collected["bytes_out"] += stage["bytes_out"]
+            if not record["group"]:
+                groups.pop("", None)
+
+        summary = {}
+        for group, entry in groups.items():
+            stages = {}
+            for name, collected in entry["stages"].items():
+                seconds = np.array(collected["seconds"])
+                total = float(seconds.sum())
+                p50, p90, p99 = np.percentile(seconds, (50, 90, 99))
+                stages[name] = {
+                    "total_s": total,
+                    "p50_s": float(p50),
+                    "p90_s": float(p90),
+                    "p99_s": float(p99),
+                    "bytes_in": collected["bytes_in"],
+                    "bytes_out": collected["bytes_out"],
+                    "mb_s_in": collected["bytes_in"] / 2**20 / total if total else None,
+                    "mb_s_out": collected["bytes_out"] / 2**20 / total if total else None,
+                }
+            summary[group] = {"files": entry["files"], "failed": entry["failed"], "stages": stages}
+        return summary
+
+    def close(self):
+        """
+        集計を実行ログに書き出して表示し、実行ログを閉じる。
+
+        Returns:
+            dict: `summary` の集計。
+        """
+        summary = self.summary()
+        self._write({"type": "summary", "wall_s": time.perf_counter() - self._start, "groups": summary,
+                     "profiles": self.profiles})
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        print(format_summary(summary))
+        for path in self.profiles:
+            print(f"Profile saved: {path}")
+        return summary
+
+class NullRecorder:
+    """
+    計測を行わない RunRecorder（計測が無効な場合に使い、呼び出し側のオーバーヘッドをほぼなくす）。
+    """
+
+    enabled = False
+
+    def file(self, file_path, group=""):
+        return NULL_TRACE
+
+    def finish(self, trace, status="ok", **extra):
+        pass
+
+    def add_record(self, record):
+        pass
+
+    def profile_path(self, file_path, stage=None):
+        return None
+
+    def profiled(self, file_path, stage=None):
+        return nullcontext()
+
+    def summary(self):
+        return {}
+
+    def close(self):
+        return {}
+
+NULL_RECORDER = NullRecorder()
+
+@contextmanager
+def _profile(path):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        profiler.dump_stats(path)
+
+def profile_to(path):
+    """
+    with ブロックの処理を cProfile で計測し、path に保存するコンテキストマネージャを返す。
+
+    - cProfile は呼び出したスレッドのみを計測する（先読みスレッドなどの処理は含まない）。
+
+    Args:
+        path (str or None): 保存先の .prof ファイル（`python -m pstats` や snakeviz で確認できる）。
+            None の場合は何もしない。
+
+    Returns:
+        contextmanager: with 文で使うコンテキストマネージャ。
+    """
+    return nullcontext() if path is None else _profile(path)
+
+def open_recorder(log_path=None, profile_patterns=None, profile_dir=DEFAULT_PROFILE_DIR, **run_info):
+    """
+    実行ログまたはプロファイルが指定された場合は RunRecorder を、そうでなければ NULL_RECORDER を返す。
+
+    Args:
+        log_path (str, optional): JSONL の実行ログのパス。
+        profile_patterns (list of str, optional): cProfile で計測するファイル名のパターン。
+        profile_dir (str, optional): cProfile の結果を保存するフォルダ。
+        **run_info: 実行ログの先頭レコードに記録する実行条件。
+
+    Returns:
+        RunRecorder or NullRecorder: 記録先。
+    """
+    if not log_path and not profile_patterns:
+        return NULL_RECORDER
+    return RunRecorder(log_path, profile_patterns, profile_dir, **run_info)
+
+def group_label(group):
+    """
+    グループ名を表示用の文字列にする（全体は "(all)"、ルート直下のファイルは "(root)"）。
+
+    Args:
+        group (str): グループ名。
+
+    Returns:
+        str: 表示用のグループ名。
+    """
+    if group == ALL_GROUP:
+        return "(all)"
+    return group or "(root)"
+
+def format_summary(summary):
+    """
+    `RunRecorder.summary` の集計を表形式の文字列にする。
+
+    Returns:
+        str: グループ・ステージごとの合計時間、p50/p90/p99（ミリ秒）、入出力のスループット。
+    """
+    lines = []
+    for group in sorted(summary, key=lambda g: (g != ALL_GROUP, g)):
+        entry = summary[group]
+        lines.append(f"[{group_label(group)}] {entry['files']} files ({entry['failed']} failed)")
+        for name, stage in entry["stages"].items():
+            mb_in = f"{stage['mb_s_in']:8.1f} MB/s in " if stage["mb_s_in"] else " " * 17
+            mb_out = f"{stage['mb_s_out']:8.1f} MB/s out" if stage["mb_s_out"] else ""
+            lines.append(f"  {name:14} total {stage['total_s']:8.2f}s  p50 {stage['p50_s'] * 1e3:8.1f}ms  "
+                         f"p90 {stage['p90_s'] * 1e3:8.1f}ms  p99 {stage['p99_s'] * 1e3:8.1f}ms  {mb_in}{mb_out}")
+    return "\n".join(lines)
@@ -1,44 +1,381 @@
 import os
+import sys
+import zlib
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
 import h5py
 from tqdm import tqdm
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+from prefetch import PrefetchPipeline, DEFAULT_DEPTH
+from manifest import Manifest
+from pack12 import pack12, unpack12, packed_length
+from bandstats import accumulate_bil, write_stats_group
+from instrument import FileTrace, NULL_TRACE, NULL_RECORDER, open_recorder
 
 IGNORE_FOLDERS = ['.Spotlight-V100', '.fseventsd', 'System Volume Information', '$RECYCLE.BIN']
 
-def convert_nh9_to_npy(nh9_file):
+LAYOUTS = ("bil", "hwc")  # bil: (height, bands, width), hwc: (height, width, bands)
+CHUNK_PRESETS = ("band", "patch")
+COMPRESSIONS = ("gzip", "lzf", "none")
+PARTIAL_SUFFIX = ".partial"  # 書き込み途中のデータセット名に付ける接尾辞
+STATS_GROUP = "band_stats"  # バンド統計量を保存するグループ（キャプチャごとのサブグループ）
+STORAGE_ATTR = "storage"  # 保存設定 (JSON) を記録するファイルの属性
+
+def dataset_shape(layout, height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    保存形式に応じたデータセットの形状を返す。
+
+    Args:
+        layout (str): "bil" (height, bands, width) または "hwc" (height, width, bands)。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+
+    Returns:
+        tuple: データセットの形状。
+    """
+    if layout == "bil":
+        return (height, bands, width)
+    if layout == "hwc":
+        return (height, width, bands)
+    raise ValueError(f"不明な保存形式です: {layout}")
+
+def resolve_chunks(layout, chunks, height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    チャンク形状を決定する。
+
+    - "band": 1バンド分の画像を少ないチャンクで読めるよう、バンド方向を1にしたチャンク。
+    - "patch": 空間パッチ (64×64) の全バンドを1チャンクで読めるチャンク。
+    - タプルを指定した場合はそのまま使用する（データセット形状を超える分は切り詰める）。
+
+    Args:
+        layout (str): 保存形式 ("bil" または "hwc")。
+        chunks (str or tuple): チャンクのプリセット名、またはチャンク形状。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+
+    Returns:
+        tuple: チャンク形状。
+    """
+    if chunks == "band":
+        chunks = (64, 1, width) if layout == "bil" else (128, 256, 1)
+    elif chunks == "patch":
+        chunks = (64, bands, 64) if layout == "bil" else (64, 64, bands)
+    elif isinstance(chunks, str):
+        raise ValueError(f"不明なチャンクのプリセットです: {chunks}")
+    shape = dataset_shape(layout, height, width, bands)
+    return tuple(max(1, min(c, n)) for c, n in zip(chunks, shape))
+
+def hdf5_storage_options(layout="bil", chunks="band", compression="gzip", gzip_level=4, shuffle=True,
+                         height=HEIGHT, width=WIDTH, bands=BANDS, pack=False):
+    """
+    HDF5データセットの保存設定を作成する。
+
+    Args:
+        layout (str, optional): 保存形式 ("bil" または "hwc")。デフォルトは "bil"。
+        chunks (str or tuple, optional): チャンクのプリセット名 ("band", "patch") またはチャンク形状。
+        compression (str, optional): 圧縮方式 ("gzip", "lzf", "none")。デフォルトは "gzip"。
+        gzip_level (int, optional): gzip の圧縮レベル (1-9)。デフォルトは4。
+        shuffle (bool, optional): shuffle フィルタを使用するか。デフォルトは True。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        pack (bool, optional): 圧縮の前処理として12ビット詰め (2画素 → 3バイト) を行うか。
+            有効な場合、データセットは最終軸を詰めた uint8 配列として保存される。
+
+    Returns:
+        dict: "layout", "geometry" (height, width, bands), "pack12" と `create_dataset` に渡す
+        キーワード引数をまとめた辞書。
     """
-    NH9ファイルをNumPy配列（npy形式）に変換する。
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"不明な圧縮方式です: {compression}")
+    shape = dataset_shape(layout, height, width, bands)
+    chunk_shape = resolve_chunks(layout, chunks, height, width, bands)
+    if pack:
+        shape = shape[:-1] + (packed_length(shape[-1]),)
+        chunk_shape = chunk_shape[:-1] + (min(packed_length(chunk_shape[-1]), shape[-1]),)
+    options = {
+        "layout": layout,
+        "geometry": (height, width, bands),
+        "pack12": pack,
+        "shape": shape,
+        "dtype": np.uint8 if pack else np.uint16,
+        "chunks": chunk_shape,
+        "shuffle": shuffle,
+    }
+    if compression == "gzip":
+        options["compression"] = "gzip"
+        options["compression_opts"] = gzip_level
+    elif compression == "lzf":
+        options["compression"] = "lzf"
+    return options
+
+def convert_nh9_to_npy(nh9_file, layout="bil", height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    NH9ファイルを12ビット値を保持した uint16 の3次元NumPy配列に変換する。
 
     Args:
         nh9_file (str): 変換するNH9ファイルのパス。
+        layout (str, optional): "bil" (height, bands, width) または "hwc" (height, width, bands)。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
 
     Returns:
         numpy.ndarray or None: 変換されたNumPy配列。エラーが発生した場合は None を返す。
     """
     try:
-        with open(nh9_file, 'rb') as file:
-            data = np.fromfile(file, dtype=np.float32)
-        return data
+        cube = NH9Cube(nh9_file, height, width, bands)
+        if layout == "hwc":
+            return np.ascontiguousarray(cube.to_hwc())
+        return cube.read_rows(0, height)
     except Exception as e:
         print(f"エラー: {nh9_file} の変換中に問題が発生しました: {e}")
         return None
 
-def process_files_in_folder(location_folder_path, date_folder_name, location_folder_name, output_root):
+def create_capture_dataset(hdf5_file, dataset_name, data, storage):
+    """
+    1キャプチャ分のデータセットを保存設定に従って作成する。
+
+    Args:
+        hdf5_file (h5py.File or h5py.Group): 書き込み先。
+        dataset_name (str): データセット名。
+        data (numpy.ndarray or None): 保存するデータ（`prepare_capture` で変換済みのもの）。
+            None の場合は空のデータセットを作成する（チャンクの直接書き込み用）。
+        storage (dict): `hdf5_storage_options` で作成した保存設定。
+
+    Returns:
+        h5py.Dataset: 作成したデータセット。
+    """
+    options = {key: value for key, value in storage.items() if key not in ("layout", "geometry", "pack12")}
+    dataset = hdf5_file.create_dataset(dataset_name, data=data, **options)
+    dataset.attrs["layout"] = storage["layout"]
+    if storage["pack12"]:
+        dataset.attrs["packing"] = "12bit"
+        dataset.attrs["unpacked_shape"] = dataset_shape(storage["layout"], *storage["geometry"])
+    return dataset
+
+def prepare_capture(data, storage):
+    """
+    保存設定に従って、保存前のデータを変換する（12ビット詰めが有効な場合は詰める）。
+
+    Args:
+        data (numpy.ndarray): 保存形式と同じ形状の uint16 配列。
+        storage (dict): `hdf5_storage_options` で作成した保存設定。
+
+    Returns:
+        numpy.ndarray: データセットに書き込む配列。
+    """
+    return pack12(data) if storage["pack12"] else data
+
+def read_capture(dataset):
+    """
+    データセットを読み込み、12ビット詰めで保存されている場合は uint16 に展開する。
+
+    Args:
+        dataset (h5py.Dataset): 読み込むデータセット。
+
+    Returns:
+        numpy.ndarray: 保存形式 (layout 属性) と同じ形状の uint16 配列。
+    """
+    data = dataset[...]
+    if dataset.attrs.get("packing") == "12bit":
+        return unpack12(data, int(dataset.attrs["unpacked_shape"][-1]))
+    return data
+
+def storage_signature(storage):
+    """
+    保存設定のうち、1つのHDF5ファイル内で揃っている必要がある項目を返す。
+
+    Args:
+        storage (dict): `hdf5_storage_options` で作成した保存設定。
+
+    Returns:
+        dict: layout, geometry, pack12, chunks, compression, compression_opts, shuffle（JSONで保存できる値）。
+    """
+    return {
+        "layout": storage["layout"],
+        "geometry": [int(n) for n in storage["geometry"]],
+        "pack12": bool(storage["pack12"]),
+        "chunks": [int(n) for n in storage["chunks"]],
+        "compression": storage.get("compression"),
+        "compression_opts": storage.get("compression_opts"),
+        "shuffle": bool(storage["shuffle"]),
+    }
+
+def dataset_storage_signature(dataset):
+    """
+    既存のデータセットの属性とフィルタから、`storage_signature` と同じ形式の保存設定を求める
+    （STORAGE_ATTR を記録する前に作成されたHDF5ファイル用）。
+
+    Args:
+        dataset (h5py.Dataset): `create_capture_dataset` で作成したデータセット。
+
+    Returns:
+        dict: `storage_signature` と同じキーを持つ辞書。
+    """
+    layout = dataset.attrs.get("layout", "bil")
+    if isinstance(layout, bytes):
+        layout = layout.decode()
+    pack = dataset.attrs.get("packing") == "12bit"
+    shape = tuple(int(n) for n in dataset.attrs["unpacked_shape"]) if pack else dataset.shape
+    height, axis1, axis2 = shape
+    geometry = [height, axis2, axis1] if layout == "bil" else [height, axis1, axis2]
+    return {
+        "layout": layout,
+        "geometry": geometry,
+        "pack12": pack,
+        "chunks": [int(n) for n in dataset.chunks] if dataset.chunks else None,
+        "compression": dataset.compression,
+        "compression_opts": dataset.compression_opts,
+        "shuffle": bool(dataset.shuffle),
+    }
+
+def stored_storage_signature(hdf5_file):
+    """
+    HDF5ファイルに記録された保存設定を返す。記録がない場合は既存のデータセットから求める。
+
+    Args:
+        hdf5_file (h5py.File): HDF5ファイル。
+
+    Returns:
+        dict or None: `storage_signature` と同じ形式の保存設定。記録もデータセットもない場合は None。
+    """
+    if STORAGE_ATTR in hdf5_file.attrs:
+        return json.loads(hdf5_file.attrs[STORAGE_ATTR])
+    for name, item in hdf5_file.items():
+        if isinstance(item, h5py.Dataset) and not name.endswith(PARTIAL_SUFFIX):
+            return dataset_storage_signature(item)
+    return None
+
+def open_incremental_hdf5(hdf5_file_path, use_hash=False, rebuild=False, storage=None):
+    """
+    HDF5ファイルを追記モードで開き、対応するマニフェストを読み込む。
+
+    - 前回中断した実行が残した書き込み途中のデータセット (PARTIAL_SUFFIX) を削除する。
+    - マニフェストに記録があってもHDF5内に存在しないデータセットは記録から外す。
+    - rebuild の場合はHDF5ファイルを作り直し、マニフェストも空にする。
+    - storage を指定した場合は、保存設定（保存形式・チャンク形状・圧縮方式・12ビット詰め）をファイルの属性に
+      記録する。既存のファイルの保存設定と異なる場合は、1つのファイルに異なる形式が混ざらないよう追記しない。
+
+    Args:
+        hdf5_file_path (str): HDF5ファイルのパス。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): 既存の内容を破棄して作り直すか。
+        storage (dict, optional): `hdf5_storage_options` で作成した保存設定。
+
+    Returns:
+        tuple: (h5py.File, Manifest)。
+
+    Raises:
+        ValueError: 既存のHDF5ファイルの保存設定が storage と異なる場合（rebuild の場合を除く）。
+    """
+    manifest = Manifest(f"{hdf5_file_path}.manifest.json", use_hash)
+    hdf5_file = h5py.File(hdf5_file_path, 'w' if rebuild else 'a')
+    if rebuild:
+        manifest.clear()
+    if storage is not None:
+        expected = storage_signature(storage)
+        stored = stored_storage_signature(hdf5_file)
+        if stored is not None and stored != expected:
+            hdf5_file.close()
+            changed = ", ".join(f"{key}: {stored.get(key)} -> {value}" for key, value in expected.items()
+                                if stored.get(key) != value)
+            raise ValueError(f"{hdf5_file_path} は異なる保存設定で作成されています ({changed})。"
+                             f"作り直す場合は --rebuild を指定してください。")
+        hdf5_file.attrs[STORAGE_ATTR] = json.dumps(expected)
+    for name in list(hdf5_file):
+        if name.endswith(PARTIAL_SUFFIX):
+            print(f"警告: 書き込み途中のデータセット {name} を削除します。")
+            del hdf5_file[name]
+    for key in list(manifest.entries):
+        if manifest.entries[key].get("dataset") not in hdf5_file:
+            manifest.discard(key)
+    return hdf5_file, manifest
+
+def select_pending_files(location_folder_path, nh9_files, hdf5_file, manifest):
+    """
+    新規または変更されたNH9ファイルのみを選ぶ。
+
+    Args:
+        location_folder_path (str): NH9ファイルが含まれるフォルダのパス。
+        nh9_files (list of str): NH9ファイル名のリスト。
+        hdf5_file (h5py.File): 出力先のHDF5ファイル。
+        manifest (Manifest): 出力先のマニフェスト。
+
+    Returns:
+        list of str: 変換が必要なNH9ファイル名のリスト。
+    """
+    return [
+        nh9_file for nh9_file in nh9_files
+        if not (manifest.is_current(nh9_file, os.path.join(location_folder_path, nh9_file))
+                and os.path.splitext(nh9_file)[0] in hdf5_file)
+    ]
+
+def commit_capture(hdf5_file, nh9_file, location_folder_path, manifest, band_stats=None):
+    """
+    書き込みが完了したデータセットを正式な名前に置き換え、マニフェストに記録する。
+
+    Args:
+        hdf5_file (h5py.File): 出力先のHDF5ファイル。
+        nh9_file (str): NH9ファイル名。
+        location_folder_path (str): NH9ファイルが含まれるフォルダのパス。
+        manifest (Manifest): 出力先のマニフェスト。
+        band_stats (dict, optional): キャプチャのバンド統計量。指定した場合は
+            「STATS_GROUP/データセット名」のグループに書き込む。
+
+    Returns:
+        None
+    """
+    dataset_name = os.path.splitext(nh9_file)[0]
+    if band_stats is not None:
+        write_stats_group(hdf5_file.require_group(f"{STATS_GROUP}/{dataset_name}"), band_stats)
+    if dataset_name in hdf5_file:
+        del hdf5_file[dataset_name]
+    hdf5_file.move(dataset_name + PARTIAL_SUFFIX, dataset_name)
+    hdf5_file.flush()
+    manifest.record(nh9_file, os.path.join(location_folder_path, nh9_file), dataset=dataset_name)
+    manifest.maybe_save()
+
+def process_files_in_folder(location_folder_path, date_folder_name, location_folder_name, output_root,
+                            prefetch_depth=DEFAULT_DEPTH, storage=None, use_hash=False, rebuild=False,
+                            band_stats=False, recorder=NULL_RECORDER):
     """
     指定された場所フォルダ内のNH9ファイルをHDF5形式で圧縮保存する。
 
     - HDF5ファイルは、場所フォルダ名と日付フォルダ名を組み合わせたファイル名で保存される。
     - 各NH9ファイルは、HDF5内のデータセットとして保存される。
+    - 各データセットは uint16 の3次元配列として、storage のチャンク形状・圧縮方式で保存される。
+    - HDF5ファイルは追記モードで開き、マニフェストと一致しない（新規・変更された）NH9ファイルのみ変換する。
+    - データセットは一時的な名前で書き込み、完了後に正式な名前へ置き換えるため、
+      中断しても書き込み途中のデータセットは次回の実行で削除・再変換される。
+    - NH9ファイルはバックグラウンドスレッドで prefetch_depth ファイル先まで先読みし、
+      HDF5への圧縮・書き込みは専用の書き込みスレッドで行う。
+    - band_stats の場合は、読み込んだデータからバンド統計量も集計して STATS_GROUP に保存する。
+    - recorder を指定した場合は、ファイルごとの読み込み・統計量・12ビット詰め・圧縮/書き込み・確定の
+      処理時間と入出力バイト数を記録する（場所フォルダ名をグループとして集計する）。
 
     Args:
         location_folder_path (str): NH9ファイルが含まれるフォルダのパス。
         date_folder_name (str): 日付フォルダ名（例: 08022024）。
         location_folder_name (str): 場所フォルダ名。
         output_root (str): HDF5ファイルの保存先ディレクトリ。
+        prefetch_depth (int, optional): 先読みするファイル数。デフォルトは2。
+        storage (dict, optional): `hdf5_storage_options` で作成した保存設定。デフォルトは
+            BIL形式・バンド単位のチャンク・gzip (レベル4) + shuffle。
+        use_hash (bool, optional): 変更検出にサイズ・更新時刻に加えて高速ハッシュを使用するか。
+        rebuild (bool, optional): 既存のHDF5ファイルとマニフェストを破棄して作り直すか。
+        band_stats (bool, optional): バンド統計量も保存するか。
+        recorder (RunRecorder, optional): 計測の記録先（`instrument.open_recorder`）。
 
     Returns:
         None
     """
+    if storage is None:
+        storage = hdf5_storage_options()
     try:
         hdf5_filename = f"{location_folder_name}_{date_folder_name}.h5"
         hdf5_file_path = os.path.join(output_root, hdf5_filename)
@@ -50,20 +387,70 @@ def process_files_in_folder(location_folder_path, date_folder_name, location_fol
             print(f"警告: {location_folder_path} にNH9ファイルが見つかりません。")
             return
 
-        with h5py.File(hdf5_file_path, 'w') as hdf5_file:
-            for nh9_file in tqdm(nh9_files, desc=f"Processing {location_folder_name}", unit="file"):
+        hdf5_file, manifest = open_incremental_hdf5(hdf5_file_path, use_hash, rebuild, storage)
+        with hdf5_file:
+            pending_files = select_pending_files(location_folder_path, nh9_files, hdf5_file, manifest)
+            if len(pending_files) < len(nh9_files):
+                print(f"変換済みの {len(nh9_files) - len(pending_files)} ファイルをスキップします。")
+
+            traces = {}
+
+            def load(nh9_file):
                 nh9_path = os.path.join(location_folder_path, nh9_file)
-                npy_data = convert_nh9_to_npy(nh9_path)
-                if npy_data is not None:
+                trace = traces[nh9_file] = recorder.file(nh9_path, location_folder_name)
+                with recorder.profiled(nh9_path, "load"):
+                    with trace.stage("read") as stage:
+                        data = convert_nh9_to_npy(nh9_path, storage["layout"], *storage["geometry"])
+                        stage.bytes_in = 0 if data is None else data.nbytes
+                    if data is None:
+                        return None
+                    stats = None
+                    if band_stats:
+                        with trace.stage("stats", bytes_in=data.nbytes):
+                            bil_data = data.transpose(0, 2, 1) if storage["layout"] == "hwc" else data
+                            stats = accumulate_bil(bil_data).result()
+                    if storage["pack12"]:
+                        with trace.stage("pack", bytes_in=data.nbytes) as stage:
+                            data = prepare_capture(data, storage)
+                            stage.bytes_out = data.nbytes
+                    return data, stats
+
+            def write(nh9_file, loaded):
+                trace = traces.pop(nh9_file)
+                if loaded is not None:
+                    npy_data, stats = loaded
                     dataset_name = os.path.splitext(nh9_file)[0]
-                    hdf5_file.create_dataset(dataset_name, data=npy_data, compression="gzip")
+                    with recorder.profiled(os.path.join(location_folder_path, nh9_file), "write"):
+                        with trace.stage("compress+write", bytes_in=npy_data.nbytes) as stage:
+                            dataset = create_capture_dataset(hdf5_file, dataset_name + PARTIAL_SUFFIX, npy_data,
+                                                             storage)
+                            stage.bytes_out = dataset.id.get_storage_size()
+                        with trace.stage("commit"):
+                            commit_capture(hdf5_file, nh9_file, location_folder_path, manifest, stats)
+                    recorder.finish(trace)
                 else:
+                    recorder.finish(trace, "failed")
                     print(f"エラー: {nh9_file} のデータセット作成に失敗しました。")
+
+            def on_error(nh9_file, e):
+                trace = traces.pop(nh9_file, None)
+                if trace is not None:
+                    recorder.finish(trace, "failed", error=str(e))
+                print(f"エラー: {nh9_file} の処理中に問題が発生しました: {e}")
+
+            pipeline = PrefetchPipeline(load, None, write, depth=prefetch_depth, on_error=on_error)
+            try:
+                with tqdm(total=len(pending_files), desc=f"Processing {location_folder_name}", unit="file") as progress:
+                    stats = pipeline.run(pending_files, progress)
+            finally:
+                manifest.save()
         print(f"完了: HDF5ファイルを生成しました -> {hdf5_file_path}")
+        print(f"パイプライン統計: {stats.summary()}")
     except Exception as e:
         print(f"エラー: {location_folder_path} の処理中に問題が発生しました: {e}")
 
-def process_date_folder(date_folder_path, output_root):
+def process_date_folder(date_folder_path, output_root, prefetch_depth=DEFAULT_DEPTH, storage=None,
+                        use_hash=False, rebuild=False, band_stats=False, recorder=NULL_RECORDER):
     """
     指定された日付フォルダ内の場所フォルダを探索し、NH9ファイルをHDF5に変換する。
 
@@ -73,6 +460,12 @@ def process_date_folder(date_folder_path, output_root):
     Args:
         date_folder_path (str): 日付フォルダのパス。
         output_root (str): HDF5ファイルを保存するルートフォルダ。
+        prefetch_depth (int, optional): 先読みするファイル数。デフォルトは2。
+        storage (dict, optional): `hdf5_storage_options` で作成した保存設定。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): 既存のHDF5ファイルを破棄して作り直すか。
+        band_stats (bool, optional): バンド統計量も保存するか。
+        recorder (RunRecorder, optional): 計測の記録先。
 
     Returns:
         None
@@ -88,24 +481,372 @@ def process_date_folder(date_folder_path, output_root):
         for location_folder in location_folders:
             location_folder_path = os.path.join(date_folder_path, location_folder)
             print(f"場所フォルダを処理中: {location_folder_path}")
-            process_files_in_folder(location_folder_path, date_folder_name, location_folder, output_root)
+            process_files_in_folder(location_folder_path, date_folder_name, location_folder, output_root,
+                                    prefetch_depth, storage, use_hash, rebuild, band_stats, recorder)
     except Exception as e:
         print(f"エラー: 日付フォルダ {date_folder_path} の処理中に問題が発生しました: {e}")
 
-if __name__ == "__main__":
+def encode_chunk(chunk, storage):
+    """
+    1チャンク分のデータを、HDF5のフィルタパイプライン (shuffle → deflate) と同じ形式に符号化する。
+
+    Args:
+        chunk (numpy.ndarray): チャンク形状の配列 (uint16、12ビット詰めの場合は uint8)。
+        storage (dict): `hdf5_storage_options` で作成した保存設定（gzip または無圧縮）。
+
+    Returns:
+        bytes: `write_direct_chunk` にそのまま渡せるバイト列。
+    """
+    raw = np.ascontiguousarray(chunk).view(np.uint8)
+    if storage["shuffle"]:
+        raw = raw.reshape(-1, chunk.dtype.itemsize).T
+    data = raw.tobytes()
+    if storage.get("compression") == "gzip":
+        data = zlib.compress(data, storage["compression_opts"])
+    return data
+
+def compress_row_block(nh9_path, row_start, storage, band_stats=False, timed=False):
+    """
+    NH9ファイルのチャンク1段分の行を読み込み、各チャンクを圧縮する（プロセスプールのワーカーで実行）。
+
+    - 端のチャンクはHDF5の仕様に合わせてチャンク形状までゼロで埋める。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        row_start (int): 読み込む先頭行（チャンクの行方向の境界）。
+        storage (dict): `hdf5_storage_options` で作成した保存設定。
+        band_stats (bool, optional): 読み込んだ行のバンド統計量も集計するか。
+        timed (bool, optional): 読み込み・統計量・12ビット詰め・圧縮（hwc の転置を含む）の処理時間と
+            入出力バイト数を計測するか。
+
+    Returns:
+        tuple: ((チャンクのオフセット, 圧縮済みバイト列) のリスト,
+            `BandStatsAccumulator`（band_stats でない場合は None）,
+            ステージごとの計測結果 `FileTrace.stages`（timed でない場合は None）)。
+    """
+    height, width, bands = storage["geometry"]
+    chunks = storage["chunks"]
+    row_stop = min(row_start + chunks[0], height)
+    trace = FileTrace(nh9_path) if timed else NULL_TRACE
+    with trace.stage("read") as stage:
+        block = NH9Cube(nh9_path, height, width, bands).read_rows(row_start, row_stop)
+        stage.bytes_in = block.nbytes
+    accumulator = None
+    if band_stats:
+        with trace.stage("stats", bytes_in=block.nbytes):
+            accumulator = accumulate_bil(block)
+    if storage["layout"] == "hwc":
+        block = block.transpose(0, 2, 1)
+    if storage["pack12"]:
+        with trace.stage("pack", bytes_in=block.nbytes) as stage:
+            block = prepare_capture(block, storage)
+            stage.bytes_out = block.nbytes
+
+    encoded = []
+    padded = np.zeros(chunks, dtype=storage["dtype"])
+    with trace.stage("compress", bytes_in=block.nbytes) as stage:
+        for start1 in range(0, block.shape[1], chunks[1]):
+            for start2 in range(0, block.shape[2], chunks[2]):
+                piece = block[:, start1:start1 + chunks[1], start2:start2 + chunks[2]]
+                if piece.shape != chunks:
+                    padded[...] = 0
+                    padded[:piece.shape[0], :piece.shape[1], :piece.shape[2]] = piece
+                    piece = padded
+                encoded.append(((row_start, start1, start2), encode_chunk(piece, storage)))
+        stage.bytes_out = sum(len(data) for _, data in encoded)
+    return encoded, accumulator, trace.stages if timed else None
+
+def check_parallel_storage(storage):
+    """
+    並列圧縮モードで扱える保存設定かを確認する。
+
+    Args:
+        storage (dict): `hdf5_storage_options` で作成した保存設定。
+
+    Raises:
+        ValueError: LZF など、Python側で符号化できない圧縮方式が指定された場合。
+    """
+    if storage.get("compression") not in (None, "gzip"):
+        raise ValueError(f"並列圧縮モードは gzip または無圧縮のみ対応しています: {storage['compression']}")
+
+def process_files_in_folder_parallel(location_folder_path, date_folder_name, location_folder_name, output_root,
+                                     executor, max_pending, storage=None, use_hash=False, rebuild=False,
+                                     band_stats=False, recorder=NULL_RECORDER):
+    """
+    指定された場所フォルダ内のNH9ファイルを、プロセスプールで並列に圧縮してHDF5に保存する。
+
+    - 読み込みと圧縮はチャンク1段（行方向）単位でプロセスプールのワーカーが行う。
+    - HDF5への書き込みは呼び出し元スレッドのみが `write_direct_chunk` で行う（単一ライター）。
+    - 同時に処理中のタスク数を max_pending に制限し、メモリ使用量を抑える。
+    - `process_files_in_folder` と同様に、マニフェストと一致しないNH9ファイルのみ変換する。
+    - band_stats の場合は、ワーカーが行ごとに集計したバンド統計量を結合して STATS_GROUP に保存する。
+    - recorder を指定した場合は、ワーカーが行ごとに計測した処理時間をファイルごとに結合し、
+      HDF5への書き込み・確定の時間とあわせて記録する（各ステージの時間はワーカーの合計時間）。
+
+    Args:
+        location_folder_path (str): NH9ファイルが含まれるフォルダのパス。
+        date_folder_name (str): 日付フォルダ名（例: 08022024）。
+        location_folder_name (str): 場所フォルダ名。
+        output_root (str): HDF5ファイルの保存先ディレクトリ。
+        executor (concurrent.futures.Executor): 圧縮に使うプロセスプール。
+        max_pending (int): 同時に処理中とするタスク数の上限。
+        storage (dict, optional): `hdf5_storage_options` で作成した保存設定。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): 既存のHDF5ファイルとマニフェストを破棄して作り直すか。
+        band_stats (bool, optional): バンド統計量も保存するか。
+        recorder (RunRecorder, optional): 計測の記録先。
+
+    Returns:
+        None
+    """
+    if storage is None:
+        storage = hdf5_storage_options()
+    try:
+        check_parallel_storage(storage)
+        hdf5_filename = f"{location_folder_name}_{date_folder_name}.h5"
+        hdf5_file_path = os.path.join(output_root, hdf5_filename)
+
+        print(f"HDF5ファイル生成中: {hdf5_file_path}")
+
+        nh9_files = [f for f in os.listdir(location_folder_path) if f.endswith('.nh9')]
+        if not nh9_files:
+            print(f"警告: {location_folder_path} にNH9ファイルが見つかりません。")
+            return
+
+        hdf5_file, manifest = open_incremental_hdf5(hdf5_file_path, use_hash, rebuild, storage)
+        try:
+            pending_files = select_pending_files(location_folder_path, nh9_files, hdf5_file, manifest)
+        except Exception:
+            hdf5_file.close()
+            raise
+        if len(pending_files) < len(nh9_files):
+            print(f"変換済みの {len(nh9_files) - len(pending_files)} ファイルをスキップします。")
+
+        height = storage["geometry"][0]
+        row_starts = range(0, height, storage["chunks"][0])
+        tasks = ((nh9_file, row_start) for nh9_file in pending_files for row_start in row_starts)
+
+        with hdf5_file, tqdm(total=len(pending_files), desc=f"Processing {location_folder_name}",
+                             unit="file") as progress:
+            datasets = {}
+            remaining = {}
+            accumulators = {}
+            traces = {}
+            failed = set()
+            pending = {}
+
+            def submit_next():
+                for nh9_file, row_start in tasks:
+                    if nh9_file in failed:
+                        continue
+                    nh9_path = os.path.join(location_folder_path, nh9_file)
+                    if nh9_file not in datasets:
+                        dataset_name = os.path.splitext(nh9_file)[0]
+                        datasets[nh9_file] = create_capture_dataset(hdf5_file, dataset_name + PARTIAL_SUFFIX,
+                                                                    None, storage)
+                        remaining[nh9_file] = len(row_starts)
+                        traces[nh9_file] = recorder.file(nh9_path, location_folder_name)
+                    pending[executor.submit(compress_row_block, nh9_path, row_start, storage, band_stats,
+                                            recorder.enabled)] = nh9_file
+                    return True
+                return False
+
+            while len(pending) < max_pending and submit_next():
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    nh9_file = pending.pop(future)
+                    if nh9_file in failed:
+                        continue
+                    trace = traces[nh9_file]
+                    try:
+                        encoded, accumulator, stages = future.result()
+                        if stages is not None:
+                            trace.merge(stages)
+                        nbytes = sum(len(data) for _, data in encoded) if recorder.enabled else 0
+                        with trace.stage("write", bytes_in=nbytes, bytes_out=nbytes):
+                            for offset, data in encoded:
+                                datasets[nh9_file].id.write_direct_chunk(offset, data)
+                    except Exception as e:
+                        failed.add(nh9_file)
+                        accumulators.pop(nh9_file, None)
+                        recorder.finish(traces.pop(nh9_file), "failed", error=str(e))
+                        del hdf5_file[datasets.pop(nh9_file).name]
+                        progress.update(1)
+                        tqdm.write(f"エラー: {nh9_file} のデータセット作成に失敗しました: {e}")
+                        continue
+                    if accumulator is not None:
+                        if nh9_file in accumulators:
+                            accumulators[nh9_file].merge(accumulator)
+                        else:
+                            accumulators[nh9_file] = accumulator
+                    remaining[nh9_file] -= 1
+                    if remaining[nh9_file] == 0:
+                        del datasets[nh9_file]
+                        stats = accumulators.pop(nh9_file).result() if band_stats else None
+                        with trace.stage("commit"):
+                            commit_capture(hdf5_file, nh9_file, location_folder_path, manifest, stats)
+                        recorder.finish(traces.pop(nh9_file))
+                        progress.update(1)
+                while len(pending) < max_pending and submit_next():
+                    pass
+            manifest.save()
+        print(f"完了: HDF5ファイルを生成しました -> {hdf5_file_path}")
+    except Exception as e:
+        print(f"エラー: {location_folder_path} の処理中に問題が発生しました: {e}")
+
+def process_date_folder_parallel(date_folder_path, output_root, workers, parallel_folders=1, storage=None,
+                                 use_hash=False, rebuild=False, band_stats=False, recorder=NULL_RECORDER):
+    """
+    日付フォルダ内の場所フォルダを、共有のプロセスプールで並列に圧縮してHDF5に変換する。
+
+    - 圧縮は workers 個のワーカープロセスで行う。
+    - parallel_folders 個の場所フォルダを同時に処理し、それぞれが自分のHDF5ファイルに書き込む。
+
+    Args:
+        date_folder_path (str): 日付フォルダのパス。
+        output_root (str): HDF5ファイルを保存するルートフォルダ。
+        workers (int): 圧縮に使うワーカープロセス数。
+        parallel_folders (int, optional): 同時に処理する場所フォルダ数。デフォルトは1。
+        storage (dict, optional): `hdf5_storage_options` で作成した保存設定。
+        use_hash (bool, optional): 変更検出に高速ハッシュも使用するか。
+        rebuild (bool, optional): 既存のHDF5ファイルを破棄して作り直すか。
+        band_stats (bool, optional): バンド統計量も保存するか。
+        recorder (RunRecorder, optional): 計測の記録先。
+
+    Returns:
+        None
+    """
+    if storage is None:
+        storage = hdf5_storage_options()
+    try:
+        check_parallel_storage(storage)
+        date_folder_name = os.path.basename(date_folder_path)
+        location_folders = [l for l in os.listdir(date_folder_path) if os.path.isdir(os.path.join(date_folder_path, l))]
+
+        if not location_folders:
+            print(f"警告: {date_folder_path} に場所フォルダが見つかりませんでした。")
+            return
+
+        max_pending = max(2, 2 * workers // max(1, parallel_folders))
+        with ProcessPoolExecutor(max_workers=workers) as executor, \
+                ThreadPoolExecutor(max_workers=parallel_folders) as folder_executor:
+            for location_folder in location_folders:
+                location_folder_path = os.path.join(date_folder_path, location_folder)
+                print(f"場所フォルダを処理中: {location_folder_path}")
+                folder_executor.submit(process_files_in_folder_parallel, location_folder_path, date_folder_name,
+                                       location_folder, output_root, executor, max_pending, storage,
+                                       use_hash, rebuild, band_stats, recorder)
+    except Exception as e:
+        print(f"エラー: 日付フォルダ {date_folder_path} の処理中に問題が発生しました: {e}")
+
+def parse_chunks(value):
+    """
+    コマンドライン引数のチャンク指定を解釈する。
+
+    Args:
+        value (str): プリセット名 ("band", "patch") またはカンマ区切りのチャンク形状 (例: "64,1,2048")。
+
+    Returns:
+        str or tuple: プリセット名またはチャンク形状。
+    """
+    if value in CHUNK_PRESETS:
+        return value
+    try:
+        return tuple(int(v) for v in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"不正なチャンク指定です: {value}")
+
+def main(argv=None, prog=None):
     """
     CUI（コマンドライン）から日付フォルダと出力フォルダのパスを取得し、HDF5変換処理を実行する。
 
-    - ユーザーに日付フォルダと出力フォルダのパスを入力させる。
+    - フォルダのパスが引数で指定されていない場合は、日付フォルダと出力フォルダのパス、
+      先読みするファイル数を入力させる（--no-input を指定した場合や、標準入力が端末でない cron・バッチ実行では
+      入力を待たずにエラーで終了する）。
+    - 保存形式・チャンク形状・圧縮方式はオプションで指定する。
+    - --workers を指定した場合は、プロセスプールで並列に圧縮し単一ライターでHDF5に書き込む。
+    - 既存のHDF5ファイルには新規・変更されたNH9ファイルのみを追記する（--rebuild で作り直す）。
+      保存形式・チャンク形状・圧縮方式・12ビット詰めの設定がファイルの記録と異なる場合は追記しない。
+    - --band-stats を指定した場合は、変換と同じ読み込みでバンド統計量を集計して保存する。
+    - --run-log を指定した場合は、ファイルごとの各ステージの処理時間と入出力バイト数を JSONL に記録し、
+      終了時に場所フォルダごとの集計を表示する。--profile で名前が一致するファイルを cProfile で計測する（逐次モードのみ）。
     - 有効なフォルダが指定されているかチェックし、処理を開始する。
 
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py convert` から呼ばれる場合など）。
+
     Raises:
-        エラー: 無効なフォルダパスが指定された場合、エラーメッセージを表示して終了する。
+        SystemExit: 無効なフォルダパスが指定された場合、エラーメッセージを表示して終了する（終了コード 2）。
     """
-    input_folder = input("処理する日付フォルダのパスを入力してください: ").strip()
-    output_folder = input("HDF5ファイルを保存するルートフォルダのパスを入力してください: ").strip()
+    parser = argparse.ArgumentParser(prog=prog, description="NH9ファイルをHDF5形式に圧縮保存する。")
+    parser.add_argument("input_folder", nargs="?", help="処理する日付フォルダのパス。")
+    parser.add_argument("output_folder", nargs="?", help="HDF5ファイルを保存するルートフォルダのパス。")
+    parser.add_argument("--layout", choices=LAYOUTS, default="bil",
+                        help="bil: (height, bands, width), hwc: (height, width, bands)。")
+    parser.add_argument("--chunks", type=parse_chunks, default="band",
+                        help="band (バンド単位の読み出し向け), patch (パッチ単位の読み出し向け), または 64,1,2048 形式。")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip", help="圧縮方式。")
+    parser.add_argument("--gzip-level", type=int, default=4, choices=range(1, 10), help="gzip の圧縮レベル。")
+    parser.add_argument("--no-shuffle", action="store_true", help="shuffle フィルタを使用しない。")
+    parser.add_argument("--pack12", action="store_true",
+                        help="圧縮の前処理として12ビット詰め (2画素 → 3バイト) を行う。")
+    parser.add_argument("--prefetch", type=int, default=None, help="先読みするファイル数。")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="圧縮に使うワーカープロセス数（1以上で並列圧縮モード。gzip または無圧縮のみ）。")
+    parser.add_argument("--parallel-folders", type=int, default=1,
+                        help="並列圧縮モードで同時に処理する場所フォルダ数。")
+    parser.add_argument("--hash", action="store_true",
+                        help="変更検出にサイズ・更新時刻に加えて高速ハッシュを使用する。")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="既存のHDF5ファイルとマニフェストを破棄して全ファイルを変換し直す。")
+    parser.add_argument("--band-stats", action="store_true",
+                        help=f"変換時にバンド統計量 (min/max/mean/std・ヒストグラム・1/99パーセンタイル) を "
+                             f"{STATS_GROUP} グループに保存する。")
+    parser.add_argument("--run-log", default=None,
+                        help="ファイルごと・ステージごとの処理時間と入出力バイト数を追記する JSONL ファイル。")
+    parser.add_argument("--profile", action="append", default=[], metavar="PATTERN",
+                        help="cProfile で計測するNH9ファイル名のパターン（複数指定可、逐次モードのみ）。")
+    parser.add_argument("--profile-dir", default="profiles", help="--profile の結果 (.prof) を保存するフォルダ。")
+    parser.add_argument("--no-input", action="store_true",
+                        help="フォルダのパスが指定されていない場合に入力を求めずにエラーで終了する。")
+    args = parser.parse_args(argv)
+
+    input_folder = args.input_folder
+    output_folder = args.output_folder
+    prefetch_depth = args.prefetch
+    if input_folder is None or output_folder is None:
+        if args.no_input or not sys.stdin.isatty():
+            parser.error("処理する日付フォルダと出力フォルダのパスを指定してください。")
+        input_folder = input("処理する日付フォルダのパスを入力してください: ").strip()
+        output_folder = input("HDF5ファイルを保存するルートフォルダのパスを入力してください: ").strip()
+        if prefetch_depth is None:
+            prefetch_input = input(f"先読みするファイル数を入力してください (空欄で {DEFAULT_DEPTH}): ").strip()
+            prefetch_depth = int(prefetch_input) if prefetch_input.isdigit() else DEFAULT_DEPTH
+    if prefetch_depth is None:
+        prefetch_depth = DEFAULT_DEPTH
+
+    storage = hdf5_storage_options(args.layout, args.chunks, args.compression, args.gzip_level, not args.no_shuffle,
+                                   pack=args.pack12)
 
     if os.path.isdir(input_folder) and os.path.isdir(output_folder):
-        process_date_folder(input_folder, output_folder)
+        recorder = open_recorder(args.run_log, args.profile, args.profile_dir, script="mainCUI",
+                                 date_folder=input_folder, workers=args.workers, prefetch=prefetch_depth,
+                                 layout=args.layout, compression=args.compression, pack12=args.pack12)
+        try:
+            if args.workers > 0:
+                process_date_folder_parallel(input_folder, output_folder, args.workers, args.parallel_folders,
+                                             storage, args.hash, args.rebuild, args.band_stats, recorder)
+            else:
+                process_date_folder(input_folder, output_folder, prefetch_depth, storage, args.hash, args.rebuild,
+                                    args.band_stats, recorder)
+        finally:
+            recorder.close()
     else:
-        print("エラー: 有効なフォルダパスを指定してください。")
+        parser.error("有効なフォルダパスを指定してください。")
+
+if __name__ == "__main__":
+    main()
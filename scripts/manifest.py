@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import hashlib
+
+HASH_SAMPLE_BYTES = 1024 * 1024
+
+def fast_hash(file_path, sample_bytes=HASH_SAMPLE_BYTES):
+    """
+    ファイルの先頭・中央・末尾の一部とサイズから高速なハッシュを計算する。
+
+    - ファイル全体は読まないため、数百MBのNH9ファイルでも数MBの読み込みで済む。
+
+    Args:
+        file_path (str): ハッシュを計算するファイルのパス。
+        sample_bytes (int, optional): 各位置から読み込むバイト数。デフォルトは1MB。
+
+    Returns:
+        str: BLAKE2b の16進ダイジェスト。
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - sample_bytes // 2), max(0, size - sample_bytes)}):
+            f.seek(offset)
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+class Manifest:
+    """
+    変換済みファイルの記録（マニフェスト）。出力ごとに1つのJSONファイルとして保存する。
+
+    - 入力ファイルをキーに、サイズ・更新時刻・（任意で）高速ハッシュを記録する。
+    - 記録と一致する入力ファイルは変換済みとして再変換をスキップできる。
+    - 保存は一時ファイルへの書き込みと置き換えで行うため、中断してもマニフェストは壊れない。
+
+    Args:
+        path (str): マニフェストのJSONファイルのパス。
+        use_hash (bool, optional): サイズ・更新時刻に加えて高速ハッシュも比較するか。
+        save_interval (float, optional): `maybe_save` で保存する最短間隔（秒）。
+    """
+
+    def __init__(self, path, use_hash=False, save_interval=5.0):
+        self.path = path
+        self.use_hash = use_hash
+        self.save_interval = save_interval
+        self.entries = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+
+    def fingerprint(self, source_path):
+        """
+        入力ファイルの現在のサイズ・更新時刻・（任意で）ハッシュを返す。
+
+        Args:
+            source_path (str): 入力ファイルのパス。
+
+        Returns:
+            dict: {"size", "mtime_ns"} と、use_hash の場合は "hash"。
+        """
+        stat = os.stat(source_path)
+        fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if self.use_hash:
+            fingerprint["hash"] = fast_hash(source_path)
+        return fingerprint
+
+    def is_current(self, key, source_path):
+        """
+        入力ファイルが記録時から変更されていないかを確認する。
+
+        Args:
+            key (str): マニフェスト上のキー（出力フォルダ内で一意なファイル名など）。
+            source_path (str): 入力ファイルのパス。
+
+        Returns:
+            bool: 記録があり、サイズ・更新時刻（・ハッシュ）が一致する場合に True。
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        stat = os.stat(source_path)
+        if entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns:
+            return False
+        if self.use_hash and entry.get("hash") != fast_hash(source_path):
+            return False
+        return True
+
+    def record(self, key, source_path, **extra):
+        """
+        変換が完了した入力ファイルを記録する（保存は `save` / `maybe_save` で行う）。
+
+        Args:
+            key (str): マニフェスト上のキー。
+            source_path (str): 入力ファイルのパス。
+            **extra: 併せて記録する値（出力パスなど）。
+        """
+        self.entries[key] = dict(self.fingerprint(source_path), **extra)
+        self._dirty = True
+
+    def discard(self, key):
+        """
+        記録を削除する。
+
+        Args:
+            key (str): マニフェスト上のキー。
+        """
+        if self.entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def clear(self):
+        """
+        すべての記録を削除する。
+        """
+        self.entries = {}
+        self._dirty = True
+
+    def save(self):
+        """
+        マニフェストを一時ファイル経由でアトミックに保存する。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def maybe_save(self):
+        """
+        前回の保存から save_interval 秒以上経過していれば保存する。
+        """
+        if self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
@@ -0,0 +1,208 @@
+import os
+import numpy as np
+from camera import HEIGHT, WIDTH, BANDS, FILENAME_PATTERN, parse_filename
+
+DTYPE = np.uint16  # 12ビットデータ → np.uint16 として扱う
+
+def expected_file_size(height, width, bands, dtype=DTYPE):
+    """
+    指定したジオメトリのNH9ファイルが持つべきバイト数を返す。
+
+    Args:
+        height (int): 画像の高さ（ピクセル）。
+        width (int): 画像の幅（ピクセル）。
+        bands (int): スペクトルのバンド数。
+        dtype (numpy.dtype): 画素のデータ型。
+
+    Returns:
+        int: 期待されるファイルサイズ（バイト）。
+    """
+    return height * bands * width * np.dtype(dtype).itemsize
+
+def check_file_size(file_path, height, width, bands, dtype=DTYPE):
+    """
+    ファイルサイズがジオメトリと一致するかを確認する。
+
+    Args:
+        file_path (str): 確認するNH9ファイルのパス。
+        height (int): 画像の高さ（ピクセル）。
+        width (int): 画像の幅（ピクセル）。
+        bands (int): スペクトルのバンド数。
+        dtype (numpy.dtype): 画素のデータ型。
+
+    Raises:
+        ValueError: ファイルサイズが期待値と一致しない場合（途中で切れたファイルなど）。
+    """
+    actual = os.path.getsize(file_path)
+    expected = expected_file_size(height, width, bands, dtype)
+    if actual != expected:
+        raise ValueError(
+            f"{file_path} のサイズが不正です: {actual} バイト "
+            f"(期待値 {expected} バイト = {height}x{bands}x{width} {np.dtype(dtype).name})"
+        )
+
+class NH9Cube:
+    """
+    NH9ファイルをメモリマップで開き、BIL形式 (行, バンド, 列) のまま遅延アクセスする。
+
+    - ファイル全体は読み込まず、スライスした部分のページのみがディスクから読み込まれる。
+    - 1行・1バンド分の画素 (width 個) はファイル上で連続しているため、
+      バンド単位・行範囲単位のアクセスは必要なバイトだけを読む。
+
+    Attributes:
+        file_path (str): NH9ファイルのパス。
+        height (int): 画像の高さ（ピクセル）。
+        width (int): 画像の幅（ピクセル）。
+        bands (int): スペクトルのバンド数。
+        data (numpy.memmap): (height, bands, width) の形状を持つメモリマップ。
+    """
+
+    def __init__(self, file_path, height=HEIGHT, width=WIDTH, bands=BANDS, dtype=DTYPE):
+        check_file_size(file_path, height, width, bands, dtype)
+        self.file_path = file_path
+        self.height = height
+        self.width = width
+        self.bands = bands
+        self.dtype = np.dtype(dtype)
+        self.data = np.memmap(file_path, dtype=self.dtype, mode="r", shape=(height, bands, width))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, key):
+        """
+        BIL配置 (行, バンド, 列) のままスライスする（コピーは作らない）。
+        """
+        return self.data[key]
+
+    @property
+    def shape(self):
+        """tuple: BIL配置の形状 (height, bands, width)。"""
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        """int: キューブ全体のバイト数。"""
+        return self.data.nbytes
+
+    def band(self, band):
+        """
+        1バンド分の画像を返す。
+
+        Args:
+            band (int): バンド番号。
+
+        Returns:
+            numpy.ndarray: (height, width) の形状を持つビュー。
+        """
+        return self.data[:, band, :]
+
+    def band_range(self, start, stop):
+        """
+        連続するバンド範囲を返す。
+
+        Args:
+            start (int): 開始バンド番号。
+            stop (int): 終了バンド番号（含まない）。
+
+        Returns:
+            numpy.ndarray: (height, stop - start, width) の形状を持つビュー。
+        """
+        return self.data[:, start:stop, :]
+
+    def row_range(self, start, stop):
+        """
+        連続する行（スキャンライン）範囲を返す。
+
+        Args:
+            start (int): 開始行。
+            stop (int): 終了行（含まない）。
+
+        Returns:
+            numpy.ndarray: (stop - start, bands, width) の形状を持つビュー。
+        """
+        return self.data[start:stop]
+
+    def spectrum(self, row, col):
+        """
+        1画素のスペクトルを返す。
+
+        Args:
+            row (int): 行番号。
+            col (int): 列番号。
+
+        Returns:
+            numpy.ndarray: (bands,) の形状を持つ配列。
+        """
+        return np.array(self.data[row, :, col])
+
+    def read_rows(self, start, stop, band_start=0, band_stop=None, out=None):
+        """
+        行範囲・バンド範囲をファイルから直接読み込む（メモリマップを経由しない）。
+
+        - 読み込み先バッファを使い回せるため、ページキャッシュをプロセスに
+          マップし続けずにメモリ使用量を一定に保てる。
+        - 呼び出しごとにファイルを開くため、複数スレッドから同時に呼び出してよい。
+
+        Args:
+            start (int): 開始行。
+            stop (int): 終了行（含まない）。
+            band_start (int, optional): 開始バンド番号。デフォルトは0。
+            band_stop (int, optional): 終了バンド番号（含まない）。デフォルトは全バンド。
+            out (numpy.ndarray, optional): 読み込み先の (stop - start, band_stop - band_start, width) 配列。
+
+        Returns:
+            numpy.ndarray: (stop - start, band_stop - band_start, width) の形状を持つ配列。
+        """
+        if band_stop is None:
+            band_stop = self.bands
+        shape = (stop - start, band_stop - band_start, self.width)
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype)
+        elif out.shape != shape or out.dtype != self.dtype or not out.flags.c_contiguous:
+            raise ValueError(f"読み込み先バッファの形状が不正です: {out.shape} (期待値 {shape})")
+
+        itemsize = self.dtype.itemsize
+        row_bytes = self.bands * self.width * itemsize
+        band_offset = band_start * self.width * itemsize
+        with open(self.file_path, "rb") as f:
+            if band_start == 0 and band_stop == self.bands:
+                f.seek(start * row_bytes)
+                f.readinto(memoryview(out).cast("B"))
+            else:
+                for i, row in enumerate(range(start, stop)):
+                    f.seek(row * row_bytes + band_offset)
+                    f.readinto(memoryview(out[i]).cast("B"))
+        return out
+
+    def iter_row_blocks(self, block_rows):
+        """
+        行ブロック単位でキューブを走査する。
+
+        Args:
+            block_rows (int): 1ブロックあたりの行数。
+
+        Yields:
+            tuple: (開始行, 終了行, (rows, bands, width) のビュー)。
+        """
+        for start in range(0, self.height, block_rows):
+            stop = min(start + block_rows, self.height)
+            yield start, stop, self.data[start:stop]
+
+    def to_hwc(self):
+        """
+        (height, width, bands) 順のビューを返す（転置はストライドの変更のみでコピーしない）。
+
+        Returns:
+            numpy.ndarray: (height, width, bands) の形状を持つビュー。
+        """
+        return np.transpose(self.data, (0, 2, 1))
+
+    def close(self):
+        """
+        メモリマップへの参照を破棄する。既に取り出したビューは引き続き有効。
+        """
+        self.data = None
@@ -0,0 +1,316 @@
+import os
+import struct
+import argparse
+import numpy as np
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+
+NH9P_MAGIC = b"NH9P"
+NH9P_VERSION = 1
+NH9P_HEADER = struct.Struct("<4sIIII12x")  # magic, version, height, bands, width（32バイト）
+MAX_12BIT = 0x0FFF
+UNPACK_BLOCK_BYTES = 256 * 1024
+
+def packed_length(n):
+    """
+    n 個の12ビット値を詰めたときのバイト数を返す（奇数個の場合は0で1個埋める）。
+
+    Args:
+        n (int): 値の個数。
+
+    Returns:
+        int: 詰めた後のバイト数。
+    """
+    return (n + 1) // 2 * 3
+
+def pack12(data, check=True):
+    """
+    12ビット値を最終軸に沿って 2個 → 3バイト に詰める。
+
+    - 値 a, b を [a の下位8ビット], [b の下位4ビット | a の上位4ビット], [b の上位8ビット] の順に格納する。
+    - 最終軸が奇数長の場合は末尾を0で埋める。
+
+    Args:
+        data (numpy.ndarray): uint16 の配列（値は 0〜4095）。
+        check (bool, optional): 12ビットを超える値がないか確認するか。デフォルトは True。
+
+    Returns:
+        numpy.ndarray: 最終軸の長さが packed_length(n) の uint8 配列。
+
+    Raises:
+        ValueError: check が True で、12ビットを超える値が含まれる場合。
+    """
+    data = np.asarray(data)
+    if check and data.size and data.max() > MAX_12BIT:
+        raise ValueError(f"12ビットを超える値が含まれています: 最大値 {data.max()}")
+    n = data.shape[-1]
+    if n % 2:
+        data = np.concatenate([data, np.zeros(data.shape[:-1] + (1,), dtype=data.dtype)], axis=-1)
+    a = data[..., 0::2]
+    b = data[..., 1::2]
+    packed = np.empty(data.shape[:-1] + (packed_length(n),), dtype=np.uint8)
+    packed[..., 0::3] = a & 0xFF
+    packed[..., 1::3] = (a >> 8) | ((b & 0x0F) << 4)
+    packed[..., 2::3] = b >> 4
+    return packed
+
+def unpack12(packed, n=None, out=None):
+    """
+    `pack12` で詰めたデータを uint16 に展開する。
+
+    Args:
+        packed (numpy.ndarray): 最終軸に沿って詰められた uint8 配列。
+        n (int, optional): 展開後の最終軸の長さ。デフォルトは packed の長さ × 2/3。
+        out (numpy.ndarray, optional): 展開先の uint16 配列（使い回してメモリ確保を避ける）。
+
+    Returns:
+        numpy.ndarray: 最終軸の長さが n の uint16 配列。
+    """
+    packed = np.asarray(packed)
+    pairs = packed.shape[-1] // 3
+    if n is None:
+        n = pairs * 2
+    shape = packed.shape[:-1] + (n,)
+    if out is None:
+        out = np.empty(shape, dtype=np.uint16)
+    elif out.shape != shape or out.dtype != np.uint16:
+        raise ValueError(f"展開先の形状が不正です: {out.shape} (期待値 {shape})")
+
+    # 一時配列がCPUキャッシュに収まるよう、先頭軸に沿って小さなブロックごとに展開する
+    packed = np.ascontiguousarray(packed)
+    if packed.ndim < 2 or packed.nbytes <= UNPACK_BLOCK_BYTES:
+        _unpack12_block(packed, n, out)
+    else:
+        step = max(1, UNPACK_BLOCK_BYTES // max(1, packed[0].nbytes))
+        for start in range(0, packed.shape[0], step):
+            _unpack12_block(packed[start:start + step], n, out[start:start + step])
+    return out
+
+def _unpack12_block(packed, n, out):
+    """
+    C連続の packed を展開する。
+
+    - 3バイトの組を、3バイト間隔のストライドを持つリトルエンディアンの uint32 のビュー（4バイト目は次の組）として読み、
+      値の組 (a, b) を out の uint32 のビュー（下位16ビットが a）に1回で書き込む。一時配列は1つのみ。
+    - 最後の組は4バイト目がバッファの外になるため、個別に展開する。
+    """
+    groups = packed.size // 3
+    if groups == 0:
+        return
+    direct = n % 2 == 0 and out.flags.c_contiguous
+    pairs = out.reshape(-1).view(np.uint32) if direct else np.empty(groups, dtype=np.uint32)
+    words = np.ndarray((groups - 1,), dtype="<u4", buffer=packed.reshape(-1), strides=(3,))
+    head = pairs[:-1]
+    np.left_shift(words, 4, out=head)
+    np.bitwise_and(head, 0x0FFF0000, out=head)
+    np.bitwise_or(head, words & 0x0FFF, out=head)
+    b0, b1, b2 = (int(v) for v in packed.reshape(-1)[-3:])
+    word = b0 | b1 << 8 | b2 << 16
+    pairs[-1] = (word & 0x0FFF) | (word & 0xFFF000) << 4
+    if not direct:
+        out[...] = pairs.view(np.uint16).reshape(packed.shape[:-1] + (packed.shape[-1] // 3 * 2,))[..., :n]
+
+def read_nh9p_header(file_path):
+    """
+    .nh9p ファイルのヘッダーを読み込む。
+
+    Args:
+        file_path (str): .nh9p ファイルのパス。
+
+    Returns:
+        tuple: (height, width, bands)。
+
+    Raises:
+        ValueError: ヘッダーが不正な場合、またはファイルサイズがジオメトリと一致しない場合。
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(NH9P_HEADER.size)
+    if len(header) != NH9P_HEADER.size:
+        raise ValueError(f"{file_path} は .nh9p ファイルではありません")
+    magic, version, height, bands, width = NH9P_HEADER.unpack(header)
+    if magic != NH9P_MAGIC or version != NH9P_VERSION:
+        raise ValueError(f"{file_path} は .nh9p ファイルではありません (magic={magic!r}, version={version})")
+    expected = NH9P_HEADER.size + height * bands * packed_length(width)
+    actual = os.path.getsize(file_path)
+    if actual != expected:
+        raise ValueError(f"{file_path} のサイズが不正です: {actual} バイト (期待値 {expected} バイト)")
+    return height, width, bands
+
+class PackedNH9Cube:
+    """
+    .nh9p ファイルをメモリマップで開き、`NH9Cube` と同じインターフェースで遅延アクセスする。
+
+    - 行・バンドの選択は詰めたままのバイト列に対して行い、選択した部分のみを展開する。
+
+    Attributes:
+        file_path (str): .nh9p ファイルのパス。
+        height (int): 画像の高さ（ピクセル）。
+        width (int): 画像の幅（ピクセル）。
+        bands (int): スペクトルのバンド数。
+        packed (numpy.memmap): (height, bands, packed_length(width)) の uint8 メモリマップ。
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.height, self.width, self.bands = read_nh9p_header(file_path)
+        self.dtype = np.dtype(np.uint16)
+        self.packed = np.memmap(file_path, dtype=np.uint8, mode="r", offset=NH9P_HEADER.size,
+                                shape=(self.height, self.bands, packed_length(self.width)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, key):
+        """
+        BIL配置 (行, バンド, 列) でスライスし、選択した行・バンドのみを展開して返す。
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows_bands, cols = key[:2], key[2:]
+        return unpack12(self.packed[rows_bands], self.width)[(Ellipsis,) + cols]
+
+    @property
+    def shape(self):
+        """tuple: BIL配置の形状 (height, bands, width)。"""
+        return (self.height, self.bands, self.width)
+
+    @property
+    def nbytes(self):
+        """int: 展開後のキューブ全体のバイト数。"""
+        return self.height * self.bands * self.width * self.dtype.itemsize
+
+    def band(self, band):
+        """
+        Returns:
+            numpy.ndarray: (height, width) の1バンド分の画像。
+        """
+        return unpack12(self.packed[:, band, :], self.width)
+
+    def band_range(self, start, stop):
+        """
+        Returns:
+            numpy.ndarray: (height, stop - start, width) のバンド範囲。
+        """
+        return unpack12(self.packed[:, start:stop, :], self.width)
+
+    def row_range(self, start, stop):
+        """
+        Returns:
+            numpy.ndarray: (stop - start, bands, width) の行範囲。
+        """
+        return unpack12(self.packed[start:stop], self.width)
+
+    def spectrum(self, row, col):
+        """
+        Returns:
+            numpy.ndarray: (bands,) の1画素のスペクトル（列を含む3バイトのみを展開する）。
+        """
+        offset = col // 2 * 3
+        return unpack12(self.packed[row, :, offset:offset + 3], 2)[:, col % 2]
+
+    def read_rows(self, start, stop, band_start=0, band_stop=None, out=None):
+        """
+        `NH9Cube.read_rows` と同じく行範囲・バンド範囲を読み込み、out に展開する。
+
+        Returns:
+            numpy.ndarray: (stop - start, band_stop - band_start, width) の uint16 配列。
+        """
+        if band_stop is None:
+            band_stop = self.bands
+        return unpack12(self.packed[start:stop, band_start:band_stop], self.width, out)
+
+    def iter_row_blocks(self, block_rows):
+        """
+        Yields:
+            tuple: (開始行, 終了行, (rows, bands, width) の展開済み配列)。
+        """
+        for start in range(0, self.height, block_rows):
+            stop = min(start + block_rows, self.height)
+            yield start, stop, self.row_range(start, stop)
+
+    def to_hwc(self):
+        """
+        Returns:
+            numpy.ndarray: (height, width, bands) の配列（全体を展開する）。
+        """
+        return np.transpose(self.row_range(0, self.height), (0, 2, 1))
+
+    def close(self):
+        """
+        メモリマップへの参照を破棄する。
+        """
+        self.packed = None
+
+def pack_nh9_file(nh9_path, nh9p_path, height, width, bands, block_rows=64):
+    """
+    NH9ファイルを行ブロック単位で .nh9p 形式（12ビット詰め、BIL配置）に変換する。
+
+    - 各行・各バンドの width 個の画素を 3/2 バイト/画素 に詰めて保存する。
+    - 一時ファイルに書き込んでから置き換えるため、中断しても壊れたファイルは残らない。
+
+    Args:
+        nh9_path (str): 入力のNH9ファイルのパス。
+        nh9p_path (str): 出力の .nh9p ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        block_rows (int, optional): 1ブロックあたりの行数。デフォルトは64。
+
+    Returns:
+        None
+    """
+    cube = NH9Cube(nh9_path, height, width, bands)
+    tmp_path = f"{nh9p_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(NH9P_HEADER.pack(NH9P_MAGIC, NH9P_VERSION, height, bands, width))
+        buffer = np.empty((block_rows, bands, width), dtype=np.uint16)
+        for start in range(0, height, block_rows):
+            stop = min(start + block_rows, height)
+            block = cube.read_rows(start, stop, out=buffer[:stop - start])
+            f.write(pack12(block).tobytes())
+    os.replace(tmp_path, nh9p_path)
+
+def unpack_nh9p_file(nh9p_path, nh9_path, block_rows=64):
+    """
+    .nh9p ファイルを元のNH9ファイル（uint16、BIL配置）に戻す。
+
+    Args:
+        nh9p_path (str): 入力の .nh9p ファイルのパス。
+        nh9_path (str): 出力のNH9ファイルのパス。
+        block_rows (int, optional): 1ブロックあたりの行数。デフォルトは64。
+
+    Returns:
+        None
+    """
+    cube = PackedNH9Cube(nh9p_path)
+    tmp_path = f"{nh9_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for start in range(0, cube.height, block_rows):
+            stop = min(start + block_rows, cube.height)
+            f.write(cube.read_rows(start, stop).tobytes())
+    os.replace(tmp_path, nh9_path)
+
+if __name__ == "__main__":
+    """
+    NH9ファイルと .nh9p ファイル（12ビット詰め）を相互に変換する。
+
+    - 入力の拡張子が .nh9 の場合は .nh9p に、.nh9p の場合は .nh9 に変換する。
+    """
+    parser = argparse.ArgumentParser(description="NH9ファイルと12ビット詰めの .nh9p ファイルを相互に変換する。")
+    parser.add_argument("input", help="入力ファイル (.nh9 または .nh9p)。")
+    parser.add_argument("output", nargs="?", help="出力ファイル（省略時は拡張子を置き換えたパス）。")
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--bands", type=int, default=BANDS)
+    args = parser.parse_args()
+
+    root, ext = os.path.splitext(args.input)
+    if ext == ".nh9p":
+        output = args.output or root + ".nh9"
+        unpack_nh9p_file(args.input, output)
+    else:
+        output = args.output or root + ".nh9p"
+        pack_nh9_file(args.input, output, args.height, args.width, args.bands)
+    print(f"保存しました: {output}")
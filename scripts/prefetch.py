@@ -0,0 +1,200 @@
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_DEPTH = 2
+
+_STOP = object()
+
+class PipelineStats:
+    """
+    パイプラインの各ステージの処理時間と待ち時間を集計する。
+
+    Attributes:
+        items (int): 処理したアイテム数。
+        wall (float): 全体の経過時間（秒）。
+        read_busy (float): 読み込みスレッドが読み込みに費やした時間の合計（秒）。
+        compute_busy (float): 計算に費やした時間（秒）。
+        write_busy (float): 書き込みスレッドが書き込みに費やした時間（秒）。
+        compute_wait_read (float): 計算が読み込み完了を待って停止した時間（秒）。
+        compute_wait_write (float): 計算が書き込みキューの空きを待って停止した時間（秒）。
+        write_wait_compute (float): 書き込みスレッドが計算結果を待って停止した時間（秒）。
+    """
+
+    def __init__(self):
+        self.items = 0
+        self.wall = 0.0
+        self.read_busy = 0.0
+        self.compute_busy = 0.0
+        self.write_busy = 0.0
+        self.compute_wait_read = 0.0
+        self.compute_wait_write = 0.0
+        self.write_wait_compute = 0.0
+        self._lock = threading.Lock()
+
+    def add_read(self, seconds):
+        with self._lock:
+            self.read_busy += seconds
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: 集計値の辞書。
+        """
+        return {key: value for key, value in vars(self).items() if not key.startswith("_")}
+
+    def summary(self):
+        """
+        Returns:
+            str: 各ステージの処理時間と待ち時間を1行にまとめた文字列。
+        """
+        return (
+            f"{self.items} items in {self.wall:.1f}s | "
+            f"read {self.read_busy:.1f}s, compute {self.compute_busy:.1f}s, write {self.write_busy:.1f}s | "
+            f"stalls: compute<-read {self.compute_wait_read:.1f}s, "
+            f"compute->write {self.compute_wait_write:.1f}s, write<-compute {self.write_wait_compute:.1f}s"
+        )
+
+class PrefetchPipeline:
+    """
+    読み込み・計算・書き込みを重ね合わせる、有界のプロデューサー/コンシューマー型パイプライン。
+
+    - 読み込み: バックグラウンドスレッドで最大 depth 個先のアイテムを先読みする。
+    - 計算: 呼び出し元のスレッドで、アイテムの順序どおりに実行する。
+    - 書き込み: 専用の書き込みスレッドで実行する（最大 depth 個までキューに溜める）。
+
+    同時にメモリ上に存在するアイテムは最大で (先読み depth 個 + 計算中 1 個 + 書き込み待ち depth 個)。
+
+    Args:
+        load (callable): load(item) -> data。読み込みスレッドで実行される。
+        process (callable or None): process(item, data) -> result。None の場合 data をそのまま渡す。
+        write (callable): write(item, result)。書き込みスレッドで実行される。
+        depth (int, optional): 先読み数および書き込みキューの深さ。デフォルトは2。
+        readers (int, optional): 読み込みスレッド数。デフォルトは depth。
+        on_error (callable, optional): on_error(item, exc)。指定した場合は失敗したアイテムを
+            スキップして処理を続ける。None の場合は例外を送出する。
+    """
+
+    def __init__(self, load, process, write, depth=DEFAULT_DEPTH, readers=None, on_error=None):
+        self.load = load
+        self.process = process
+        self.write = write
+        self.depth = max(1, depth)
+        self.readers = readers or self.depth
+        self.on_error = on_error
+        self.stats = PipelineStats()
+        self._progress_lock = threading.Lock()
+
+    def _timed_load(self, item):
+        start = time.perf_counter()
+        try:
+            return self.load(item)
+        finally:
+            self.stats.add_read(time.perf_counter() - start)
+
+    def _advance(self, progress):
+        if progress is not None:
+            with self._progress_lock:
+                progress.update(1)
+
+    def _handle_error(self, item, exc, progress):
+        if self.on_error is None:
+            raise exc
+        self.on_error(item, exc)
+        self._advance(progress)
+
+    def _writer(self, write_queue, errors, progress):
+        stats = self.stats
+        while True:
+            start = time.perf_counter()
+            entry = write_queue.get()
+            stats.write_wait_compute += time.perf_counter() - start
+            if entry is _STOP:
+                return
+            item, result = entry
+            start = time.perf_counter()
+            try:
+                self.write(item, result)
+            except Exception as e:
+                if self.on_error is None:
+                    errors.append(e)
+                else:
+                    self.on_error(item, e)
+            stats.write_busy += time.perf_counter() - start
+            stats.items += 1
+            self._advance(progress)
+
+    def run(self, items, progress=None):
+        """
+        アイテム列をパイプラインで処理する。
+
+        Args:
+            items (iterable): 処理するアイテムの列（ファイルパスなど）。
+            progress (tqdm, optional): 書き込み完了ごと、および on_error でスキップしたアイテムごとに
+                update(1) を呼ぶ進捗バー。
+
+        Returns:
+            PipelineStats: 各ステージの処理時間と待ち時間。
+
+        Raises:
+            Exception: on_error が指定されておらず、いずれかのステージで例外が発生した場合。
+        """
+        stats = self.stats
+        wall_start = time.perf_counter()
+        write_queue = queue.Queue(maxsize=self.depth)
+        writer_errors = []
+        writer = threading.Thread(target=self._writer, args=(write_queue, writer_errors, progress), daemon=True)
+        writer.start()
+
+        items = iter(items)
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.readers) as executor:
+                def submit_next():
+                    for item in items:
+                        pending.append((item, executor.submit(self._timed_load, item)))
+                        return
+
+                for _ in range(self.depth):
+                    submit_next()
+
+                while pending and not writer_errors:
+                    item, future = pending.popleft()
+                    submit_next()
+
+                    start = time.perf_counter()
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        self._handle_error(item, e, progress)
+                        continue
+                    finally:
+                        stats.compute_wait_read += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    try:
+                        result = data if self.process is None else self.process(item, data)
+                    except Exception as e:
+                        self._handle_error(item, e, progress)
+                        continue
+                    finally:
+                        stats.compute_busy += time.perf_counter() - start
+                    del data
+
+                    start = time.perf_counter()
+                    write_queue.put((item, result))
+                    stats.compute_wait_write += time.perf_counter() - start
+                    del result
+
+                for _, future in pending:
+                    future.cancel()
+        finally:
+            write_queue.put(_STOP)
+            writer.join()
+            stats.wall = time.perf_counter() - wall_start
+
+        if writer_errors:
+            raise writer_errors[0]
+        return stats
@@ -0,0 +1,369 @@
+import os
+import glob
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from tqdm import tqdm
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+
+PYRAMID_FACTORS = (2, 4, 8)
+DEFAULT_BLOCK_ROWS = 64
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+def pyramid_path(nh9_path, factor):
+    """
+    NH9ファイルに対応する縮小レベルのファイルのパスを返す。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        factor (int): 縮小率 (2, 4, 8 など)。
+
+    Returns:
+        str: 「元のファイル名.pyr<縮小率>.npy」形式のパス。
+    """
+    return f"{nh9_path}.pyr{factor}.npy"
+
+def level_shape(height, width, bands, factor):
+    """
+    縮小レベルの配列の形状を返す（割り切れない端の行・列は切り捨てる）。
+
+    Returns:
+        tuple: (bands, height // factor, width // factor)。
+    """
+    return (bands, height // factor, width // factor)
+
+def _pool2(values):
+    """
+    (rows, bands, width) の配列の 2 × 2 画素の和を求める（奇数の端の行・列は切り捨てる）。
+
+    - reshape して総和を取るより、隣接する行・列のスライス同士の加算の方が大幅に速い。
+    """
+    height, width = values.shape[0] // 2 * 2, values.shape[-1] // 2 * 2
+    rows = np.add(values[0:height:2], values[1:height:2], dtype=np.uint32)
+    return rows[..., 0:width:2] + rows[..., 1:width:2]
+
+def build_pyramid(nh9_path, height=HEIGHT, width=WIDTH, bands=BANDS, factors=PYRAMID_FACTORS,
+                  block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    NH9ファイルを行ブロック単位で1回だけ走査し、バンドごとに縮小したピラミッドを作成する。
+
+    - 各レベルは factor × factor 画素の平均（四捨五入）で、(bands, height/factor, width/factor) の
+      uint16 配列として .npy 形式で保存する（バンドごとに連続しているためメモリマップで1バンドずつ読める）。
+    - 各レベルは整数の画素和から直接求めるため、下位レベルの丸め誤差は累積しない。
+    - 一時ファイルに書き込んでから置き換えるため、中断しても壊れたファイルは残らない（失敗時は一時ファイルを削除する）。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        factors (tuple of int, optional): 作成する縮小率（2 のべき乗）。デフォルトは (2, 4, 8)。
+        block_rows (int, optional): 1ブロックあたりの行数（最大の縮小率の倍数に切り上げる）。
+
+    Returns:
+        list of str: 作成したファイルのパス。
+    """
+    cube = NH9Cube(nh9_path, height, width, bands)
+    factors = sorted(factors)
+    top = factors[-1]
+    block_rows = -(-block_rows // top) * top
+    tmp_paths = [pyramid_path(nh9_path, f) + ".tmp.npy" for f in factors]
+    levels = []
+    try:
+        for tmp, f in zip(tmp_paths, factors):
+            levels.append(np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint16,
+                                                    shape=level_shape(height, width, bands, f)))
+
+        buffer = np.empty((block_rows, bands, width), dtype=np.uint16)
+        for start in range(0, height, block_rows):
+            stop = min(start + block_rows, height)
+            block = cube.read_rows(start, stop, out=buffer[:stop - start])
+            sums, scale = block, 1
+            for factor, level in zip(factors, levels):
+                while scale < factor:
+                    sums = _pool2(sums)
+                    scale *= 2
+                count = factor * factor
+                level[:, start // factor:stop // factor, :] = ((sums + count // 2) // count).transpose(1, 0, 2)
+
+        for level in levels:
+            level.flush()
+    except BaseException:
+        # 書き込み途中の一時ファイルを残さない
+        del levels
+        for tmp in tmp_paths:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    del levels
+
+    paths = []
+    for tmp, factor in zip(tmp_paths, factors):
+        path = pyramid_path(nh9_path, factor)
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+def load_pyramid(nh9_path, height=HEIGHT, width=WIDTH, bands=BANDS, factors=PYRAMID_FACTORS):
+    """
+    NH9ファイルのピラミッドをメモリマップで開く。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        factors (tuple of int, optional): 開く縮小率。
+
+    Returns:
+        dict or None: {縮小率: (bands, h, w) のメモリマップ}。いずれかのレベルがない、形状が合わない、
+            またはNH9ファイルより古い場合は None。
+    """
+    source_mtime = os.stat(nh9_path).st_mtime_ns
+    levels = {}
+    for factor in factors:
+        path = pyramid_path(nh9_path, factor)
+        if not os.path.exists(path) or os.stat(path).st_mtime_ns < source_mtime:
+            return None
+        level = np.load(path, mmap_mode="r")
+        if level.shape != level_shape(height, width, bands, factor):
+            return None
+        levels[factor] = level
+    return levels
+
+class BandCache:
+    """
+    (縮小率, バンド) ごとのバンド画像を保持する、メモリ上限付きのLRUキャッシュ。
+
+    Args:
+        max_bytes (int, optional): 保持するバンド画像の合計バイト数の上限。デフォルトは256MB。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, load):
+        """
+        キャッシュからバンド画像を返す。ない場合は load() で読み込んで追加する。
+
+        Args:
+            key (hashable): キャッシュのキー。
+            load (callable): load() -> numpy.ndarray。
+
+        Returns:
+            numpy.ndarray: バンド画像。
+        """
+        image = self._entries.get(key)
+        if image is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+        self.misses += 1
+        image = np.ascontiguousarray(load())
+        self._entries[key] = image
+        self.nbytes += image.nbytes
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return image
+
+    def clear(self):
+        """
+        すべてのバンド画像を破棄する。
+        """
+        self._entries.clear()
+        self.nbytes = 0
+
+class PyramidCube:
+    """
+    NH9キューブと縮小ピラミッドをまとめ、表示解像度に応じたレベルのバンド画像を返す。
+
+    Args:
+        cube (NH9Cube): 元解像度のNH9キューブ（縮小率 1 として扱う）。
+        levels (dict, optional): `load_pyramid` の {縮小率: メモリマップ}。
+        cache_bytes (int, optional): バンドキャッシュのメモリ上限（バイト）。
+    """
+
+    def __init__(self, cube, levels=None, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.cube = cube
+        self.levels = dict(levels or {})
+        self.factors = sorted(set(self.levels) | {1}, reverse=True)
+        self.cache = BandCache(cache_bytes)
+
+    @property
+    def height(self):
+        return self.cube.height
+
+    @property
+    def width(self):
+        return self.cube.width
+
+    @property
+    def bands(self):
+        return self.cube.bands
+
+    @property
+    def coarsest(self):
+        """int: 最も粗いレベルの縮小率。"""
+        return self.factors[0]
+
+    def band(self, band, factor=1):
+        """
+        指定した縮小率のバンド画像を返す（LRUキャッシュ経由）。
+
+        Args:
+            band (int): バンド番号。
+            factor (int, optional): 縮小率。1 の場合は元解像度。
+
+        Returns:
+            numpy.ndarray: (height / factor, width / factor) の uint16 配列。
+        """
+        if factor == 1:
+            return self.cache.get((1, band), lambda: self.cube.band(band))
+        return self.cache.get((factor, band), lambda: self.levels[factor][band])
+
+    def factor_for_view(self, visible_width, visible_height, display_width, display_height):
+        """
+        表示範囲と表示先のピクセル数から、表示に十分な最も粗いレベルを選ぶ。
+
+        Args:
+            visible_width (float): 表示範囲の幅（元解像度の画素数）。
+            visible_height (float): 表示範囲の高さ（元解像度の画素数）。
+            display_width (float): 表示先の幅（画面のピクセル数）。
+            display_height (float): 表示先の高さ（画面のピクセル数）。
+
+        Returns:
+            int: 縮小率。
+        """
+        density = min(visible_width / max(display_width, 1), visible_height / max(display_height, 1))
+        for factor in self.factors:
+            if factor <= density:
+                return factor
+        return 1
+
+class BandRangeSum:
+    """
+    1つの縮小レベルについて、バンド範囲 [start, stop) の画素ごとの和を保持する。
+
+    - 範囲を変更すると、前の範囲との差分のバンドのみを加算・減算して更新する（スライダーを1バンド動かした場合は
+      端の2バンド分の加減算のみ）。差分が新しい範囲より多い場合は作り直す。
+    - バンド画像は `PyramidCube.band` (LRUキャッシュ) から読み込む。12ビット値の和は uint32 で誤差なく保持できる。
+
+    Args:
+        pyramid (PyramidCube): バンド画像を読み込むキューブ。
+        factor (int, optional): 縮小率。1 の場合は元解像度。
+    """
+
+    def __init__(self, pyramid, factor=1):
+        self.pyramid = pyramid
+        self.factor = factor
+        self.start = 0
+        self.stop = 0
+        self.sums = None
+
+    def _apply(self, bands, op):
+        for band in bands:
+            op(self.sums, self.pyramid.band(band, self.factor), out=self.sums)
+
+    def update(self, start, stop):
+        """
+        バンド範囲を変更し、画素ごとの和を返す。
+
+        Args:
+            start (int): 開始バンド番号。
+            stop (int): 終了バンド番号（含まない）。
+
+        Returns:
+            numpy.ndarray: (height / factor, width / factor) の uint32 配列（更新時に上書きされる）。
+        """
+        if self.sums is not None and (start, stop) == (self.start, self.stop):
+            return self.sums
+        changed = abs(start - self.start) + abs(stop - self.stop)
+        if self.sums is None or start >= self.stop or stop <= self.start or changed > stop - start:
+            if self.sums is None:
+                shape = self.pyramid.band(start, self.factor).shape
+                self.sums = np.zeros(shape, dtype=np.uint32)
+            else:
+                self.sums.fill(0)
+            self._apply(range(start, stop), np.add)
+        else:
+            self._apply(range(start, self.start), np.add)
+            self._apply(range(self.start, start), np.subtract)
+            self._apply(range(stop, self.stop), np.subtract)
+            self._apply(range(self.stop, stop), np.add)
+        self.start, self.stop = start, stop
+        return self.sums
+
+def open_pyramid_cube(nh9_path, height=HEIGHT, width=WIDTH, bands=BANDS, build=True, cache_bytes=DEFAULT_CACHE_BYTES):
+    """
+    NH9ファイルを開き、ピラミッドがあれば（build の場合はなければ作成して）`PyramidCube` を返す。
+
+    - NH9ファイルの隣にピラミッドを作成できない場合（読み取り専用のフォルダなど）は警告を表示し、
+      ピラミッドなし（元解像度のみ）の `PyramidCube` を返す。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        build (bool, optional): ピラミッドがない、または古い場合に作成するか。
+        cache_bytes (int, optional): バンドキャッシュのメモリ上限（バイト）。
+
+    Returns:
+        PyramidCube: 元解像度のキューブと縮小ピラミッド。
+    """
+    cube = NH9Cube(nh9_path, height, width, bands)
+    levels = load_pyramid(nh9_path, height, width, bands)
+    if levels is None and build:
+        print(f"プレビュー用のピラミッドを作成しています: {nh9_path}")
+        try:
+            build_pyramid(nh9_path, height, width, bands)
+        except OSError as e:
+            print(f"警告: ピラミッドを作成できないため、元解像度のみで表示します: {e}")
+        else:
+            levels = load_pyramid(nh9_path, height, width, bands)
+    return PyramidCube(cube, levels, cache_bytes)
+
+def build_pyramid_file(nh9_path, height=HEIGHT, width=WIDTH, bands=BANDS, force=False):
+    """
+    1つのNH9ファイルのピラミッドを作成する（プロセスプールのワーカーからも呼ばれる）。
+
+    Returns:
+        list of str or None: 作成したファイルのパス。最新のため作成しなかった場合は None。
+    """
+    if not force and load_pyramid(nh9_path, height, width, bands) is not None:
+        return None
+    return build_pyramid(nh9_path, height, width, bands)
+
+if __name__ == "__main__":
+    """
+    指定したフォルダ以下（またはファイル）の .nh9 ファイルごとに、spectralview.py 用の縮小ピラミッド
+    (1/2, 1/4, 1/8) を作成する。
+
+    - 最新のピラミッドがあるファイルはスキップする（--force で作り直す）。
+    """
+    parser = argparse.ArgumentParser(description="NH9ファイルのプレビュー用の縮小ピラミッドを作成する。")
+    parser.add_argument("paths", nargs="+", help=".nh9 ファイル、またはそれらを含むフォルダ。")
+    parser.add_argument("--workers", type=int, default=1, help="ワーカープロセス数。")
+    parser.add_argument("--force", action="store_true", help="最新のピラミッドがあっても作り直す。")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.nh9"), recursive=True)))
+        else:
+            files.append(path)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(build_pyramid_file, f, force=args.force): f for f in files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Building pyramids", unit="file"):
+            try:
+                future.result()
+            except Exception as e:
+                tqdm.write(f"エラー: {futures[future]} のピラミッドの作成中に問題が発生しました: {e}")
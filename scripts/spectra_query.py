@@ -0,0 +1,206 @@
+import os
+import csv
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from nh9reader import NH9Cube, HEIGHT, WIDTH, BANDS
+from extract_id import open_index
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DEFAULT_WORKERS = 8
+ROWS_PER_TASK = 32
+
+def resolve_sources(sources, db_path=None):
+    """
+    点の指定元（NH9ファイルのパス、または日時ID）をNH9ファイルのパスに変換する。
+
+    - 日時ID (YYYYMMDD_HHMMSS) は extract_id.py のインデックス (SQLite) から検索する。
+
+    Args:
+        sources (iterable of str): NH9ファイルのパス、または日時ID。
+        db_path (str, optional): インデックスのSQLiteデータベースのパス（日時IDを使う場合は必須）。
+
+    Returns:
+        dict: {指定元: NH9ファイルのパス}。
+
+    Raises:
+        ValueError: 日時IDを解決できない（インデックスがない、見つからない、複数のファイルに一致する）場合。
+    """
+    resolved = {}
+    ids = []
+    for source in set(sources):
+        if source.endswith(".nh9") or os.path.exists(source):
+            resolved[source] = source
+        else:
+            ids.append(source)
+    if not ids:
+        return resolved
+    if db_path is None or not os.path.exists(db_path):
+        raise ValueError(f"日時IDの解決にはインデックスが必要です (--db): {ids[0]}")
+
+    conn = open_index(db_path)
+    try:
+        root = conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+        root = root["value"] if root is not None else ""
+        for file_id in ids:
+            rows = conn.execute("SELECT path FROM files WHERE id = ?", (file_id,)).fetchall()
+            if len(rows) != 1:
+                state = "見つかりません" if not rows else f"{len(rows)} 個のファイルに一致します"
+                raise ValueError(f"日時ID {file_id} が{state}")
+            resolved[file_id] = os.path.normpath(os.path.join(root, rows[0]["path"]))
+    finally:
+        conn.close()
+    return resolved
+
+def read_file_spectra(nh9_path, rows, cols, height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    1つのNH9ファイルから、指定した画素のスペクトルを読み込む（スレッドプールのワーカーで実行）。
+
+    - BIL形式では1行（スキャンライン）の全バンドが連続しているため、点を含む行のみを読み込む。
+    - 連続する行はまとめて1回で読み込む。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        rows (numpy.ndarray): 各点の行（昇順）。
+        cols (numpy.ndarray): 各点の列。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+
+    Returns:
+        numpy.ndarray: (点の数, bands) の uint16 配列。
+    """
+    cube = NH9Cube(nh9_path, height, width, bands)
+    spectra = np.empty((len(rows), bands), dtype=cube.dtype)
+    unique_rows, first = np.unique(rows, return_index=True)
+    breaks = np.flatnonzero(np.diff(unique_rows) != 1) + 1
+    for run in np.split(np.arange(len(unique_rows)), breaks):
+        start, stop = int(unique_rows[run[0]]), int(unique_rows[run[-1]]) + 1
+        lines = cube.read_rows(start, stop)
+        begin = first[run[0]]
+        end = first[run[-1] + 1] if run[-1] + 1 < len(first) else len(rows)
+        spectra[begin:end] = lines[rows[begin:end] - start, :, cols[begin:end]]
+    return spectra
+
+def query_spectra(points, db_path=None, workers=DEFAULT_WORKERS, height=HEIGHT, width=WIDTH, bands=BANDS):
+    """
+    多数のキャプチャの指定した画素のスペクトルをまとめて取得する。
+
+    - 点をファイルと行ごとにまとめ、点を含むスキャンラインのみをスレッドプールで並列に読み込む。
+
+    Args:
+        points (list of tuple): (NH9ファイルのパスまたは日時ID, 行, 列) のリスト。
+        db_path (str, optional): 日時IDを解決するためのインデックスのSQLiteデータベースのパス。
+        workers (int, optional): 読み込みに使うスレッド数。デフォルトは8。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+
+    Returns:
+        dict: 入力の点の順に並べた "source", "path"（文字列の配列）, "row", "col"（int32 の配列）,
+            "spectra"（(点の数, bands) の uint16 配列）。
+
+    Raises:
+        ValueError: 座標が画像の範囲外、または日時IDを解決できない場合。
+    """
+    sources = np.array([str(p[0]) for p in points])
+    rows = np.array([int(p[1]) for p in points], dtype=np.int32)
+    cols = np.array([int(p[2]) for p in points], dtype=np.int32)
+    outside = (rows < 0) | (rows >= height) | (cols < 0) | (cols >= width)
+    if outside.any():
+        i = int(np.flatnonzero(outside)[0])
+        raise ValueError(f"座標が画像の範囲外です: {points[i]}")
+
+    resolved = resolve_sources(sources, db_path)
+    paths = np.array([resolved[s] for s in sources])
+    spectra = np.empty((len(points), bands), dtype=np.uint16)
+
+    # ファイル・行の順に並べ、ファイルごとに ROWS_PER_TASK 行ずつのタスクに分ける
+    order = np.lexsort((cols, rows, paths))
+    tasks = []
+    for path in np.unique(paths):
+        selected = order[paths[order] == path]
+        unique_rows = np.unique(rows[selected])
+        for start in range(0, len(unique_rows), ROWS_PER_TASK):
+            chunk_rows = unique_rows[start:start + ROWS_PER_TASK]
+            tasks.append((path, selected[np.isin(rows[selected], chunk_rows)]))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(index, executor.submit(read_file_spectra, path, rows[index], cols[index], height, width, bands))
+                   for path, index in tasks]
+        for index, future in futures:
+            spectra[index] = future.result()
+
+    return {"source": sources, "path": paths, "row": rows, "col": cols, "spectra": spectra}
+
+def load_points(file_path):
+    """
+    点のリストをCSVファイルから読み込む。
+
+    - 各行は「NH9ファイルのパスまたは日時ID, 行, 列」。数値でない行（ヘッダー）は無視する。
+
+    Args:
+        file_path (str): CSVファイルのパス。
+
+    Returns:
+        list of tuple: (指定元, 行, 列) のリスト。
+    """
+    points = []
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
+        for record in csv.reader(f):
+            if len(record) < 3 or not record[1].strip().isdigit():
+                continue
+            points.append((record[0].strip(), int(record[1]), int(record[2])))
+    return points
+
+def save_spectra(result, output_path):
+    """
+    取得したスペクトルを .npz または .parquet（pyarrow がある場合）として保存する。
+
+    Args:
+        result (dict): `query_spectra` の結果。
+        output_path (str): 出力ファイルのパス（拡張子で形式を選ぶ）。
+
+    Returns:
+        None
+
+    Raises:
+        ImportError: .parquet を指定したが pyarrow がインストールされていない場合。
+    """
+    if output_path.endswith(".parquet"):
+        if pa is None:
+            raise ImportError("Parquet で保存するには pyarrow が必要です")
+        spectra = result["spectra"]
+        table = pa.table({
+            "source": result["source"],
+            "path": result["path"],
+            "row": result["row"],
+            "col": result["col"],
+            "spectrum": pa.FixedSizeListArray.from_arrays(pa.array(spectra.ravel()), spectra.shape[1]),
+        })
+        pq.write_table(table, output_path)
+    else:
+        np.savez_compressed(output_path, **result)
+
+if __name__ == "__main__":
+    """
+    CSVファイルで指定した (NH9ファイルのパスまたは日時ID, 行, 列) の点のスペクトルをまとめて取得し、保存する。
+    """
+    parser = argparse.ArgumentParser(description="多数のNH9ファイルの指定した画素のスペクトルをまとめて取得する。")
+    parser.add_argument("points", help="「NH9ファイルのパスまたは日時ID, 行, 列」のCSVファイル。")
+    parser.add_argument("--db", default="hsi_data_ids.sqlite", help="日時IDを解決するインデックス (extract_id.py) のパス。")
+    parser.add_argument("--output", default="spectra.npz", help="出力ファイル (.npz または .parquet)。")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="読み込みに使うスレッド数。")
+    args = parser.parse_args()
+
+    try:
+        result = query_spectra(load_points(args.points), args.db, args.workers)
+        save_spectra(result, args.output)
+        print(f"Saved {len(result['spectra'])} spectra to {args.output}")
+    except (ValueError, ImportError) as e:
+        print(f"エラー: {e}")
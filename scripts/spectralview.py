@@ -1,24 +1,13 @@
 import os
-import re
+import sys
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
-from tkinter import Tk, filedialog
-from matplotlib.widgets import Slider
-
-def parse_filename(file_name):
-    """
-    ファイル名からメタデータを解析する。
-
-    Args:
-        file_name (str): 解析対象のNH9ファイル名。
-
-    Returns:
-        dict: 解析されたメタデータ（scan, gain, exposure, wavelength, datetime）。
-              マッチしない場合は空の辞書を返す。
-    """
-    pattern = r"Scan-d\(s(?P<scan>.+),g(?P<gain>\d+),(?P<exposure>[\d.]+ms),(?P<wavelength>\d+-\d+)\)_(?P<datetime>\d+_\d+)\.nh9"
-    match = re.match(pattern, file_name)
-    return match.groupdict() if match else {}
+from matplotlib.widgets import Slider, RangeSlider, RadioButtons
+from nh9reader import NH9Cube, parse_filename, HEIGHT, WIDTH, BANDS
+from camera import RGB_BANDS
+from bandstats import load_band_stats
+from pyramid import open_pyramid_cube, BandRangeSum
 
 def select_file():
     """
@@ -27,6 +16,8 @@ def select_file():
     Returns:
         str: 選択されたファイルのパス（選択されなかった場合は空文字列）。
     """
+    from tkinter import Tk, filedialog  # ファイルを引数で指定した場合は読み込まない
+
     root = Tk()
     root.withdraw()  # メインウィンドウを非表示にする
     return filedialog.askopenfilename(
@@ -38,6 +29,8 @@ def load_hsi_data(file_path, height, width, bands, dtype=np.uint16):
     """
     HSIデータをNH9ファイルから読み込む。
 
+    - ファイルはメモリマップで開かれ、表示したバンドのページのみが読み込まれる。
+
     Args:
         file_path (str): 読み込むNH9ファイルのパス。
         height (int): 画像の高さ（ピクセル）。
@@ -46,44 +39,219 @@ def load_hsi_data(file_path, height, width, bands, dtype=np.uint16):
         dtype (numpy.dtype): 読み込むデータの型（デフォルトは np.uint16）。
 
     Returns:
-        numpy.ndarray: (height, width, bands) の形状を持つ3次元配列のHSIデータ。
+        numpy.ndarray: (height, width, bands) の形状を持つ3次元配列のHSIデータ（メモリマップのビュー）。
+
+    Raises:
+        ValueError: ファイルサイズが指定したジオメトリと一致しない場合。
+    """
+    return NH9Cube(file_path, height, width, bands, dtype).to_hwc()  # 転置して正しい順序にする
+
+def band_clim(band_image, band, band_stats=None):
+    """
+    バンド画像の表示範囲（コントラスト）を返す。
+
+    - バンド統計量があればその min/max を使い、画素を走査しない。
+
+    Args:
+        band_image (numpy.ndarray): (height, width) のバンド画像。
+        band (int): バンド番号。
+        band_stats (dict, optional): `bandstats.load_band_stats` の統計量。
+
+    Returns:
+        tuple: (vmin, vmax)。
+    """
+    if band_stats is not None:
+        return band_stats["min"][band], band_stats["max"][band]
+    return band_image.min(), band_image.max()
+
+def band_wavelength(band):
+    """
+    バンド番号の中心波長 (nm) を返す（350 nm から 5 nm 間隔）。
+
+    Args:
+        band (int or numpy.ndarray): バンド番号。
+
+    Returns:
+        int or numpy.ndarray: 波長 (nm)。
+    """
+    return 350 + 5 * band
+
+def metadata_line(metadata):
+    """
+    タイトルに表示するメタデータの行を作成する。
     """
-    with open(file_path, "rb") as f:
-        raw_data = np.fromfile(f, dtype, -1)
-    img = np.reshape(raw_data, (height, bands, width))
-    return np.transpose(img, (0, 2, 1))  # 転置して正しい順序にする
+    return f"scan: {metadata.get('scan', 'N/A')}, gain: {metadata.get('gain', 'N/A')}, " \
+           f"exposure: {metadata.get('exposure', 'N/A')}, wavelength: {metadata.get('wavelength', 'N/A')}"
 
-def interactive_band_viewer(hsi_data, metadata):
+def band_title(band, metadata, factor=1):
+    """
+    バンド画像のタイトル（波長・メタデータ・表示解像度）を作成する。
+
+    Args:
+        band (int): バンド番号。
+        metadata (dict): ファイル名から取得したメタデータ。
+        factor (int, optional): 表示しているレベルの縮小率。
+
+    Returns:
+        str: タイトル文字列。
+    """
+    resolution = "" if factor == 1 else f" [1/{factor}]"
+    return f"Band {band} ({band_wavelength(band)} nm){resolution}\n{metadata_line(metadata)}"
+
+def rgb_title(ranges, metadata, factor=1):
+    """
+    RGB合成画像のタイトル（各チャンネルのバンド範囲・メタデータ・表示解像度）を作成する。
+
+    Args:
+        ranges (sequence of tuple): R, G, B の (開始, 終了) のバンド範囲。
+        metadata (dict): ファイル名から取得したメタデータ。
+        factor (int, optional): 表示しているレベルの縮小率。
+
+    Returns:
+        str: タイトル文字列。
+    """
+    resolution = "" if factor == 1 else f" [1/{factor}]"
+    channels = ", ".join(f"{name}: {band_wavelength(b0)}-{band_wavelength(b1 - 1)} nm"
+                         for name, (b0, b1) in zip("RGB", ranges))
+    return f"RGB ({channels}){resolution}\n{metadata_line(metadata)}"
+
+def range_channel_max(band_stats, ranges):
+    """
+    バンド統計量から、各チャンネル（バンド範囲の平均）の正規化に使う最大値を求める。
+
+    - `hs_to_rgbV2.py --use-stats` と同じく、バンド範囲のバンドごとの最大値の平均を使う。
+
+    Args:
+        band_stats (dict): `bandstats.load_band_stats` の統計量。
+        ranges (sequence of tuple): R, G, B の (開始, 終了) のバンド範囲。
+
+    Returns:
+        tuple: (R, G, B) の最大値。
+    """
+    return tuple(max(float(np.mean(band_stats["max"][b0:b1])), 1.0) for b0, b1 in ranges)
+
+def rgb_composite(channel_sums, ranges, channel_max=None):
+    """
+    R/G/B のバンド範囲の和から、各チャンネルを最大値で 0-255 に正規化したRGB画像を作成する。
+
+    - channel_max を指定しない場合は、`hs_to_rgbV2.py` と同じく各チャンネルの平均の最大値で正規化する。
+
+    Args:
+        channel_sums (sequence of numpy.ndarray): R, G, B の (height, width) のバンド和。
+        ranges (sequence of tuple): R, G, B の (開始, 終了) のバンド範囲。
+        channel_max (sequence of float, optional): R, G, B の正規化に使う最大値。
+
+    Returns:
+        numpy.ndarray: (height, width, 3) の uint8 のRGB画像。
+    """
+    rgb_image = np.empty(channel_sums[0].shape + (3,), dtype=np.uint8)
+    for channel, (sums, (b0, b1)) in enumerate(zip(channel_sums, ranges)):
+        count = b1 - b0
+        peak = channel_max[channel] if channel_max is not None else max(float(sums.max()) / count, 1.0)
+        scaled = np.multiply(sums, np.float32(255 / (peak * count)), dtype=np.float32)
+        rgb_image[:, :, channel] = np.minimum(scaled, 255, out=scaled)
+    return rgb_image
+
+def interactive_band_viewer(pyramid, metadata, band_stats=None, rgb_bands=RGB_BANDS):
     """
     HSIデータをスライダーでバンドを切り替えながら可視化する。
 
-    - 初期状態では最初のバンドを表示。
-    - スライダーを動かすと異なるバンドが表示される。
+    - 初期状態では最初のバンドを最も粗い縮小レベルで表示するため、すぐに表示される。
+    - ズームすると、表示範囲の画素数に見合ったレベル（最終的には元解像度）に切り替える。
+    - スライダーを動かすと異なるバンドが表示される。読み込んだバンド画像はLRUキャッシュに保持する。
+    - バンド統計量が与えられた場合は、表示範囲（RGB合成では正規化の最大値）をその min/max から設定する。
+    - RGBモードでは R/G/B の範囲スライダーで選んだバンド範囲の平均を合成して表示する。バンド範囲の和は
+      縮小レベル・チャンネルごとに `pyramid.BandRangeSum` に保持し、範囲を変更すると差分のバンドのみを加減算する。
+    - 画像をクリックすると、その画素のスペクトルをメモリマップから読み込んで右側に表示する（Shift+クリックで重ねて表示）。
 
     Args:
-        hsi_data (numpy.ndarray): (height, width, bands) の形状を持つ3次元配列のHSIデータ。
+        pyramid (pyramid.PyramidCube): 元解像度のキューブと縮小ピラミッド。
         metadata (dict): ファイル名から取得したメタデータ。
+        band_stats (dict, optional): `bandstats.load_band_stats` の統計量。
+        rgb_bands (sequence of tuple, optional): RGB合成の初期の (開始, 終了) のバンド範囲 (R, G, B)。
 
     Returns:
         None
     """
-    initial_band = 0
-    max_band = hsi_data.shape[2] - 1
+    state = {"band": 0, "factor": pyramid.coarsest, "mode": "Gray", "ranges": [tuple(r) for r in rgb_bands]}
+    range_sums = {}  # (縮小率, チャンネル): BandRangeSum
+    max_band = pyramid.bands - 1
+    wavelengths = band_wavelength(np.arange(pyramid.bands))
+
+    fig, (ax, ax_spectrum) = plt.subplots(1, 2, figsize=(13, 7), gridspec_kw={"width_ratios": [3, 2]})
+    plt.subplots_adjust(bottom=0.32, wspace=0.3)
+
+    def level_extent(image, factor):
+        return (0, image.shape[1] * factor, image.shape[0] * factor, 0)
+
+    band_image = pyramid.band(state["band"], state["factor"])
+    vmin, vmax = band_clim(band_image, state["band"], band_stats)
+    img = ax.imshow(band_image, cmap="gray", vmin=vmin, vmax=vmax, interpolation="nearest",
+                    extent=level_extent(band_image, state["factor"]))
 
-    fig, ax = plt.subplots(figsize=(8, 6))
-    plt.subplots_adjust(bottom=0.25)
+    ax.set_title(band_title(state["band"], metadata, state["factor"]))
+    colorbar = plt.colorbar(img, ax=ax, label="Intensity")
 
-    band_image = hsi_data[:, :, initial_band]
-    img = ax.imshow(band_image, cmap="gray")
+    ax_spectrum.set_title("Click a pixel to plot its spectrum (Shift+click to add)")
+    ax_spectrum.set_xlabel("Wavelength (nm)")
+    ax_spectrum.set_ylabel("Intensity")
+    ax_spectrum.set_xlim(wavelengths[0], wavelengths[-1])
+    band_marker = ax_spectrum.axvline(band_wavelength(state["band"]), color="gray", linestyle="--")
+    spans = [None, None, None]
+    spectra = []  # (スペクトルの線, 画像上の印)
 
-    title_text = f"Band {initial_band} ({350 + 5 * initial_band} nm)\n" \
-                 f"scan: {metadata.get('scan', 'N/A')}, gain: {metadata.get('gain', 'N/A')}, " \
-                 f"exposure: {metadata.get('exposure', 'N/A')}, wavelength: {metadata.get('wavelength', 'N/A')}"
-    ax.set_title(title_text)
-    plt.colorbar(img, ax=ax, label="Intensity")
+    ax_mode = plt.axes([0.03, 0.06, 0.08, 0.12])
+    mode_buttons = RadioButtons(ax_mode, ("Gray", "RGB"))
+    ax_slider = plt.axes([0.2, 0.2, 0.65, 0.03], facecolor="lightgoldenrodyellow")
+    slider = Slider(ax_slider, "Band", 0, max_band, valinit=state["band"], valstep=1)
+    range_sliders = []
+    for channel, (name, (b0, b1)) in enumerate(zip("RGB", state["ranges"])):
+        ax_range = plt.axes([0.2, 0.14 - 0.045 * channel, 0.65, 0.03], facecolor="lightgoldenrodyellow")
+        range_sliders.append(RangeSlider(ax_range, name, 0, max_band, valinit=(b0, b1 - 1), valstep=1))
 
-    ax_slider = plt.axes([0.2, 0.1, 0.65, 0.03], facecolor="lightgoldenrodyellow")
-    slider = Slider(ax_slider, "Band", 0, max_band, valinit=initial_band, valstep=1)
+    def rgb_image(factor):
+        """
+        現在のバンド範囲の和（差分のみ更新）からRGB合成画像を作成する。
+        """
+        ranges = state["ranges"]
+        channel_sums = [range_sums.setdefault((factor, channel), BandRangeSum(pyramid, factor)).update(b0, b1)
+                        for channel, (b0, b1) in enumerate(ranges)]
+        channel_max = range_channel_max(band_stats, ranges) if band_stats is not None else None
+        return rgb_composite(channel_sums, ranges, channel_max)
+
+    def show_markers():
+        """
+        スペクトル図に、表示中のバンド（Grayモード）またはバンド範囲（RGBモード）を表示する。
+        """
+        rgb = state["mode"] == "RGB"
+        band_marker.set_xdata([band_wavelength(state["band"])] * 2)
+        band_marker.set_visible(not rgb)
+        for channel, ((b0, b1), color) in enumerate(zip(state["ranges"], ("red", "green", "blue"))):
+            if spans[channel] is not None:
+                spans[channel].remove()
+            spans[channel] = ax_spectrum.axvspan(band_wavelength(b0), band_wavelength(b1 - 1), color=color, alpha=0.15)
+            spans[channel].set_visible(rgb)
+
+    def show():
+        """
+        現在のモード・バンド・縮小レベルの画像を表示する。
+        """
+        band, factor = state["band"], state["factor"]
+        if state["mode"] == "RGB":
+            image = rgb_image(factor)
+            ax.set_title(rgb_title(state["ranges"], metadata, factor))
+        else:
+            image = pyramid.band(band, factor)
+            vmin, vmax = band_clim(image, band, band_stats)
+            img.set_clim(vmin=vmin, vmax=vmax)
+            ax.set_title(band_title(band, metadata, factor))
+        img.set_data(image)
+        extent = level_extent(image, factor)
+        if tuple(img.get_extent()) != extent:
+            img.set_extent(extent)
+        colorbar.ax.set_visible(state["mode"] == "Gray")
+        show_markers()
+        fig.canvas.draw_idle()
 
     def update(val):
         """
@@ -95,32 +263,97 @@ def interactive_band_viewer(hsi_data, metadata):
         Returns:
             None
         """
-        band = int(slider.val)
-        band_image = hsi_data[:, :, band]
-        img.set_data(band_image)
-        img.set_clim(vmin=band_image.min(), vmax=band_image.max())
+        state["band"] = int(slider.val)
+        if state["mode"] != "Gray":
+            mode_buttons.set_active(0)  # on_mode から表示を更新する
+        else:
+            show()
 
-        updated_title = f"Band {band} ({350 + 5 * band} nm)\n" \
-                        f"scan: {metadata.get('scan', 'N/A')}, gain: {metadata.get('gain', 'N/A')}, " \
-                        f"exposure: {metadata.get('exposure', 'N/A')}, wavelength: {metadata.get('wavelength', 'N/A')}"
-        ax.set_title(updated_title)
+    def update_ranges(val):
+        """
+        範囲スライダーの値変更時に、RGB合成のバンド範囲を更新する（RGBモードに切り替える）。
+        """
+        state["ranges"] = [(int(lo), int(hi) + 1) for lo, hi in (s.val for s in range_sliders)]
+        if state["mode"] != "RGB":
+            mode_buttons.set_active(1)
+        else:
+            show()
+
+    def on_mode(label):
+        """
+        Gray / RGB モードの切り替え時に呼び出される。
+        """
+        state["mode"] = label
+        show()
+
+    def on_click(event):
+        """
+        画像のクリック時に、その画素のスペクトルを表示する（ズーム・パン中は無視する）。
+        """
+        toolbar = fig.canvas.toolbar
+        if event.inaxes is not ax or event.button != 1 or (toolbar is not None and toolbar.mode):
+            return
+        row = min(max(int(event.ydata), 0), pyramid.height - 1)
+        col = min(max(int(event.xdata), 0), pyramid.width - 1)
+        if event.key != "shift":
+            for line, point in spectra:
+                line.remove()
+                point.remove()
+            spectra.clear()
+        line, = ax_spectrum.plot(wavelengths, pyramid.cube.spectrum(row, col), label=f"({row}, {col})")
+        point, = ax.plot(col + 0.5, row + 0.5, marker="+", markersize=12, color=line.get_color())
+        spectra.append((line, point))
+        ax_spectrum.relim()
+        ax_spectrum.autoscale_view(scalex=False)
+        ax_spectrum.legend(loc="upper right", fontsize="small")
         fig.canvas.draw_idle()
 
+    def on_view_changed(_):
+        """
+        ズーム・パン・ウィンドウサイズの変更時に、表示に十分な縮小レベルへ切り替える。
+        """
+        x0, x1 = ax.get_xlim()
+        y0, y1 = ax.get_ylim()
+        bbox = ax.get_window_extent()
+        factor = pyramid.factor_for_view(abs(x1 - x0), abs(y1 - y0), bbox.width, bbox.height)
+        if factor != state["factor"]:
+            state["factor"] = factor
+            show()
+
     slider.on_changed(update)
+    for range_slider in range_sliders:
+        range_slider.on_changed(update_ranges)
+    mode_buttons.on_clicked(on_mode)
+    show_markers()
+    ax.callbacks.connect("xlim_changed", on_view_changed)
+    ax.callbacks.connect("ylim_changed", on_view_changed)
+    fig.canvas.mpl_connect("resize_event", on_view_changed)
+    fig.canvas.mpl_connect("button_press_event", on_click)
     plt.show()
 
-if __name__ == "__main__":
+def main(argv=None, prog=None):
     """
     メイン処理:
-    - NH9ファイルを選択。
+    - NH9ファイルを選択（引数で指定しない場合はファイル選択ダイアログを開く）。
     - ファイル名からメタデータを解析。
-    - HSIデータを読み込む。
+    - HSIデータをメモリマップで開き、プレビュー用の縮小ピラミッドを読み込む（ない場合は作成し、
+      作成できない場合は元解像度のみで表示する）。
+    - ファイルを開けない・形状が合わない場合はエラーを表示して終了コード 1 で終了する（それ以外の例外はそのまま送出する）。
+    - バンド統計量のサイドカーファイルがあれば読み込む。
     - インタラクティブビューアでデータを可視化。
 
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py view` から呼ばれる場合など）。
+
     Raises:
         FileNotFoundError: ファイルが存在しない場合にエラーメッセージを表示して終了する。
     """
-    file_path = select_file()
+    parser = argparse.ArgumentParser(prog=prog, description="NH9ファイルのスペクトルバンドを可視化する。")
+    parser.add_argument("file", nargs="?", help="表示するNH9ファイル（省略時はファイル選択ダイアログを開く）。")
+    args = parser.parse_args(argv)
+
+    file_path = args.file or select_file()
     if not file_path or not os.path.exists(file_path):
         print("エラー: ファイルが選択されなかったか、存在しません。")
         exit()
@@ -130,13 +363,20 @@ if __name__ == "__main__":
     metadata = parse_filename(os.path.basename(file_path))
     print("ファイルのメタデータ:", metadata)
 
-    height, width, bands = 1080, 2048, 151  # カメラの仕様
-    dtype = np.uint16  # 12ビットデータ → np.uint16 として扱う
+    height, width, bands = HEIGHT, WIDTH, BANDS  # カメラの仕様 (camera.py)
 
     try:
-        hsi_data = load_hsi_data(file_path, height, width, bands, dtype)
-        print(f"HSIデータの形状: {hsi_data.shape}")
+        pyramid = open_pyramid_cube(file_path, height, width, bands)
+        print(f"HSIデータの形状: {(pyramid.height, pyramid.width, pyramid.bands)}")
+
+        band_stats = load_band_stats(file_path)
+        if band_stats is None:
+            print("バンド統計量のサイドカーファイルがないため、表示範囲はバンドごとに計算します（bandstats.py で作成できます）。")
 
-        interactive_band_viewer(hsi_data, metadata)
-    except Exception as e:
-        print(f"エラーが発生しました: {e}")
+        interactive_band_viewer(pyramid, metadata, band_stats)
+    except (OSError, ValueError) as e:
+        print(f"エラー: {file_path} を表示できません: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
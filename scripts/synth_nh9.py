@@ -0,0 +1,197 @@
+import os
+import json
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+from nh9reader import HEIGHT, WIDTH, BANDS
+
+DEFAULT_BLOCK_ROWS = 64
+OBJECT_TAGS = ("person", "car", "tree", "building", "bicycle", "sign", "bench", "dog", "window", "road")
+SCENE_TAGS = ("street", "park", "campus", "parking lot", "station", "outdoor man-made", "indoor", "False")
+
+def synthetic_block(row_start, row_stop, height, width, bands, rng):
+    """
+    実データに近い滑らかな12ビットのBILキューブの行範囲を生成する。
+
+    - 空間方向のなだらかな明るさの変化 × 山形のスペクトル + ガウスノイズ。
+
+    Args:
+        row_start (int): 開始行。
+        row_stop (int): 終了行（含まない）。
+        height (int): 画像全体の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        rng (numpy.random.Generator): ノイズの乱数生成器。
+
+    Returns:
+        numpy.ndarray: (row_stop - row_start, bands, width) の uint16 配列。
+    """
+    rows = np.linspace(0, 1, height, dtype=np.float32)[row_start:row_stop, None, None]
+    cols = np.linspace(0, 1, width, dtype=np.float32)[None, None, :]
+    spectrum = np.sin(np.linspace(0, np.pi, bands, dtype=np.float32))[None, :, None]
+    block = 1500 * spectrum * (0.5 + 0.5 * rows * cols) + 300
+    block += rng.normal(0, 20, size=block.shape).astype(np.float32)
+    return np.clip(block, 0, 4095).astype(np.uint16)
+
+def synthetic_cube(height, width, bands, seed=0):
+    """
+    ベンチマーク用に、実データに近い滑らかな12ビットのBILキューブを生成する。
+
+    Args:
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        seed (int, optional): 乱数シード。
+
+    Returns:
+        numpy.ndarray: (height, bands, width) の uint16 配列。
+    """
+    return synthetic_block(0, height, height, width, bands, np.random.default_rng(seed))
+
+def synthetic_file_name(timestamp, scan=1, gain=2, exposure="3.5ms", wavelength="350-1100"):
+    """
+    実機と同じ命名規則のNH9ファイル名を返す。
+
+    Args:
+        timestamp (datetime): 撮影日時。
+        scan (int, optional): スキャン番号。
+        gain (int, optional): ゲイン。
+        exposure (str, optional): 露光時間。
+        wavelength (str, optional): 波長範囲。
+
+    Returns:
+        str: 「Scan-d(s<scan>,g<gain>,<exposure>,<wavelength>)_YYYYMMDD_HHMMSS.nh9」形式のファイル名。
+    """
+    return f"Scan-d(s{scan},g{gain},{exposure},{wavelength})_{timestamp:%Y%m%d_%H%M%S}.nh9"
+
+def write_synthetic_nh9(file_path, height=HEIGHT, width=WIDTH, bands=BANDS, seed=0, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    合成キューブをNH9ファイルとして書き込む（行ブロックごとに生成するため、フレーム全体をメモリに載せない）。
+
+    Args:
+        file_path (str): 出力するNH9ファイルのパス。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        seed (int, optional): 乱数シード（同じシードからは同じファイルが生成される）。
+        block_rows (int, optional): 1ブロックあたりの行数。
+
+    Returns:
+        int: 書き込んだバイト数。
+    """
+    rng = np.random.default_rng(seed)
+    written = 0
+    with open(file_path, "wb") as f:
+        for start in range(0, height, block_rows):
+            block = synthetic_block(start, min(start + block_rows, height), height, width, bands, rng)
+            f.write(block.tobytes())
+            written += block.nbytes
+    return written
+
+def generate_dataset(output_dir, dates=1, locations=2, files_per_location=3, height=HEIGHT, width=WIDTH, bands=BANDS,
+                     seed=0, start=datetime(2024, 8, 1, 12, 0, 0)):
+    """
+    「日付フォルダ/場所フォルダ/*.nh9」の階層を持つ合成データセットを生成する。
+
+    Args:
+        output_dir (str): 出力先のルートフォルダ。
+        dates (int, optional): 日付フォルダ数。
+        locations (int, optional): 日付フォルダあたりの場所フォルダ数。
+        files_per_location (int, optional): 場所フォルダあたりのNH9ファイル数。
+        height (int): 画像の高さ。
+        width (int): 画像の幅。
+        bands (int): スペクトルのバンド数。
+        seed (int, optional): 乱数シード。
+        start (datetime, optional): 最初のファイルの撮影日時。
+
+    Returns:
+        list of str: 生成したNH9ファイルのパス。
+    """
+    files = []
+    for d in range(dates):
+        day = start + timedelta(days=d)
+        for loc in range(locations):
+            folder = os.path.join(output_dir, f"{day:%d%m%Y}", f"loc{loc}")
+            os.makedirs(folder, exist_ok=True)
+            for i in range(files_per_location):
+                timestamp = day + timedelta(minutes=loc * 10, seconds=i)
+                path = os.path.join(folder, synthetic_file_name(timestamp, scan=i + 1))
+                write_synthetic_nh9(path, height, width, bands, seed + len(files))
+                files.append(path)
+    return files
+
+def generate_placeholder_tree(output_dir, count, dates=4, locations=5, start=datetime(2024, 8, 1, 12, 0, 0)):
+    """
+    ファイル名のみを使う処理（extract_id.py のインデックス作成など）のベンチマーク用に、
+    命名規則どおりの空のNH9ファイルを多数生成する。
+
+    Args:
+        output_dir (str): 出力先のルートフォルダ。
+        count (int): 生成するファイル数。
+        dates (int, optional): 日付フォルダ数。
+        locations (int, optional): 日付フォルダあたりの場所フォルダ数。
+        start (datetime, optional): 最初のファイルの撮影日時。
+
+    Returns:
+        list of str: 生成したファイルのパス。
+    """
+    files = []
+    for i in range(count):
+        d, loc = i % dates, (i // dates) % locations
+        day = start + timedelta(days=d)
+        folder = os.path.join(output_dir, f"{day:%d%m%Y}", f"loc{loc}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, synthetic_file_name(day + timedelta(seconds=i), scan=i % 9 + 1))
+        open(path, "wb").close()
+        files.append(path)
+    return files
+
+def write_synthetic_metadata(output_path, records, seed=0):
+    """
+    tagcount.py のベンチマーク用に、タグを持つメタデータのJSON配列を生成する。
+
+    Args:
+        output_path (str): 出力するJSONファイルのパス。
+        records (int): レコード数。
+        seed (int, optional): 乱数シード。
+
+    Returns:
+        int: 書き込んだバイト数。
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 8, 1, 12, 0, 0)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i in range(records):
+            item = {
+                "id": f"{start + timedelta(seconds=i):%Y%m%d_%H%M%S}",
+                "object_tags": rng.choice(OBJECT_TAGS, size=rng.integers(1, 5), replace=False).tolist(),
+                "scene_tags": rng.choice(SCENE_TAGS, size=rng.integers(1, 3), replace=False).tolist(),
+            }
+            f.write(("," if i else "") + "\n    " + json.dumps(item))
+        f.write("\n]\n")
+    return os.path.getsize(output_path)
+
+if __name__ == "__main__":
+    """
+    ベンチマーク・テスト用の合成NH9データセット（日付フォルダ/場所フォルダ/*.nh9）を生成する。
+
+    - ファイル名は実機と同じ命名規則 (Scan-d(...)_YYYYMMDD_HHMMSS.nh9) に従う。
+    - --small で小さいジオメトリ (270 × 512 × 151) のファイルを生成する。
+    """
+    parser = argparse.ArgumentParser(description="合成NH9データセットを生成する。")
+    parser.add_argument("output_dir", help="出力先のルートフォルダ。")
+    parser.add_argument("--dates", type=int, default=1, help="日付フォルダ数。")
+    parser.add_argument("--locations", type=int, default=2, help="日付フォルダあたりの場所フォルダ数。")
+    parser.add_argument("--files", type=int, default=3, help="場所フォルダあたりのNH9ファイル数。")
+    parser.add_argument("--small", action="store_true", help="小さいジオメトリ (270 × 512 × 151) で生成する。")
+    parser.add_argument("--metadata", type=int, default=0, help="指定した件数のタグ付きメタデータ (metadata.json) も生成する。")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード。")
+    args = parser.parse_args()
+
+    height, width = (HEIGHT // 4, WIDTH // 4) if args.small else (HEIGHT, WIDTH)
+    files = generate_dataset(args.output_dir, args.dates, args.locations, args.files, height, width, BANDS, args.seed)
+    print(f"Generated {len(files)} files ({height}x{width}x{BANDS}) in {args.output_dir}")
+    if args.metadata:
+        write_synthetic_metadata(os.path.join(args.output_dir, "metadata.json"), args.metadata, args.seed)
+        print(f"Generated {args.metadata} metadata records")
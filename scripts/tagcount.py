@@ -1,53 +1,220 @@
+import os
 import json
-import matplotlib.pyplot as plt
+import glob
+import argparse
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from manifest import Manifest
 
-def count_tags_and_plot(file_path):
+IGNORED_SCENE_TAGS = {
+    "indoor", "outdoor natural", "outdoor man-made", "shopping and dining", "workplace",
+    "home or hotel", "transportation", "water", "ice", "snow", "forest,field,jungle",
+    "sports field,parks,leisure spaces", "cultural or historical", "commercial buildings,shops,markets,cities,and towns",
+    "shopping and dining,great hall", "indoor, shopping and dining, great hall",
+    "houses,cabins,gardens,and farms", "water,ice,snow", "False"
+}
+IGNORED_OBJECT_TAGS = {"False"}
+READ_CHUNK_CHARS = 1024 * 1024
+DEFAULT_CACHE = "tagcount_cache.json"
+
+def iter_json_array(f, chunk_chars=READ_CHUNK_CHARS):
     """
-    JSONファイルからオブジェクトタグとシーンタグの出現回数をカウントし、可視化する。
+    JSON配列のファイルを先頭から少しずつ読み込み、要素を1つずつ返す（ファイル全体をメモリに載せない）。
 
-    - JSONファイル内の `object_tags` と `scene_tags` を集計。
-    - 事前に指定した無視するタグを除外。
-    - カウント結果を降順にソートし、棒グラフとしてプロット。
+    Args:
+        f (io.TextIOBase): JSON配列を含むテキストファイル。
+        chunk_chars (int, optional): 1回に読み込む文字数。デフォルトは1M文字。
+
+    Yields:
+        object: 配列の各要素。
+
+    Raises:
+        ValueError: ファイルがJSON配列でない、または途中で切れている場合。
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_chars).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("JSON配列ではありません")
+    pos = 1
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("バッファの終端", buffer, pos)
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("JSON配列が途中で切れています")
+            chunk = f.read(chunk_chars)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+def iter_records(file_path):
+    """
+    メタデータのシャード（JSON配列または JSONL）からレコードを1つずつ読み込む。
 
     Args:
-        file_path (str): 処理するJSONファイルのパス。
+        file_path (str): .json（配列）または .jsonl（1行1レコード）のファイルのパス。
+
+    Yields:
+        dict: 各レコード。
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        if file_path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+def count_shard(file_path):
+    """
+    1つのシャードのオブジェクトタグとシーンタグの出現回数を数える（プロセスプールのワーカーで実行）。
+
+    - 無視するタグの除外は行わない（キャッシュした結果を除外設定に依存させないため、結合時に除外する）。
+
+    Args:
+        file_path (str): シャードのパス。
 
     Returns:
-        None
+        dict: {"records": レコード数, "object_tags": {タグ: 回数}, "scene_tags": {タグ: 回数}}。
+    """
+    object_tags_counter = Counter()
+    scene_tags_counter = Counter()
+    records = 0
+    for item in iter_records(file_path):
+        object_tags_counter.update(item.get("object_tags", []))
+        scene_tags_counter.update(item.get("scene_tags", []))
+        records += 1
+    return {"records": records, "object_tags": dict(object_tags_counter), "scene_tags": dict(scene_tags_counter)}
+
+def list_shards(paths, exclude=()):
     """
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    指定したファイル・フォルダからメタデータのシャードを列挙する。
+
+    Args:
+        paths (list of str): ファイル、またはシャード (*.json, *.jsonl) を含むフォルダのパス。
+        exclude (iterable of str, optional): フォルダ内にあってもシャードとして扱わないファイル（キャッシュなど）。
+
+    Returns:
+        list of str: シャードのパスのリスト。
+    """
+    excluded = {os.path.abspath(path) for path in exclude}
+    shards = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, "*.json")) + glob.glob(os.path.join(path, "*.jsonl")))
+            shards.extend(shard for shard in found if os.path.abspath(shard) not in excluded)
+        else:
+            shards.append(path)
+    return shards
+
+def aggregate_tags(paths, cache_path=DEFAULT_CACHE, workers=None):
+    """
+    複数のシャードのタグの出現回数を集計し、無視するタグを除外して結合する。
+
+    - シャードごとの集計結果をキャッシュ（サイズ・更新時刻で変更を検出）し、新規・変更されたシャードのみを解析する。
+    - 解析はプロセスプールでシャード単位に並列に行う。
+    - キャッシュファイル自体はシャードとして扱わない。
+    - 解析できないシャードはエラーを表示して集計から除外し、残りのシャードの集計を続ける。
+
+    Args:
+        paths (list of str): シャードのパス、またはシャードを含むフォルダのパス。
+        cache_path (str or None, optional): キャッシュのJSONファイルのパス。None の場合はキャッシュしない。
+        workers (int, optional): ワーカープロセス数。デフォルトはCPU数。
+
+    Returns:
+        tuple: (オブジェクトタグの Counter, シーンタグの Counter)。
+    """
+    shards = list_shards(paths, exclude=[cache_path] if cache_path else ())
+    cache = Manifest(cache_path) if cache_path else None
+    keys = {shard: os.path.abspath(shard) for shard in shards}
+    pending = [shard for shard in shards if cache is None or not cache.is_current(keys[shard], shard)]
+
+    results = {}
+    failed = set()
+    if pending:
+        print(f"Parsing {len(pending)} of {len(shards)} shards")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(count_shard, shard): shard for shard in pending}
+            for future in as_completed(futures):
+                shard = futures[future]
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    print(f"エラー: {shard} の解析中に問題が発生しました: {e}")
+                    failed.add(shard)
+                    continue
+                results[shard] = counts
+                if cache is not None:
+                    cache.record(keys[shard], shard, **counts)
+        if cache is not None:
+            cache.save()
+        if failed:
+            print(f"{len(failed)} 個のシャードを集計から除外しました。")
 
     object_tags_counter = Counter()
     scene_tags_counter = Counter()
+    for shard in shards:
+        if shard in failed:
+            continue
+        counts = results.get(shard) or cache.entries[keys[shard]]
+        object_tags_counter.update(counts["object_tags"])
+        scene_tags_counter.update(counts["scene_tags"])
+
+    for tag in IGNORED_OBJECT_TAGS:
+        object_tags_counter.pop(tag, None)
+    for tag in IGNORED_SCENE_TAGS:
+        scene_tags_counter.pop(tag, None)
+    return object_tags_counter, scene_tags_counter
+
+def count_tags_and_plot(file_path, output_dir=None, cache_path=DEFAULT_CACHE, workers=None):
+    """
+    JSONファイルからオブジェクトタグとシーンタグの出現回数をカウントし、可視化する。
+
+    - JSONファイル内の `object_tags` と `scene_tags` を1レコードずつ読み込んで集計。
+    - 複数のシャード（JSON配列または JSONL）を指定した場合はプロセスプールで並列に集計して結合する。
+    - 事前に指定した無視するタグを除外。
+    - カウント結果を降順にソートし、棒グラフとしてプロット。
 
-    ignored_scene_tags = {
-        "indoor", "outdoor natural", "outdoor man-made", "shopping and dining", "workplace",
-        "home or hotel", "transportation", "water", "ice", "snow", "forest,field,jungle",
-        "sports field,parks,leisure spaces", "cultural or historical", "commercial buildings,shops,markets,cities,and towns",
-        "shopping and dining,great hall", "indoor, shopping and dining, great hall",
-        "houses,cabins,gardens,and farms", "water,ice,snow", "False"
-    }
-    ignored_object_tags = {"False"}
+    Args:
+        file_path (str or list of str): 処理するJSONファイル（シャード）またはフォルダのパス。
+        output_dir (str, optional): 指定した場合はグラフを表示せずにPNGファイルとして保存する。
+        cache_path (str or None, optional): シャードごとの集計結果のキャッシュのパス。
+        workers (int, optional): ワーカープロセス数。
 
-    for item in data:
-        object_tags = item.get("object_tags", [])
-        scene_tags = item.get("scene_tags", [])
+    Returns:
+        None
+    """
+    paths = [file_path] if isinstance(file_path, str) else list(file_path)
+    object_tags_counter, scene_tags_counter = aggregate_tags(paths, cache_path, workers)
+
+    sorted_object_tags = object_tags_counter.most_common()
+    sorted_scene_tags = scene_tags_counter.most_common()
 
-        object_tags_counter.update(tag for tag in object_tags if tag not in ignored_object_tags)
-        scene_tags_counter.update(tag for tag in scene_tags if tag not in ignored_scene_tags)
+    def chart_path(name):
+        return None if output_dir is None else os.path.join(output_dir, name)
 
-    sorted_object_tags = sorted(object_tags_counter.items(), key=lambda x: x[1], reverse=True)
-    sorted_scene_tags = sorted(scene_tags_counter.items(), key=lambda x: x[1], reverse=True)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
 
     if sorted_object_tags:
-        plot_bar_chart(sorted_object_tags, "Object Tags Count", "blue", step=1000)
+        plot_bar_chart(sorted_object_tags, "Object Tags Count", "blue", step=1000,
+                       output_path=chart_path("object_tags.png"))
 
     if sorted_scene_tags:
-        plot_bar_chart(sorted_scene_tags, "Scene Tags Count", "green", step=150)
+        plot_bar_chart(sorted_scene_tags, "Scene Tags Count", "green", step=150,
+                       output_path=chart_path("scene_tags.png"))
 
-def plot_bar_chart(sorted_tags, title, color, step=500):
+def plot_bar_chart(sorted_tags, title, color, step=500, output_path=None):
     """
     タグのカウント結果を横向きの棒グラフとして描画する。
 
@@ -56,36 +223,63 @@ def plot_bar_chart(sorted_tags, title, color, step=500):
         title (str): グラフのタイトル。
         color (str): 棒グラフの色（"blue" or "green"）。
         step (int, optional): X軸の目盛り間隔。デフォルトは500。
+        output_path (str, optional): 指定した場合は表示せずに画像ファイルとして保存する。
 
     Returns:
         None
     """
-    plt.figure(figsize=(6, len(sorted_tags) * 1.5))  
+    import matplotlib.pyplot as plt  # 重い依存関係のため、グラフを描画するときのみ読み込む
+
+    plt.figure(figsize=(6, len(sorted_tags) * 1.5))
     tags, counts = zip(*sorted_tags)
     plt.barh(tags, counts, color=color, height=0.5)
-    
+
     plt.title(title, fontsize=30, weight='bold')
     plt.xlabel("Count", fontsize=26, weight='bold')
     plt.ylabel("Tags", fontsize=26, weight='bold')
     plt.yticks(fontsize=18, weight='bold')
     plt.xticks(fontsize=20, weight='bold')
 
-    plt.gca().invert_yaxis()  
-    plt.xlim(0, max(counts) * 1.1)  
-    plt.xticks(range(0, int(max(counts) * 1.1) + 1, step), fontsize=20, weight='bold')  
+    plt.gca().invert_yaxis()
+    plt.xlim(0, max(counts) * 1.1)
+    plt.xticks(range(0, int(max(counts) * 1.1) + 1, step), fontsize=20, weight='bold')
 
-    plt.subplots_adjust(left=0.45)  
+    plt.subplots_adjust(left=0.45)
     plt.tight_layout()
-    plt.show()
+    if output_path is None:
+        plt.show()
+    else:
+        plt.savefig(output_path)
+        plt.close()
+        print(f"Chart saved: {output_path}")
 
-if __name__ == "__main__":
+def main(argv=None, prog=None):
     """
     メイン処理:
-    - JSONファイル `metadata.json` を解析し、オブジェクトタグとシーンタグを集計。
-    - 集計結果をグラフとして描画。
+    - JSONファイル（既定は `metadata.json`）またはシャードのフォルダを解析し、オブジェクトタグとシーンタグを集計。
+    - シャードごとの集計結果はキャッシュし、再実行時は新規・変更されたシャードのみ解析する。
+    - 集計結果をグラフとして描画（--output-dir を指定した場合は画像ファイルに保存）。
+
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py tags` から呼ばれる場合など）。
 
     Raises:
         FileNotFoundError: 指定したJSONファイルが存在しない場合にエラーメッセージを表示して終了する。
     """
-    file_path = "metadata.json"
-    count_tags_and_plot(file_path)
+    parser = argparse.ArgumentParser(prog=prog, description="メタデータのタグの出現回数を集計してグラフにする。")
+    parser.add_argument("paths", nargs="*", default=["metadata.json"],
+                        help="JSON / JSONL のシャード、またはそれらを含むフォルダ。")
+    parser.add_argument("--output-dir", help="グラフを表示せずにPNGファイルとして保存するフォルダ。")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="シャードごとの集計結果のキャッシュファイル。")
+    parser.add_argument("--no-cache", action="store_true", help="キャッシュを使用しない。")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数。")
+    args = parser.parse_args(argv)
+
+    if args.output_dir:
+        import matplotlib
+        matplotlib.use("Agg")
+    count_tags_and_plot(args.paths, args.output_dir, None if args.no_cache else args.cache, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import h5py
+from tqdm import tqdm
+from nh9reader import NH9Cube
+from pack12 import unpack12, packed_length
+from mainCUI import LAYOUTS, PARTIAL_SUFFIX, STATS_GROUP
+
+METHODS = ("exact", "hash")
+DEFAULT_BLOCK_ROWS = 64
+STATUSES = ("ok", "mismatch", "missing", "error")
+
+def archive_geometry(dataset):
+    """
+    データセットの属性と形状から、元のNH9ファイルのジオメトリを求める。
+
+    Args:
+        dataset (h5py.Dataset): `mainCUI.py` で保存したデータセット。
+
+    Returns:
+        tuple: (layout, packed, (height, width, bands))。
+
+    Raises:
+        ValueError: 保存形式・データ型・形状が `mainCUI.py` の出力として不正な場合。
+    """
+    layout = dataset.attrs.get("layout", "bil")
+    if isinstance(layout, bytes):
+        layout = layout.decode()
+    if layout not in LAYOUTS:
+        raise ValueError(f"不明な保存形式です: {layout}")
+    packed = dataset.attrs.get("packing") == "12bit"
+    if dataset.ndim != 3:
+        raise ValueError(f"データセットの次元数が不正です: {dataset.shape}")
+    if packed:
+        if dataset.dtype != np.uint8 or "unpacked_shape" not in dataset.attrs:
+            raise ValueError(f"12ビット詰めのデータセットのデータ型・属性が不正です: {dataset.dtype}")
+        shape = tuple(int(n) for n in dataset.attrs["unpacked_shape"])
+        if len(shape) != 3 or dataset.shape != shape[:-1] + (packed_length(shape[-1]),):
+            raise ValueError(f"12ビット詰めのデータセットの形状が不正です: {dataset.shape} (展開後 {shape})")
+    else:
+        if dataset.dtype != np.uint16:
+            raise ValueError(f"データ型が不正です: {dataset.dtype} (期待値 uint16)")
+        shape = dataset.shape
+    if layout == "bil":
+        height, bands, width = shape
+    else:
+        height, width, bands = shape
+    return layout, packed, (height, width, bands)
+
+def read_archive_region(dataset, packed, rows, axis1, axis2):
+    """
+    データセットの領域を読み込み、12ビット詰めの場合は展開する。
+
+    Args:
+        dataset (h5py.Dataset): 読み込むデータセット。
+        packed (bool): 最終軸が12ビット詰めか。
+        rows (tuple): 先頭軸の範囲 (開始, 終了)。
+        axis1 (tuple): 2番目の軸の範囲 (開始, 終了)。
+        axis2 (tuple): 最終軸の範囲 (開始, 終了)。展開後の座標で指定する（12ビット詰めの場合、開始は偶数）。
+
+    Returns:
+        numpy.ndarray: データセットの保存形式と同じ並びの uint16 配列。
+    """
+    if not packed:
+        return dataset[rows[0]:rows[1], axis1[0]:axis1[1], axis2[0]:axis2[1]]
+    start = axis2[0] // 2 * 3
+    data = dataset[rows[0]:rows[1], axis1[0]:axis1[1], start:packed_length(axis2[1])]
+    return unpack12(data, axis2[1] - axis2[0])
+
+def read_source_region(cube, layout, rows, axis1, axis2):
+    """
+    NH9ファイルから、データセットの座標で指定した領域を読み込む。
+
+    Args:
+        cube (NH9Cube): 元のNH9ファイル。
+        layout (str): データセットの保存形式 ("bil" または "hwc")。
+        rows (tuple): 行の範囲 (開始, 終了)。
+        axis1 (tuple): 2番目の軸（bil はバンド、hwc は列）の範囲 (開始, 終了)。
+        axis2 (tuple): 最終軸（bil は列、hwc はバンド）の範囲 (開始, 終了)。
+
+    Returns:
+        numpy.ndarray: データセットの保存形式と同じ並びの uint16 配列。
+    """
+    if layout == "bil":
+        return cube.read_rows(rows[0], rows[1], axis1[0], axis1[1])[:, :, axis2[0]:axis2[1]]
+    block = cube.read_rows(rows[0], rows[1], axis2[0], axis2[1])
+    return block[:, :, axis1[0]:axis1[1]].transpose(0, 2, 1)
+
+def chunk_grid(dataset, layout, packed, geometry):
+    """
+    データセットのチャンクの境界を、展開後の座標で返す。
+
+    Returns:
+        list of list: 各軸の [(開始, 終了)] のリスト（先頭軸、2番目の軸、最終軸の順）。
+    """
+    height, width, bands = geometry
+    shape = (height, bands, width) if layout == "bil" else (height, width, bands)
+    chunks = list(dataset.chunks or (DEFAULT_BLOCK_ROWS,) + shape[1:])
+    if packed:
+        chunks[2] = chunks[2] // 3 * 2
+    return [[(start, min(start + size, n)) for start in range(0, n, size)] for size, n in zip(chunks, shape)]
+
+def first_difference(source, archive, rows, axis1, axis2):
+    """
+    最初に値が異なる位置（データセットの座標）と、異なる値の個数を返す。
+    """
+    diff = source != archive
+    index = np.argwhere(diff)[0]
+    position = (rows[0] + int(index[0]), axis1[0] + int(index[1]), axis2[0] + int(index[2]))
+    return position, int(diff.sum())
+
+def verify_capture(nh9_path, hdf5_path, dataset_name, method="exact", sample=0, seed=0):
+    """
+    NH9ファイルとHDF5のデータセットが同じ値を持つかを、チャンク単位で読み込んで検証する
+    （プロセスプールのワーカーで実行）。
+
+    - 保存形式 (bil / hwc)・12ビット詰め・データ型・形状を属性から確認し、ジオメトリはデータセットの形状から求める。
+    - exact: チャンクの行 (先頭軸のチャンク1段) ずつ両方を読み込み、値を比較する。最初の不一致で終了する。
+    - hash: 両方を BIL の並びで BLAKE2b に通し、ダイジェストを比較する。元のNH9ファイルの
+      ダイジェスト (ファイル全体のバイト列と同じ) を記録できる。
+    - sample > 0 の場合は、ランダムに選んだ sample 個のチャンクのみを exact で比較する。
+    - 一度に読み込むのはチャンク1段分のみで、フレーム全体はメモリに載せない。
+
+    Args:
+        nh9_path (str): NH9ファイルのパス。
+        hdf5_path (str): HDF5ファイルのパス。
+        dataset_name (str): データセット名。
+        method (str, optional): "exact" または "hash"。
+        sample (int, optional): 比較するチャンク数。0 の場合は全体を比較する。
+        seed (int, optional): チャンクを選ぶ乱数シード。
+
+    Returns:
+        dict: source, archive, dataset, status ("ok", "mismatch", "missing", "error"), message,
+            checked（比較したチャンクまたはチャンク段の数）と、hash の場合は digest。
+    """
+    result = {"source": nh9_path, "archive": hdf5_path, "dataset": dataset_name, "status": "ok", "message": "",
+              "checked": 0}
+    if not os.path.exists(hdf5_path):
+        return dict(result, status="missing", message="HDF5ファイルがありません")
+    try:
+        with h5py.File(hdf5_path, "r") as hdf5_file:
+            if dataset_name not in hdf5_file:
+                partial = dataset_name + PARTIAL_SUFFIX in hdf5_file
+                return dict(result, status="missing",
+                            message="書き込み途中のデータセットのみがあります" if partial else "データセットがありません")
+            dataset = hdf5_file[dataset_name]
+            try:
+                layout, packed, geometry = archive_geometry(dataset)
+                cube = NH9Cube(nh9_path, *geometry)
+            except ValueError as e:
+                return dict(result, status="mismatch", message=str(e))
+            grid = chunk_grid(dataset, layout, packed, geometry)
+
+            if sample:
+                rng = np.random.default_rng(seed)
+                sizes = [len(axis) for axis in grid]
+                picks = rng.choice(int(np.prod(sizes)), size=min(sample, int(np.prod(sizes))), replace=False)
+                regions = [tuple(axis[i] for axis, i in zip(grid, np.unravel_index(p, sizes))) for p in picks]
+            else:
+                regions = [(rows, (0, grid[1][-1][1]), (0, grid[2][-1][1])) for rows in grid[0]]
+
+            if method == "hash":
+                source_digest = hashlib.blake2b(digest_size=16)
+                archive_digest = hashlib.blake2b(digest_size=16)
+                for rows, axis1, axis2 in regions:
+                    source_digest.update(cube.read_rows(rows[0], rows[1]))
+                    archive = read_archive_region(dataset, packed, rows, axis1, axis2)
+                    archive_digest.update(np.ascontiguousarray(archive.transpose(0, 2, 1) if layout == "hwc"
+                                                               else archive))
+                    result["checked"] += 1
+                result["digest"] = source_digest.hexdigest()
+                if archive_digest.hexdigest() != result["digest"]:
+                    return dict(result, status="mismatch",
+                                message=f"ダイジェストが一致しません: {archive_digest.hexdigest()}")
+                return result
+
+            for rows, axis1, axis2 in regions:
+                source = read_source_region(cube, layout, rows, axis1, axis2)
+                archive = read_archive_region(dataset, packed, rows, axis1, axis2)
+                result["checked"] += 1
+                if not np.array_equal(source, archive):
+                    position, count = first_difference(source, archive, rows, axis1, axis2)
+                    return dict(result, status="mismatch",
+                                message=f"{layout} の位置 {position} から値が異なります "
+                                        f"(チャンク {rows}, {axis1}, {axis2} 内の {count} 個)")
+            return result
+    except Exception as e:
+        return dict(result, status="error", message=str(e))
+
+def find_verify_jobs(date_folder_path, output_root):
+    """
+    日付フォルダのNH9ファイルと、`mainCUI.py` が出力したHDF5ファイル・データセットを対応付ける。
+
+    - 場所フォルダごとに「<場所フォルダ名>_<日付フォルダ名>.h5」の、拡張子を除いたファイル名のデータセットと対応する。
+
+    Args:
+        date_folder_path (str): 日付フォルダのパス。
+        output_root (str): HDF5ファイルを保存したルートフォルダ。
+
+    Returns:
+        list of tuple: [(NH9ファイルのパス, HDF5ファイルのパス, データセット名)]。
+    """
+    date_folder_name = os.path.basename(os.path.normpath(date_folder_path))
+    jobs = []
+    for location in sorted(os.listdir(date_folder_path)):
+        location_path = os.path.join(date_folder_path, location)
+        if not os.path.isdir(location_path):
+            continue
+        hdf5_path = os.path.join(output_root, f"{location}_{date_folder_name}.h5")
+        for nh9_file in sorted(f for f in os.listdir(location_path) if f.endswith(".nh9")):
+            jobs.append((os.path.join(location_path, nh9_file), hdf5_path, os.path.splitext(nh9_file)[0]))
+    return jobs
+
+def find_orphan_datasets(jobs):
+    """
+    HDF5ファイル内の、対応するNH9ファイルがないデータセットを返す（band_stats と書き込み途中のものは除く）。
+
+    Args:
+        jobs (list of tuple): `find_verify_jobs` の結果。
+
+    Returns:
+        list of str: 「<HDF5ファイルのパス>:<データセット名>」のリスト。
+    """
+    expected = {}
+    for _, hdf5_path, dataset_name in jobs:
+        expected.setdefault(hdf5_path, set()).add(dataset_name)
+    orphans = []
+    for hdf5_path, names in sorted(expected.items()):
+        if not os.path.exists(hdf5_path):
+            continue
+        with h5py.File(hdf5_path, "r") as hdf5_file:
+            for name, item in hdf5_file.items():
+                if (isinstance(item, h5py.Dataset) and name != STATS_GROUP and not name.endswith(PARTIAL_SUFFIX)
+                        and name not in names):
+                    orphans.append(f"{hdf5_path}:{name}")
+    return orphans
+
+def verify_date_folder(date_folder_path, output_root, method="exact", sample=0, seed=0, workers=None):
+    """
+    日付フォルダの全NH9ファイルを、対応するHDF5のデータセットとプロセスプールで並列に検証する。
+
+    Args:
+        date_folder_path (str): 日付フォルダのパス。
+        output_root (str): HDF5ファイルを保存したルートフォルダ。
+        method (str, optional): "exact" または "hash"。
+        sample (int, optional): ファイルごとに比較するチャンク数。0 の場合は全体を比較する。
+        seed (int, optional): チャンクを選ぶ乱数シード（ファイルごとにずらして使う）。
+        workers (int, optional): ワーカープロセス数。デフォルトはCPU数。
+
+    Returns:
+        list of dict: NH9ファイルの順の `verify_capture` の結果。
+    """
+    jobs = find_verify_jobs(date_folder_path, output_root)
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(verify_capture, *job, method, sample, seed + i): i for i, job in enumerate(jobs)}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Verifying", unit="file"):
+            i = futures[future]
+            results[i] = future.result()
+            if results[i]["status"] != "ok":
+                tqdm.write(f"エラー ({results[i]['status']}): {jobs[i][0]}: {results[i]['message']}")
+    return results
+
+def main(argv=None, prog=None):
+    """
+    `mainCUI.py` で変換したHDF5ファイルが、元のNH9ファイルと同じ値を保持しているかを検証する。
+
+    - NH9ファイルとデータセットをチャンク単位で読み込んで比較する（フレーム全体はメモリに載せない）。
+    - ファイル単位でプロセスプールで並列に処理し、ファイルごとの結果 (ok / mismatch / missing / error) を表示する。
+    - --sample N でファイルごとにランダムな N チャンクのみを比較する（簡易検証）。
+    - --method hash で元のNH9ファイルのダイジェストを --report に記録する。
+    - 全ファイルが ok でない場合は終了コード 1 で終了する。
+
+    Args:
+        argv (list of str, optional): コマンドライン引数。None の場合は sys.argv を使う。
+        prog (str, optional): ヘルプに表示するプログラム名（`hsi.py verify` から呼ばれる場合など）。
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="HDF5ファイルと元のNH9ファイルの値が一致するかを検証する。")
+    parser.add_argument("input_folder", help="元のNH9ファイルを含む日付フォルダのパス。")
+    parser.add_argument("output_folder", help="mainCUI.py でHDF5ファイルを保存したルートフォルダのパス。")
+    parser.add_argument("--method", choices=METHODS, default="exact",
+                        help="exact: 値を直接比較する, hash: BLAKE2b のダイジェストを比較し、レポートに記録する。")
+    parser.add_argument("--sample", type=int, default=0,
+                        help="ファイルごとにランダムに選んだ N チャンクのみを比較する（0 で全体を比較）。")
+    parser.add_argument("--seed", type=int, default=0, help="--sample のチャンクを選ぶ乱数シード。")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数。")
+    parser.add_argument("--report", help="ファイルごとの結果を書き出すJSONファイルのパス。")
+    args = parser.parse_args(argv)
+
+    if args.sample < 0:
+        parser.error("--sample は0以上を指定してください")
+    if args.sample and args.method == "hash":
+        parser.error("--sample は --method exact でのみ使用できます")
+    if not os.path.isdir(args.input_folder) or not os.path.isdir(args.output_folder):
+        parser.error("有効なフォルダパスを指定してください。")
+
+    results = verify_date_folder(args.input_folder, args.output_folder, args.method, args.sample, args.seed,
+                                 args.workers)
+    orphans = find_orphan_datasets(find_verify_jobs(args.input_folder, args.output_folder))
+    counts = {status: sum(r["status"] == status for r in results) for status in STATUSES}
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"input_folder": args.input_folder, "output_folder": args.output_folder,
+                       "method": args.method, "sample": args.sample, "seed": args.seed, "counts": counts,
+                       "results": results, "orphans": orphans}, f, ensure_ascii=False, indent=4)
+        print(f"Report saved to {args.report}")
+    for orphan in orphans:
+        print(f"警告: 対応するNH9ファイルがないデータセットです: {orphan}")
+    print(f"検証結果: {len(results)} ファイル中 " + ", ".join(f"{status} {n}" for status, n in counts.items()))
+    if counts["ok"] != len(results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()